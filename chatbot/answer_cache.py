@@ -0,0 +1,86 @@
+"""
+Semantic answer cache for the Flask app.
+
+A stored answer is reused when a past query with the same intent and
+personalization profile is close enough. The query embeddings live in one
+preallocated matrix, so a lookup is a single matrix-vector product; the lock is
+held only to snapshot the matching slots and to record the hit, never while
+scoring.
+"""
+import time
+from threading import Lock
+from typing import Dict, Optional
+
+import numpy as np
+
+class AnswerCache:
+    """
+    Fixed-capacity cache of answers keyed by normalized query embeddings.
+    Entries expire ttl seconds after they are stored; once every slot is taken
+    the least recently used entry is overwritten.
+    """
+    def __init__(self, capacity: int, dim: int, ttl: float, threshold: float):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.threshold = threshold
+        self.embeddings = np.zeros((capacity, dim), dtype="float32")
+        self.groups = np.full(capacity, -1, dtype="int64")  # (intent, profile) id of each slot, -1 when free
+        self.generations = np.zeros(capacity, dtype="int64")  # Bumped whenever a slot is overwritten
+        self.created_at = np.zeros(capacity)
+        self.last_used = np.zeros(capacity)
+        self.answers = [None] * capacity
+        self.group_ids: Dict[tuple, int] = {}
+        self.lock = Lock()
+        self.stats = {"hits": 0, "misses": 0, "bypassed": 0}
+
+    def lookup(self, query_embedding: np.ndarray, intent: str, profile: tuple) -> Optional[str]:
+        """Return the stored answer of the most similar past query with the same intent and profile"""
+        now = time.time()
+        with self.lock:
+            group = self.group_ids.get((intent, profile), -1)
+            slots = np.flatnonzero((self.groups == group) & (now - self.created_at <= self.ttl)) if group >= 0 else []
+            generations = self.generations[slots]
+
+        best_slot = None
+        if len(slots):
+            # Embeddings are normalized, so the dot product is the cosine similarity
+            scores = self.embeddings[slots] @ query_embedding[0]
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                best_slot, best_generation = int(slots[best]), generations[best]
+
+        with self.lock:
+            # The slot may have been overwritten while it was scored
+            if best_slot is not None and self.generations[best_slot] == best_generation:
+                self.last_used[best_slot] = now
+                self.stats["hits"] += 1
+                return self.answers[best_slot]
+            self.stats["misses"] += 1
+        return None
+
+    def store(self, query_embedding: np.ndarray, intent: str, profile: tuple, answer: str) -> None:
+        """Remember an answer in a free or expired slot, or in place of the least recently used one"""
+        if not self.capacity:
+            return
+        now = time.time()
+        with self.lock:
+            group = self.group_ids.setdefault((intent, profile), len(self.group_ids))
+            free = np.flatnonzero((self.groups < 0) | (now - self.created_at > self.ttl))
+            slot = int(free[0]) if len(free) else int(np.argmin(self.last_used))
+            self.generations[slot] += 1
+            self.embeddings[slot] = query_embedding[0]
+            self.groups[slot] = group
+            self.created_at[slot] = self.last_used[slot] = now
+            self.answers[slot] = answer
+
+    def record_bypass(self) -> None:
+        """Count a query that was not eligible for the cache"""
+        with self.lock:
+            self.stats["bypassed"] += 1
+
+    def get_stats(self) -> dict:
+        """Hit, miss and bypass counts with the number of live entries"""
+        now = time.time()
+        with self.lock:
+            size = int(np.count_nonzero((self.groups >= 0) & (now - self.created_at <= self.ttl)))
+            return dict(self.stats, size=size)
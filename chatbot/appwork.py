@@ -2,34 +2,52 @@ import json
 from flask import Flask, request, jsonify, render_template
 from flask_cors import CORS
 from flask_pymongo import PyMongo
-from bson import ObjectId
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, emit, join_room
 import groq
-import re
 import os
+import signal
+import fcntl
+import atexit
+import time
+import hashlib
+import sqlite3
+import mimetypes
 from dotenv import load_dotenv
-import base64
-from PyPDF2 import PdfReader
-import docx
 import faiss
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.messages import HumanMessage, AIMessage
 from werkzeug.utils import secure_filename
-from typing import Dict, List, Optional
+from werkzeug.exceptions import RequestEntityTooLarge
+from typing import Callable, Dict, Iterable, List, Optional
 import tempfile
-from threading import Lock
+from threading import Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import islice
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_groq import ChatGroq
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import Runnable, RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
-from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
 from pymongo.mongo_client import MongoClient
 
 load_dotenv()
 
+# Shared with the Telegram bots; imported after load_dotenv so they see .env settings
+from groq_http import GROQ_TIMEOUTS, create_groq_http_client, get_groq_stats
+from session_store import SESSION_MAX_BYTES, SESSION_MAX_COUNT, SESSION_TTL, SessionStore, SqliteSessionStore
+from chunking import Chunker
+from media import MediaTooLargeError, encode_data_url, get_image_stats, prepare_image
+from intents import IntentClassifier
+from ingestion import IngestionJobs, SqliteIngestionJobs, warm_parse_pool
+from session_cookie import get_cookie_session_id, get_session_id, init_session_cookie
+from answer_cache import AnswerCache
+from formatting import StreamingResponseCleaner, clean_response
+from summary_memory import SummaryMemory
+
 # Initialize Flask app with SocketIO
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "default-secret-key")
@@ -49,6 +67,28 @@ print("Successfully connected to MongoDB!")
 
 edudetails_collection = db.edudetails
 
+# Education profiles are cached in-process; lookups project only the fields the app uses
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", "300"))
+PROFILE_CACHE_MISS_TTL = int(os.getenv("PROFILE_CACHE_MISS_TTL", "30"))  # Users without a profile may be filling in the survey
+PROFILE_PROJECTION = {"_id": 0, "username": 1, "educationLevel": 1, "standard": 1, "codingLevel": 1, "strongLanguages": 1}
+profile_cache: "OrderedDict[str, tuple]" = OrderedDict()
+profile_cache_lock = Lock()
+profile_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+def check_username_index() -> None:
+    """Warn at startup when edudetails has no index on username, since every profile lookup filters on it"""
+    try:
+        indexes = edudetails_collection.index_information()
+        if any(info["key"][0][0] == "username" for info in indexes.values()):
+            print("edudetails.username is indexed")
+        else:
+            print("WARNING: edudetails has no index on username; profile lookups will scan the collection")
+    except Exception as e:
+        print("Could not check edudetails indexes:", e)
+
+check_username_index()
+
 
 @app.before_request
 def handle_options():
@@ -60,29 +100,128 @@ def handle_options():
         response.headers.add("Access-Control-Allow-Credentials", "true")
         return response
     
-socketio = SocketIO(app, cors_allowed_origins="*")
+# With several workers, set SOCKETIO_MESSAGE_QUEUE (e.g. a Redis URL) so events emitted by
+# background work reach clients connected to any worker
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=os.getenv("SOCKETIO_MESSAGE_QUEUE"))
+
+# Sessions are identified by a random id in a cookie (see session_cookie.py for SameSite/Secure)
+init_session_cookie(app)
+
+# Shared Groq HTTP layer: intent detection, chat, Whisper and vision calls all go through
+# one pooled keep-alive connection pool instead of separate HTTP stacks
+groq_http_client = create_groq_http_client()
 
 # Initialize Groq client
 groq_api_key = os.getenv("GROQ_API_KEY")
-client = groq.Client(api_key=groq_api_key) 
+client = groq.Client(api_key=groq_api_key, http_client=groq_http_client)
 
 # Initialize embedding model for RAG
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+# Per-owner vector indexes for uploaded documents (owner = session id from the cookie)
+EMBEDDING_DIM = 384
+document_indexes: Dict[str, "DocumentIndex"] = {}
+document_indexes_lock = Lock()
+
+# On-disk snapshots of each owner's index and chunk texts
+RAG_STORE_DIR = os.getenv("RAG_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rag_store"))
+RAG_SNAPSHOT_INTERVAL = int(os.getenv("RAG_SNAPSHOT_INTERVAL", "300"))
+
+# Owners start on an exact flat index and are promoted to an approximate
+# backend ("hnsw" or "ivf", or "flat" to never promote) once they pass the threshold.
+# Use index_report.py to pick these settings from a recall-vs-latency table.
+ANN_BACKEND = os.getenv("ANN_BACKEND", "hnsw")
+ANN_PROMOTION_THRESHOLD = int(os.getenv("ANN_PROMOTION_THRESHOLD", "20000"))
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))  # 0 picks 4 * sqrt(vector count)
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+index_rebuild_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-rebuild")
 
-# Global index and mapping for code documentation
-index = faiss.IndexFlatL2(384)
-id_to_text: Dict[int, str] = {}
-next_id = 0 
+# Number of chunks embedded per forward pass during ingestion
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
 
-# Session storage for conversation histories and processing locks
-session_histories: Dict[str, ChatMessageHistory] = {}
+# On-disk embedding cache keyed by a content hash of each chunk and the model name.
+# Rows unused for EMBEDDING_CACHE_TTL seconds, and the least recently used rows past
+# EMBEDDING_CACHE_MAX_ROWS, are deleted every EMBEDDING_CACHE_PRUNE_INTERVAL seconds (0 disables either limit)
+EMBEDDING_CACHE_FILE = os.getenv("EMBEDDING_CACHE_FILE", os.path.join(RAG_STORE_DIR, "embedding_cache.sqlite"))
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "500000"))
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", str(30 * 24 * 3600)))
+EMBEDDING_CACHE_PRUNE_INTERVAL = int(os.getenv("EMBEDDING_CACHE_PRUNE_INTERVAL", "3600"))
+embedding_cache_lock = Lock()
+embedding_cache_stats = {"hits": 0, "misses": 0, "pruned": 0}
+os.makedirs(os.path.dirname(EMBEDDING_CACHE_FILE) or ".", exist_ok=True)
+embedding_cache_db = sqlite3.connect(EMBEDDING_CACHE_FILE, check_same_thread=False)
+embedding_cache_db.execute("PRAGMA journal_mode=WAL")
+embedding_cache_db.execute(
+    "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL DEFAULT 0)"
+)
+if "last_used" not in [column[1] for column in embedding_cache_db.execute("PRAGMA table_info(embeddings)")]:
+    # Caches created before pruning existed; their rows start their TTL now
+    embedding_cache_db.execute("ALTER TABLE embeddings ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+    embedding_cache_db.execute("UPDATE embeddings SET last_used = ?", (time.time(),))
+embedding_cache_db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+embedding_cache_db.commit()
+
+# Query-side caches: embeddings of recent queries, and top-k results per index version
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "4096"))
+retrieval_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+retrieval_cache_lock = Lock()
+retrieval_cache_stats = {"hits": 0, "misses": 0}
+
+# Pre-built prompt | model | parser chains keyed by (prompt variant, personalization profile)
+CHAIN_CACHE_SIZE = int(os.getenv("CHAIN_CACHE_SIZE", "256"))
+chain_cache: "OrderedDict[tuple, Runnable]" = OrderedDict()
+chain_cache_lock = Lock()
+chain_cache_stats = {"hits": 0, "misses": 0}
+
+# Semantic answer cache: reuse a stored answer when a past query with the same intent
+# and personalization profile is close enough. Intents whose prompt replays the
+# session history are bypassed by default, since their answers depend on the session.
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2000"))  # 0 disables the cache
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_BYPASS_INTENTS = {
+    intent.strip() for intent in os.getenv(
+        "ANSWER_CACHE_BYPASS_INTENTS",
+        "code_explanation,code_generation,debug_help,optimization,code_review,learning_path"
+    ).split(",") if intent.strip()
+}
+answer_cache = AnswerCache(ANSWER_CACHE_SIZE, EMBEDDING_DIM, ANSWER_CACHE_TTL, ANSWER_CACHE_THRESHOLD)
+
+# Independent sub-queries of one message are answered concurrently on this pool
+SUBQUERY_WORKERS = int(os.getenv("SUBQUERY_WORKERS", "8"))
+subquery_executor = ThreadPoolExecutor(max_workers=SUBQUERY_WORKERS, thread_name_prefix="subquery")
+
+# Background ingestion jobs for uploaded documents
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+ingestion_executor = ThreadPoolExecutor(max_workers=INGESTION_WORKERS, thread_name_prefix="ingestion")
+
+# Session storage for conversation histories and processing locks (see session_store.py for the caps).
+# "memory" keeps histories in this process; "sqlite" shares them between worker processes through SESSION_DB_FILE
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DB_FILE = os.getenv("SESSION_DB_FILE", os.path.join(RAG_STORE_DIR, "sessions.sqlite"))
 session_locks: Dict[str, Lock] = {}
 
+# Requests of one session are answered in arrival order; at most SESSION_QUEUE_DEPTH may be in flight
+SESSION_QUEUE_DEPTH = int(os.getenv("SESSION_QUEUE_DEPTH", "4"))
+session_queue_depths: Dict[str, int] = {}
+session_locks_guard = Lock()
+session_queue_stats = {"completed": 0, "rejected": 0, "wait_total_ms": 0.0, "wait_max_ms": 0.0}
+
+class SessionBusyError(Exception):
+    """Raised when a session already has SESSION_QUEUE_DEPTH requests in flight"""
+
 # Initialize LangChain components
 chat_llm = ChatGroq(
     temperature=0.7,
     model_name="llama3-70b-8192",
-    groq_api_key=groq_api_key
+    groq_api_key=groq_api_key,
+    http_client=groq_http_client,
+    request_timeout=GROQ_TIMEOUTS["chat"]
 )
 
 # Supported file extensions
@@ -91,17 +230,71 @@ SUPPORTED_DOC_EXTENSIONS = {'.pdf', '.docx'}
 SUPPORTED_AUDIO_EXTENSIONS = {'.mp3', '.wav', '.m4a', '.ogg'}
 SUPPORTED_IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp'}
 
-def get_session_lock(session_id: str) -> Lock:
-    """Get or create processing lock for a session"""
-    if session_id not in session_locks:
-        session_locks[session_id] = Lock()
-    return session_locks[session_id]
+# Uploads are chunked on code or sentence boundaries by embedding-model token count (see chunking.py)
+chunker = Chunker(embedding_model.tokenizer, SUPPORTED_TEXT_EXTENSIONS - {'.txt'})
+
+# Request bodies past MAX_UPLOAD_BYTES are refused while they are still being received.
+# Audio and images are sent to Groq straight from the upload's buffer, within their own caps.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+MAX_AUDIO_BYTES = int(os.getenv("MAX_AUDIO_BYTES", str(25 * 1024 * 1024)))  # Groq's transcription file limit
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))  # Before downscaling
+VISION_MAX_PAYLOAD_BYTES = 3 * 1024 * 1024  # 4MB once base64-encoded, Groq's limit
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
+
+@contextmanager
+def session_turn(session_id: str):
+    """
+    Hold a session's processing lock for one request
+    The lock is dropped once no request of the session is running or waiting
+    """
+    with session_locks_guard:
+        depth = session_queue_depths.get(session_id, 0)
+        if depth >= SESSION_QUEUE_DEPTH:
+            session_queue_stats["rejected"] += 1
+            raise SessionBusyError(session_id)
+        session_queue_depths[session_id] = depth + 1
+        session_lock = session_locks.setdefault(session_id, Lock())
+    
+    start_time = time.perf_counter()
+    session_lock.acquire()
+    wait_ms = (time.perf_counter() - start_time) * 1000
+    try:
+        yield
+    finally:
+        session_lock.release()
+        with session_locks_guard:
+            session_queue_stats["completed"] += 1
+            session_queue_stats["wait_total_ms"] += wait_ms
+            session_queue_stats["wait_max_ms"] = max(session_queue_stats["wait_max_ms"], wait_ms)
+            session_queue_depths[session_id] -= 1
+            if not session_queue_depths[session_id]:
+                del session_queue_depths[session_id]
+                del session_locks[session_id]
+
+def get_session_queue_stats() -> dict:
+    """Queue-wait metrics of the per-session request ordering"""
+    with session_locks_guard:
+        completed = session_queue_stats["completed"]
+        return {
+            "active_sessions": len(session_queue_depths),
+            "queued": sum(session_queue_depths.values()),
+            "max_depth": SESSION_QUEUE_DEPTH,
+            "completed": completed,
+            "rejected": session_queue_stats["rejected"],
+            "wait_avg_ms": round(session_queue_stats["wait_total_ms"] / completed, 2) if completed else 0.0,
+            "wait_max_ms": round(session_queue_stats["wait_max_ms"], 2),
+        }
+
+if SESSION_BACKEND == "sqlite":
+    session_store = SqliteSessionStore(SESSION_DB_FILE, SESSION_MAX_COUNT, SESSION_MAX_BYTES, SESSION_TTL)
+else:
+    session_store = SessionStore(SESSION_MAX_COUNT, SESSION_MAX_BYTES, SESSION_TTL)
+# Recent turns are replayed within MEMORY_TOKEN_BUDGET, older ones as a running summary (see summary_memory.py)
+summary_memory = SummaryMemory(client, session_store)
 
 def get_session_history(session_id: str) -> ChatMessageHistory:
     """Get or create chat history for a session"""
-    if session_id not in session_histories:
-        session_histories[session_id] = ChatMessageHistory()
-    return session_histories[session_id]
+    return session_store.get(session_id)
 
 def get_personalized_prompt(user_details: dict, intent: str) -> str:
     """Generate personalized prompt based on user details"""
@@ -140,17 +333,15 @@ def get_personalized_prompt(user_details: dict, intent: str) -> str:
     
     return base_prompts.get(intent, base_prompts["default"])
 
-def get_conversation_chain(session_id: str, intent: str, user_details: dict = None) -> LLMChain:
-    """Create appropriate LangChain chain based on intent"""
-    history = get_session_history(session_id)
-    
-    # Common components
-    memory = ConversationBufferMemory(
-        return_messages=True,
-        memory_key="history",
-        chat_memory=history
-    )
-    
+def prompt_variant(intent: str) -> str:
+    """Name of the system prompt an intent uses; intents with the same variant share a chain"""
+    return intent if intent in ["greeting", "non_coding", "teaching"] else "default"
+
+def build_conversation_chain(intent: str, user_details: dict = None) -> Runnable:
+    """
+    Create appropriate LangChain chain based on intent
+    The chain takes "input" and "history"; callers commit the turn to session history themselves
+    """
     # Get personalized prompt
     prompt_template = get_personalized_prompt(user_details, intent)
     
@@ -167,255 +358,908 @@ def get_conversation_chain(session_id: str, intent: str, user_details: dict = No
             ("human", "{input}")
         ])
     
-    return LLMChain(
-        llm=chat_llm,
-        prompt=prompt,
-        memory=memory,
-        verbose=False
-    )
+    return prompt | chat_llm | StrOutputParser()
 
-def detect_intent_llm(text: str) -> List[Dict[str, str]]:
+def get_conversation_chain(intent: str, user_details: dict = None) -> Runnable:
     """
-    Detect intent of user query using Llama3-70b-8192
-    Returns list of detected intents and queries
+    Get the chain for an intent and user profile, building it on first use
+    Chains hold no session state, so one instance serves every session with the same profile
     """
-    prompt = [
-        {
-            "role": "system",
-            "content": (
-                "You are an AI that classifies user queries about programming and coding.\n"
-                "Classify the intent into one of these categories:\n"
-                "1. greeting - Simple greetings or small talk\n"
-                "2. code_explanation - Requests to explain code concepts or existing code\n"
-                "3. code_generation - Requests to write new code\n"
-                "4. debug_help - Requests to debug or fix code\n"
-                "5. optimization - Requests to optimize existing code\n"
-                "6. learning_path - Requests for learning resources or paths\n"
-                "7. code_review - Requests to review existing code\n"
-                "8. teaching - Requests to teach or explain programming concepts\n"
-                "9. non_coding - Anything not related to programming\n"
-                "10. if the user gives the code as input mark an code_explanation intent\n"
-                "11. dont forget to mark the intent as coding_explanation if the user gives the code as input\n"
-                "12. if the user gives a code as input, mark it as code_explanation\n"
-                "Reply in JSON format: [{\"query\": \"user message\", \"intent\": \"detected_intent\"}]\n"
-                "If the query contains multiple intents, split them into separate items."
-            )
-        },
-        {
-            "role": "user",
-            "content": f"User message: {text}"
-        }
-    ]
+    variant = prompt_variant(intent)
+    cache_key = (variant, profile_key(user_details))
+    with chain_cache_lock:
+        chain = chain_cache.get(cache_key)
+        if chain is not None:
+            chain_cache.move_to_end(cache_key)
+            chain_cache_stats["hits"] += 1
+            return chain
+        chain_cache_stats["misses"] += 1
+    
+    chain = build_conversation_chain(variant, user_details)
+    with chain_cache_lock:
+        chain_cache[cache_key] = chain
+        while len(chain_cache) > CHAIN_CACHE_SIZE:
+            chain_cache.popitem(last=False)
+    return chain
 
-    try:
-        response = client.chat.completions.create(
-            model="llama3-70b-8192",
-            messages=prompt,
-            response_format={"type": "json_object"},
-            temperature=0.2
-        )
+class DocumentIndex:
+    """Vector index, chunk texts and document membership for a single owner"""
+    
+    def __init__(self, owner: str):
+        self.owner = owner
+        self.index = faiss.IndexFlatL2(EMBEDDING_DIM)
+        self.chunks: List[str] = []
+        self.chunk_ids_by_key: Dict[str, int] = {}
+        self.document_ids: Dict[str, List[int]] = {}
+        self.lock = Lock()
+        self.dirty = False
+        self.read_only = False
+        self.version = 0  # Bumped on every change so cached search results can be invalidated
+        self.generation = 0  # Bumped when a merged snapshot renumbers the chunk ids
+        self.snapshot_stamp = None  # Identity of the on-disk snapshot this copy was last synced with
+        self.backend = "flat"
+        self.built_size = 0
+        self.rebuilding = False
+    
+    @property
+    def store_dir(self) -> str:
+        """Snapshot directory, named by a hash so any owner string is a safe path"""
+        return os.path.join(RAG_STORE_DIR, hashlib.sha256(self.owner.encode("utf-8")).hexdigest()[:32])
 
-        result = json.loads(response.choices[0].message.content)
-        if isinstance(result, dict):
-            result = [result]  # Convert single item to list
-        return result
+def get_document_index(owner: str, create: bool = True) -> Optional[DocumentIndex]:
+    """Get an owner's index, loading its snapshot on first use"""
+    with document_indexes_lock:
+        doc_index = document_indexes.get(owner)
+        if doc_index is None:
+            doc_index = load_document_index(owner)
+            if doc_index is None and create:
+                doc_index = DocumentIndex(owner)
+            if doc_index is not None:
+                document_indexes[owner] = doc_index
+        return doc_index
+
+def index_backend(index) -> str:
+    """Name of the backend a FAISS index implements"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSWFlat):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFFlat):
+        return "ivf"
+    return "flat"
+
+def configure_search(index) -> None:
+    """Apply the configured search-time accuracy knobs to an ANN index"""
+    backend = index_backend(index)
+    if backend == "hnsw":
+        faiss.downcast_index(index).hnsw.efSearch = HNSW_EF_SEARCH
+    elif backend == "ivf":
+        faiss.downcast_index(index).nprobe = IVF_NPROBE
+
+def build_ann_index(vectors: np.ndarray, backend: str):
+    """Build (and train, for IVF) an approximate index over the given vectors"""
+    if backend == "hnsw":
+        ann_index = faiss.IndexHNSWFlat(EMBEDDING_DIM, HNSW_M)
+        ann_index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    elif backend == "ivf":
+        nlist = IVF_NLIST or max(1, int(4 * np.sqrt(len(vectors))))
+        quantizer = faiss.IndexFlatL2(EMBEDDING_DIM)
+        ann_index = faiss.IndexIVFFlat(quantizer, EMBEDDING_DIM, nlist)
+        ann_index.train(vectors)
+        # Keep vectors reconstructable so the index can be retrained later
+        ann_index.make_direct_map()
+    else:
+        raise ValueError(f"Unknown ANN backend: {backend}")
+    ann_index.add(vectors)
+    configure_search(ann_index)
+    return ann_index
+
+def needs_rebuild(doc_index: DocumentIndex) -> bool:
+    """Whether an owner's index should be (re)built on the configured ANN backend"""
+    if ANN_BACKEND == "flat" or doc_index.rebuilding:
+        return False
+    total = doc_index.index.ntotal
+    if doc_index.backend == "flat":
+        return total >= ANN_PROMOTION_THRESHOLD
+    # IVF centroids go stale as the corpus grows, so retrain when it doubles
+    return doc_index.backend == "ivf" and total >= 2 * doc_index.built_size
+
+def rebuild_document_index(doc_index: DocumentIndex) -> None:
+    """Build an ANN index in the background and swap it in, catching up on vectors added meanwhile"""
+    try:
+        with doc_index.lock:
+            built_size = doc_index.index.ntotal
+            generation = doc_index.generation
+            vectors = doc_index.index.reconstruct_n(0, built_size)
+        
+        start_time = time.perf_counter()
+        ann_index = build_ann_index(vectors, ANN_BACKEND)
+        
+        with doc_index.lock:
+            if doc_index.generation != generation:
+                # Another worker's snapshot was merged in and the ids no longer match; the next upload retries
+                print(f"Discarded index rebuild for {doc_index.owner}: chunk ids changed meanwhile")
+                return
+            added = doc_index.index.ntotal - built_size
+            if added:
+                ann_index.add(doc_index.index.reconstruct_n(built_size, added))
+            doc_index.index = ann_index
+            doc_index.backend = ANN_BACKEND
+            doc_index.built_size = built_size
+            doc_index.read_only = False
+            doc_index.dirty = True
+            doc_index.version += 1
+        print(f"Rebuilt index for {doc_index.owner} as {ANN_BACKEND} over {built_size + added} vectors in {time.perf_counter() - start_time:.1f}s")
     except Exception as e:
-        print("Intent detection error:", e)
-        return [{"query": text, "intent": "non_coding"}]
-
-def clean_response(text: str) -> str:
-    """Clean and format the LLM response while preserving code blocks"""
-    # First protect code blocks during cleaning
-    protected_blocks = []
-    def protect(match):
-        protected_blocks.append(match.group(0))
-        return f"__PROTECTED_BLOCK_{len(protected_blocks)-1}__"
-    
-    # Protect code blocks
-    text = re.sub(r'```[\s\S]*?```', protect, text)
-    # Remove double quotes around the response
-    text = re.sub(r'^"(.*)"$', r'\1', text)
-    # Clean other formatting
-    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
-    text = re.sub(r'\*(.*?)\*', r'\1', text)
-    
-    # Restore protected code blocks
-    for i, block in enumerate(protected_blocks):
-        text = text.replace(f"__PROTECTED_BLOCK_{i}__", block)
-    
-    return text.strip()
-
-def store_and_index_text(text: str) -> None:
-    """Store text chunks in vector index"""
-    global next_id
-    chunks = [text[i:i+500] for i in range(0, len(text), 500)]
-    
-    for chunk in chunks:
-        embedding = embedding_model.encode(chunk, normalize_embeddings=True).astype("float32")
-        index.add(np.array([embedding]))
-        id_to_text[next_id] = chunk
-        next_id += 1
-
-def retrieve_relevant_text(query: str, top_k: int = 3) -> Optional[str]:
-    """Retrieve relevant text chunks using RAG"""
-    if next_id == 0:  # No documents indexed
+        print(f"Index rebuild error for {doc_index.owner}: {str(e)}")
+    finally:
+        doc_index.rebuilding = False
+
+def search_params(doc_index: DocumentIndex, ids: Optional[List[int]] = None):
+    """Search parameters for the owner's backend, restricted to the given chunk ids if any"""
+    if ids is None:
         return None
+    selector = faiss.IDSelectorBatch(np.array(ids, dtype="int64"))
+    if doc_index.backend == "hnsw":
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=HNSW_EF_SEARCH)
+    if doc_index.backend == "ivf":
+        return faiss.SearchParametersIVF(sel=selector, nprobe=IVF_NPROBE)
+    return faiss.SearchParameters(sel=selector)
+
+def ensure_writable_index(doc_index: DocumentIndex) -> None:
+    """Copy a memory-mapped flat snapshot into process memory before the first write"""
+    if doc_index.read_only:
+        # clone_index would copy the mapping itself, which FAISS refuses to grow
+        index = faiss.IndexFlatL2(EMBEDDING_DIM)
+        index.add(doc_index.index.reconstruct_n(0, doc_index.index.ntotal))
+        doc_index.index = index
+        doc_index.read_only = False
+
+def chunk_key(chunk: str) -> str:
+    """Content address of a chunk's embedding under the current model"""
+    return hashlib.sha256(f"{EMBEDDING_MODEL_NAME}\0{chunk}".encode("utf-8")).hexdigest()
+
+def embed_chunks(chunks: List[str], keys: List[str]) -> np.ndarray:
+    """Embed chunks, reusing cached vectors and only running the encoder on unseen content"""
+    placeholders = ",".join("?" * len(keys))
+    with embedding_cache_lock:
+        rows = embedding_cache_db.execute(
+            f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", keys
+        ).fetchall()
+        if rows:
+            embedding_cache_db.execute(
+                f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})", [time.time()] + keys
+            )
+            embedding_cache_db.commit()
+    cached = {key: np.frombuffer(vector, dtype="float32") for key, vector in rows}
+    
+    embeddings = np.empty((len(chunks), EMBEDDING_DIM), dtype="float32")
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+    for i, key in enumerate(keys):
+        if key in cached:
+            embeddings[i] = cached[key]
+    
+    if missing:
+        embeddings[missing] = embedding_model.encode(
+            [chunks[i] for i in missing],
+            batch_size=EMBEDDING_BATCH_SIZE,
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        ).astype("float32")
+        with embedding_cache_lock:
+            embedding_cache_db.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(keys[i], embeddings[i].tobytes(), time.time()) for i in missing]
+            )
+            embedding_cache_db.commit()
+    
+    with embedding_cache_lock:
+        embedding_cache_stats["hits"] += len(chunks) - len(missing)
+        embedding_cache_stats["misses"] += len(missing)
+    return embeddings
+
+def prune_embedding_cache() -> int:
+    """Delete cached embeddings past EMBEDDING_CACHE_TTL or beyond EMBEDDING_CACHE_MAX_ROWS; returns the rows removed"""
+    with embedding_cache_lock:
+        pruned = 0
+        if EMBEDDING_CACHE_TTL > 0:
+            pruned += embedding_cache_db.execute(
+                "DELETE FROM embeddings WHERE last_used < ?", (time.time() - EMBEDDING_CACHE_TTL,)
+            ).rowcount
+        if EMBEDDING_CACHE_MAX_ROWS > 0:
+            pruned += embedding_cache_db.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (EMBEDDING_CACHE_MAX_ROWS,)
+            ).rowcount
+        embedding_cache_db.commit()
+        embedding_cache_stats["pruned"] += pruned
+    return pruned
+
+def prune_embedding_cache_periodically() -> None:
+    """Background loop that prunes the embedding cache every EMBEDDING_CACHE_PRUNE_INTERVAL seconds"""
+    while True:
+        time.sleep(EMBEDDING_CACHE_PRUNE_INTERVAL)
+        try:
+            pruned = prune_embedding_cache()
+            if pruned:
+                print(f"Pruned {pruned} cached embeddings")
+        except Exception as e:
+            print(f"Embedding cache prune error: {str(e)}")
+
+def store_and_index_chunks(chunks: Iterable[str], owner: str, document: str, on_progress: Optional[Callable[[int, Optional[int]], None]] = None) -> int:
+    """Embed chunks into the owner's vector index as they arrive, one batch at a time, skipping duplicates"""
+    chunks = iter(chunks)
+    doc_index = None
+    start_time = time.perf_counter()
+    embedded = 0
+    added = 0
+    while batch := list(islice(chunks, EMBEDDING_BATCH_SIZE)):
+        if doc_index is None:
+            doc_index = get_document_index(owner)
+        keys = [chunk_key(chunk) for chunk in batch]
+        
+        # Chunks the owner already has are only linked to this document
+        new_chunks = {}
+        with doc_index.lock:
+            ids = doc_index.document_ids.setdefault(document, [])
+            linked = set(ids)
+            for chunk, key in zip(batch, keys):
+                existing_id = doc_index.chunk_ids_by_key.get(key)
+                if existing_id is not None:
+                    if existing_id not in linked:
+                        ids.append(existing_id)
+                        linked.add(existing_id)
+                        doc_index.dirty = True
+                        doc_index.version += 1
+                elif key not in new_chunks:
+                    new_chunks[key] = chunk
         
+        if new_chunks:
+            new_keys = list(new_chunks)
+            embeddings = embed_chunks([new_chunks[key] for key in new_keys], new_keys)
+            with doc_index.lock:
+                # Another upload may have added some of these while we were embedding, and a
+                # merged snapshot may have renumbered the document's chunks
+                ids = doc_index.document_ids.setdefault(document, [])
+                linked = set(ids)
+                fresh = [i for i, key in enumerate(new_keys) if key not in doc_index.chunk_ids_by_key]
+                if fresh:
+                    ensure_writable_index(doc_index)
+                    doc_index.index.add(embeddings[fresh])
+                    for i in fresh:
+                        doc_index.chunk_ids_by_key[new_keys[i]] = len(doc_index.chunks)
+                        doc_index.chunks.append(new_chunks[new_keys[i]])
+                    doc_index.dirty = True
+                    doc_index.version += 1
+                    added += len(fresh)
+                for key in new_keys:
+                    chunk_id = doc_index.chunk_ids_by_key[key]
+                    if chunk_id not in linked:
+                        ids.append(chunk_id)
+                        linked.add(chunk_id)
+        embedded += len(batch)
+        # The total is unknown until the document has been read to the end
+        if on_progress:
+            on_progress(embedded, None)
+    
+    if doc_index is None:
+        return 0
+    if on_progress:
+        on_progress(embedded, embedded)
+    with doc_index.lock:
+        rebuild = needs_rebuild(doc_index)
+        if rebuild:
+            doc_index.rebuilding = True
+    if rebuild:
+        index_rebuild_executor.submit(rebuild_document_index, doc_index)
+    # Snapshot right away so the other workers pick the upload up on their next search
+    save_document_index(doc_index)
+    
+    elapsed = max(time.perf_counter() - start_time, 1e-6)
+    print(f"Indexed {embedded} chunks in {elapsed:.2f}s ({embedded / elapsed:.1f} chunks/s, {embedded - added} duplicates skipped)")
+    return added
+
+@lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)
+def encode_query(query: str) -> np.ndarray:
+    """Embed a query, memoised so repeated queries skip the encoder"""
     query_embedding = embedding_model.encode(query, normalize_embeddings=True).reshape(1, -1).astype("float32")
-    distances, indices = index.search(query_embedding, top_k)
-    retrieved = [id_to_text.get(i, "") for i in indices[0] if i >= 0]
-    return "\n".join(retrieved) if retrieved else None
+    # Shared between callers through the cache, so it must never be modified
+    query_embedding.flags.writeable = False
+    return query_embedding
+
+# Confident single-sentence messages are classified in-process, the rest by the LLM (see intents.py)
+intent_classifier = IntentClassifier(client, embedding_model, encode_query)
 
-def extract_text_from_file(file) -> str:
-    """Extract text from various file types"""
-    filename = secure_filename(file.filename)
-    ext = os.path.splitext(filename)[1].lower()
+def retrieve_relevant_text(query: str, owner: str, document: Optional[str] = None, top_k: int = 3) -> Optional[str]:
+    """Retrieve relevant text chunks from the owner's documents, optionally from one document only"""
+    doc_index = get_document_index(owner, create=False)
+    if doc_index is None:
+        return None
+    sync_document_index(doc_index)
+    if not doc_index.chunks:  # No documents indexed
+        return None
+    
+    # Results stay valid until the owner's index changes
+    cache_key = (owner, document, query, top_k)
+    with retrieval_cache_lock:
+        cached = retrieval_cache.get(cache_key)
+        if cached is not None and cached[0] == doc_index.version:
+            retrieval_cache.move_to_end(cache_key)
+            retrieval_cache_stats["hits"] += 1
+            return cached[1]
+        retrieval_cache_stats["misses"] += 1
     
+    query_embedding = encode_query(query)
+    with doc_index.lock:
+        version = doc_index.version
+        ids = None
+        if document:
+            ids = doc_index.document_ids.get(document)
+            if not ids:
+                return None
+        params = search_params(doc_index, ids)
+        distances, indices = doc_index.index.search(query_embedding, top_k, params=params)
+        retrieved = [doc_index.chunks[i] for i in indices[0] if i >= 0]
+    result = "\n".join(retrieved) if retrieved else None
+    
+    with retrieval_cache_lock:
+        retrieval_cache[cache_key] = (version, result)
+        retrieval_cache.move_to_end(cache_key)
+        while len(retrieval_cache) > RETRIEVAL_CACHE_SIZE:
+            retrieval_cache.popitem(last=False)
+    return result
+
+def get_cache_stats() -> dict:
+    """Hit/miss counters for the embedding, query, retrieval, chain, profile and answer caches"""
+    query_info = encode_query.cache_info()
+    with embedding_cache_lock:
+        embedding_stats = dict(embedding_cache_stats)
+    with retrieval_cache_lock:
+        retrieval_stats = dict(retrieval_cache_stats, size=len(retrieval_cache))
+    with chain_cache_lock:
+        chain_stats = dict(chain_cache_stats, size=len(chain_cache))
+    with profile_cache_lock:
+        profile_stats = dict(profile_cache_stats, size=len(profile_cache))
+    answer_stats = answer_cache.get_stats()
+    return {
+        "chunk_embeddings": embedding_stats,
+        "query_embeddings": {
+            "hits": query_info.hits,
+            "misses": query_info.misses,
+            "size": query_info.currsize
+        },
+        "retrieval_results": retrieval_stats,
+        "chains": chain_stats,
+        "profiles": profile_stats,
+        "answers": answer_stats
+    }
+
+@contextmanager
+def snapshot_lock(store_dir: str, exclusive: bool):
+    """
+    Lock an owner's snapshot across worker processes: one writer at a time, and
+    readers never see the chunk list of one writer with the index of another
+    """
+    with open(os.path.join(store_dir, "snapshot.lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield  # Released when the file is closed
+
+def snapshot_stamp(store_dir: str) -> Optional[tuple]:
+    """Identity of an owner's snapshot on disk; every save renames a new chunk list into place"""
     try:
-        if ext in SUPPORTED_TEXT_EXTENSIONS:
-            return file.read().decode('utf-8')
-        elif ext == '.pdf':
-            reader = PdfReader(file)
-            return "\n".join(page.extract_text() for page in reader.pages if page.extract_text())
-        elif ext == '.docx':
-            doc = docx.Document(file)
-            return "\n".join([para.text for para in doc.paragraphs])
-        else:
-            raise ValueError(f"Unsupported file type: {ext}")
+        stat = os.stat(os.path.join(store_dir, "chunks.json"))
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def read_snapshot(store_dir: str) -> Optional[tuple]:
+    """
+    Read an owner's snapshot as (index, chunks, document_ids, read_only, stamp); caller
+    holds snapshot_lock. Flat indexes are memory-mapped in place so workers share their
+    pages until the first write; HNSW and IVF indexes are loaded into each worker's own
+    memory, since FAISS can't add to a mapped one
+    """
+    index_file = os.path.join(store_dir, "index.faiss")
+    chunks_file = os.path.join(store_dir, "chunks.json")
+    if not (os.path.exists(index_file) and os.path.exists(chunks_file)):
+        return None
+    
+    read_only = False
+    try:
+        loaded_index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP_IFC)
+        read_only = index_backend(loaded_index) == "flat"
+    except RuntimeError:
+        loaded_index = None
+    if not read_only:
+        # Not mappable, or an ANN index that will be added to; load a private copy
+        loaded_index = faiss.read_index(index_file)
+    with open(chunks_file, "r", encoding="utf-8") as f:
+        snapshot = json.load(f)
+    
+    total = loaded_index.ntotal
+    if len(snapshot["chunks"]) < total:
+        raise ValueError(f"{total} vectors but only {len(snapshot['chunks'])} chunks")
+    if "document_ids" in snapshot:
+        document_ids = {
+            document: [chunk_id for chunk_id in ids if chunk_id < total]
+            for document, ids in snapshot["document_ids"].items()
+        }
+    else:
+        # Older snapshots stored one document name per chunk
+        document_ids = {}
+        for chunk_id, document in enumerate(snapshot["documents"][:total]):
+            document_ids.setdefault(document, []).append(chunk_id)
+    return loaded_index, snapshot["chunks"][:total], document_ids, read_only, snapshot_stamp(store_dir)
+
+def apply_snapshot(doc_index: DocumentIndex, snapshot: tuple) -> None:
+    """
+    Replace an owner's in-memory index with a snapshot from disk, then add back the
+    chunks and document links that only this worker has; caller holds doc_index.lock.
+    Chunks are only ever appended, so the union loses nothing either side wrote
+    """
+    loaded_index, chunks, document_ids, read_only, stamp = snapshot
+    chunk_ids_by_key = {chunk_key(chunk): chunk_id for chunk_id, chunk in enumerate(chunks)}
+    local_keys = [None] * len(doc_index.chunks)
+    for key, chunk_id in doc_index.chunk_ids_by_key.items():
+        local_keys[chunk_id] = key
+    extra_ids = [chunk_id for chunk_id, key in enumerate(local_keys) if key not in chunk_ids_by_key]
+    extra_vectors = np.stack([doc_index.index.reconstruct(chunk_id) for chunk_id in extra_ids]) if extra_ids else None
+    local_chunks, local_document_ids = doc_index.chunks, doc_index.document_ids
+    
+    configure_search(loaded_index)
+    doc_index.index = loaded_index
+    doc_index.read_only = read_only
+    doc_index.backend = index_backend(loaded_index)
+    doc_index.built_size = loaded_index.ntotal
+    doc_index.chunks = list(chunks)
+    doc_index.chunk_ids_by_key = chunk_ids_by_key
+    doc_index.document_ids = document_ids
+    changed = bool(extra_ids)
+    if extra_ids:
+        ensure_writable_index(doc_index)
+        doc_index.index.add(extra_vectors)
+        for chunk_id in extra_ids:
+            chunk_ids_by_key[local_keys[chunk_id]] = len(doc_index.chunks)
+            doc_index.chunks.append(local_chunks[chunk_id])
+    for document, ids in local_document_ids.items():
+        merged_ids = document_ids.setdefault(document, [])
+        linked = set(merged_ids)
+        for chunk_id in ids:
+            merged_id = chunk_ids_by_key[local_keys[chunk_id]]
+            if merged_id not in linked:
+                merged_ids.append(merged_id)
+                linked.add(merged_id)
+                changed = True
+    doc_index.snapshot_stamp = stamp
+    doc_index.dirty = changed
+    doc_index.version += 1
+    doc_index.generation += 1
+
+def sync_document_index(doc_index: DocumentIndex) -> None:
+    """Merge in a newer snapshot another worker saved for this owner since we last loaded or saved it"""
+    stamp = snapshot_stamp(doc_index.store_dir)
+    if stamp is None or stamp == doc_index.snapshot_stamp:
+        return
+    with doc_index.lock:
+        if snapshot_stamp(doc_index.store_dir) == doc_index.snapshot_stamp:
+            return
+        try:
+            with snapshot_lock(doc_index.store_dir, exclusive=False):
+                snapshot = read_snapshot(doc_index.store_dir)
+        except Exception as e:
+            print(f"Could not reload document index from {doc_index.store_dir}: {str(e)}")
+            return
+        if snapshot is not None:
+            apply_snapshot(doc_index, snapshot)
+
+def save_document_index(doc_index: DocumentIndex) -> None:
+    """Snapshot one owner's index and chunk texts to disk if anything changed"""
+    with doc_index.lock:
+        if not doc_index.dirty:
+            return
+        os.makedirs(doc_index.store_dir, exist_ok=True)
+        index_file = os.path.join(doc_index.store_dir, "index.faiss")
+        chunks_file = os.path.join(doc_index.store_dir, "chunks.json")
+        # Files are written under a per-process name and renamed into place, so a worker
+        # that has the old index memory-mapped keeps reading the file it opened
+        suffix = f".{os.getpid()}.tmp"
+        with snapshot_lock(doc_index.store_dir, exclusive=True):
+            # Another worker saved this owner since we last synced; merge its chunks in
+            # first so neither worker's uploads are overwritten
+            if snapshot_stamp(doc_index.store_dir) not in (None, doc_index.snapshot_stamp):
+                apply_snapshot(doc_index, read_snapshot(doc_index.store_dir))
+            # Chunks are written first: they are append-only, so a crash between
+            # the two renames leaves a chunk list that is a superset of the index
+            with open(chunks_file + suffix, "w", encoding="utf-8") as f:
+                json.dump({
+                    "owner": doc_index.owner,
+                    "chunks": doc_index.chunks,
+                    "document_ids": doc_index.document_ids
+                }, f)
+            os.replace(chunks_file + suffix, chunks_file)
+            faiss.write_index(doc_index.index, index_file + suffix)
+            os.replace(index_file + suffix, index_file)
+            doc_index.snapshot_stamp = snapshot_stamp(doc_index.store_dir)
+        doc_index.dirty = False
+
+def save_document_store() -> None:
+    """Snapshot every owner's index that changed since the last snapshot"""
+    with document_indexes_lock:
+        doc_indexes = list(document_indexes.values())
+    saved = 0
+    for doc_index in doc_indexes:
+        if doc_index.dirty:
+            save_document_index(doc_index)
+            saved += 1
+    if saved:
+        print(f"Saved {saved} document index snapshot(s) to {RAG_STORE_DIR}")
+
+def load_document_index(owner: str) -> Optional[DocumentIndex]:
+    """Load an owner's snapshot, or None when there is none"""
+    doc_index = DocumentIndex(owner)
+    try:
+        with snapshot_lock(doc_index.store_dir, exclusive=False):
+            snapshot = read_snapshot(doc_index.store_dir)
+    except FileNotFoundError:
+        return None
     except Exception as e:
-        print(f"Error extracting text from {filename}: {str(e)}")
-        raise
+        print(f"Could not load document index from {doc_index.store_dir}: {str(e)}")
+        return None
+    if snapshot is None:
+        return None
+    apply_snapshot(doc_index, snapshot)
+    return doc_index
+
+def snapshot_document_store_periodically() -> None:
+    """Background loop that snapshots the document store every RAG_SNAPSHOT_INTERVAL seconds"""
+    while True:
+        time.sleep(RAG_SNAPSHOT_INTERVAL)
+        try:
+            save_document_store()
+        except Exception as e:
+            print(f"Document store snapshot error: {str(e)}")
+
+def handle_sigterm(signum, frame):
+    """Snapshot the document store before the process is stopped"""
+    save_document_store()
+    raise SystemExit(0)
+
+# Parsing runs on the process pool in ingestion.py; chunking and embedding on ingestion_executor.
+# Job records follow SESSION_BACKEND: "sqlite" lets /api/ingest/<job_id> be polled through any worker,
+# while "memory" keeps them in the worker that took the upload, which then needs sticky sessions
+if SESSION_BACKEND == "sqlite":
+    ingestion_jobs = SqliteIngestionJobs(SESSION_DB_FILE, chunker, store_and_index_chunks, SUPPORTED_TEXT_EXTENSIONS)
+else:
+    ingestion_jobs = IngestionJobs(chunker, store_and_index_chunks, SUPPORTED_TEXT_EXTENSIONS)
+
+def submit_ingestion_job(filename: str, file_path: str, owner: str, query: Optional[str] = None,
+                         user_details: Optional[dict] = None, document: Optional[str] = None) -> dict:
+    """
+    Queue a document for background ingestion into the owner's index and return its job record
+    A question sent with the upload is answered from it once it is indexed (see run_ingestion_job)
+    """
+    job = ingestion_jobs.create(filename, owner=owner, query=query or None, answer=None)
+    ingestion_executor.submit(run_ingestion_job, job["job_id"], file_path, owner, user_details, document or filename)
+    return job
+
+def run_ingestion_job(job_id: str, file_path: str, owner: str, user_details: Optional[dict], document: str) -> None:
+    """
+    Ingest an upload, then answer the question sent with it
+    The answer is stored on the job record for /api/ingest/<job_id> and emitted to the owner's
+    SocketIO room as ingest_done, together with the job's final status
+    """
+    ingestion_jobs.run(job_id, file_path, owner)
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        return
+    if job["query"]:
+        if job["status"] != "done":
+            answer = "❌ Failed to process the document. Please try again."
+        else:
+            try:
+                answer = answer_detected_intent(job["query"], owner, user_details, owner, document)
+            except SessionBusyError:
+                answer = "⏳ Still answering your previous messages. Please ask about the document again."
+            except Exception as e:
+                print(f"Upload question error: {str(e)}")
+                answer = "❌ An error occurred while answering your question about the document."
+        ingestion_jobs.update(job_id, answer=answer)
+        job["answer"] = answer
+    socketio.emit("ingest_done", {
+        "job_id": job_id,
+        "status": job["status"],
+        "filename": job["filename"],
+        "response": job["answer"]
+    }, to=owner)
+
+def upload_size(file, max_bytes: int) -> int:
+    """Size of an upload's buffered stream, rejected past max_bytes without reading it"""
+    size = file.stream.seek(0, os.SEEK_END)
+    file.stream.seek(0)
+    if size > max_bytes:
+        raise MediaTooLargeError(f"{file.filename} is {size} bytes, over the {max_bytes} byte limit")
+    return size
 
 def process_audio_file(file) -> str:
     """Transcribe audio file using Groq's Whisper API"""
     try:
-        # Save to temp file with proper extension
-        temp_ext = '.webm'  # Default for recorded audio
-        if file.filename:
-            ext = os.path.splitext(secure_filename(file.filename))[1].lower()
-            if ext in SUPPORTED_AUDIO_EXTENSIONS:
-                temp_ext = ext
-                
-        with tempfile.NamedTemporaryFile(suffix=temp_ext, delete=False) as temp:
-            file.save(temp.name)
-            
-            with open(temp.name, "rb") as audio_file:
-                transcription = client.audio.transcriptions.create(
-                    file=(temp.name, audio_file.read()),
-                    model="whisper-large-v3-turbo",
-                    response_format="text",
-                    language="en",
-                )
-                return str(transcription)
+        # Whisper picks the decoder from the file name's extension
+        ext = os.path.splitext(secure_filename(file.filename or ""))[1].lower()
+        filename = f"audio{ext if ext in SUPPORTED_AUDIO_EXTENSIONS else '.webm'}"  # Default for recorded audio
+        upload_size(file, MAX_AUDIO_BYTES)
+        
+        transcription = client.audio.transcriptions.create(
+            file=(filename, file.stream),
+            model="whisper-large-v3-turbo",
+            response_format="text",
+            language="en",
+            timeout=GROQ_TIMEOUTS["transcription"]
+        )
+        return str(transcription)
     except Exception as e:
         print(f"Audio transcription error: {str(e)}")
         raise
-    finally:
-        if 'temp' in locals() and temp and os.path.exists(temp.name):
-            os.unlink(temp.name)
 
 def process_image_file(file) -> str:
     """Extract text/description from image using Llama-4-Scout"""
     try:
-        # Save to temp file
-        ext = os.path.splitext(file.filename)[1].lower()
-        with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as temp:
-            file.save(temp.name)
-            
-            with open(temp.name, "rb") as img_file:
-                image_data = base64.b64encode(img_file.read()).decode('utf-8')
-                
-                response = client.chat.completions.create(
-                    model="meta-llama/llama-4-scout-17b-16e-instruct",
-                    messages=[
+        size = upload_size(file, MAX_IMAGE_BYTES)
+        mime_type = mimetypes.guess_type(secure_filename(file.filename))[0] or "image/jpeg"
+        stream, size, mime_type = prepare_image(file.stream, size, mime_type)
+        if size > VISION_MAX_PAYLOAD_BYTES:
+            raise MediaTooLargeError(f"{file.filename} is still {size} bytes after preprocessing")
+        image_url = encode_data_url(stream, size, mime_type)
+        
+        response = client.chat.completions.create(
+            model="meta-llama/llama-4-scout-17b-16e-instruct",
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are an AI that can analyze images. Describe the image content in detail, focusing on any text or code present."
+                },
+                {
+                    "role": "user",
+                    "content": [
                         {
-                            "role": "system",
-                            "content": "You are an AI that can analyze images. Describe the image content in detail, focusing on any text or code present."
+                            "type": "image_url",
+                            "image_url": image_url
                         },
                         {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "image_url",
-                                    "image_url": f"data:image/{ext[1:]};base64,{image_data}"
-                                },
-                                {
-                                    "type": "text",
-                                    "text": "Describe this image in detail, especially any text or code content."
-                                }
-                            ]
+                            "type": "text",
+                            "text": "Describe this image in detail, especially any text or code content."
                         }
-                    ],
-                    max_tokens=1000
-                )
-                return response.choices[0].message.content
+                    ]
+                }
+            ],
+            max_tokens=1000,
+            timeout=GROQ_TIMEOUTS["vision"]
+        )
+        return response.choices[0].message.content
     except Exception as e:
         print(f"Image processing error: {str(e)}")
         raise
-    finally:
-        if 'temp' in locals() and temp and os.path.exists(temp.name):
-            os.unlink(temp.name)
-
-def handle_detected_intent(text: str, session_id: str, user_details: dict) -> jsonify:
-    """Handle the detected intent with user details"""
-    sub_queries = detect_intent_llm(text)
-    print("Detected sub-queries:", sub_queries)
-
-    responses = []
-    
-    for item in sub_queries:
-        query = item["query"]
-        intent = item["intent"]
-        print(f"Processing intent '{intent}' for query: {query}")
-
-        # Get session lock to ensure sequential processing
-        session_lock = get_session_lock(session_id)
-        with session_lock:
-            # Get appropriate chain with user details
-            chain = get_conversation_chain(session_id, intent, user_details)
-            
-            # Add context if available
-            context = None
-            if intent not in ["greeting", "non_coding"]:
-                context = retrieve_relevant_text(query)
-            
-            # Prepare input 
-            input_text = f"Context:\n{context}\n\nQuestion:\n{query}" if context else query
-            
-            # Generate response
-            raw_response = chain.run(input=input_text)
-            clean_response_text = clean_response(raw_response)
-            
+
+def profile_key(user_details: Optional[dict]) -> tuple:
+    """Hashable form of the get_personalized_prompt inputs"""
+    if not user_details:
+        return ()
+    return (
+        user_details.get('educationLevel', 'unknown'),
+        user_details.get('standard', ''),
+        user_details.get('codingLevel', 'beginner'),
+        tuple(user_details.get('strongLanguages', []))
+    )
+
+def answer_sub_query(query: str, intent: str, history_messages: list, user_details: dict, owner: str, document: Optional[str],
+                     on_token: Optional[Callable[[str], None]] = None) -> tuple:
+    """
+    Retrieve context and generate the answer for one sub-query
+    When on_token is given the answer is streamed to it as cleaned text deltas
+    Returns (input text, raw answer, cleaned answer) without touching session history
+    """
+    print(f"Processing intent '{intent}' for query: {query}")
+    
+    # Add context if available
+    context = None
+    if intent not in ["greeting", "non_coding"]:
+        context = retrieve_relevant_text(query, owner, document)
+    
+    # Answers grounded in the owner's documents or in the session are not shared, and no answer is
+    # cached while one of the owner's uploads is still being indexed, since it may have had context
+    cacheable = (
+        ANSWER_CACHE_SIZE > 0 and not context and intent not in ANSWER_CACHE_BYPASS_INTENTS
+        and not ingestion_jobs.has_pending(owner=owner)
+    )
+    if cacheable:
+        query_embedding = encode_query(query)
+        profile = profile_key(user_details)
+        cached_answer = answer_cache.lookup(query_embedding, intent, profile)
+        if cached_answer is not None:
+            if on_token:
+                on_token(cached_answer)
+            return query, cached_answer, cached_answer
+    elif ANSWER_CACHE_SIZE > 0:
+        answer_cache.record_bypass()
+    
+    # Get appropriate chain with user details
+    chain = get_conversation_chain(intent, user_details)
+    
+    # Prepare input 
+    input_text = f"Context:\n{context}\n\nQuestion:\n{query}" if context else query
+    
+    # Generate response
+    chain_input = {"input": input_text, "history": history_messages}
+    if on_token:
+        cleaner = StreamingResponseCleaner()
+        tokens = []
+        start_time = time.perf_counter()
+        for token in chain.stream(chain_input):
+            if not tokens:
+                print(f"Time to first token for '{intent}': {(time.perf_counter() - start_time) * 1000:.0f}ms")
+            tokens.append(token)
+            delta = cleaner.feed(token)
+            if delta:
+                on_token(delta)
+        delta = cleaner.flush()
+        if delta:
+            on_token(delta)
+        raw_response = "".join(tokens)
+    else:
+        raw_response = chain.invoke(chain_input)
+    clean_response_text = clean_response(raw_response)
+    if cacheable:
+        answer_cache.store(query_embedding, intent, profile, clean_response_text)
+    
+    return input_text, raw_response, clean_response_text
+
+def answer_detected_intent(text: str, session_id: str, user_details: dict, owner: str, document: Optional[str] = None) -> str:
+    """Answer the detected intent with user details, retrieving only from the owner's documents"""
+    # Messages of one session are processed in order; the turn is taken first so a
+    # rejected message never costs an intent call
+    with session_turn(session_id), session_store.use(session_id) as history:
+        sub_queries = intent_classifier.detect(text)
+        print("Detected sub-queries:", sub_queries)
+        
+        # Every sub-query sees the history as it was before this message
+        history_messages = summary_memory.get_prompt_history(session_id)
+        
+        if len(sub_queries) == 1:
+            item = sub_queries[0]
+            results = [answer_sub_query(item["query"], item["intent"], history_messages, user_details, owner, document)]
+        else:
+            futures = [
+                subquery_executor.submit(answer_sub_query, item["query"], item["intent"], history_messages, user_details, owner, document)
+                for item in sub_queries
+            ]
+            results = [future.result() for future in futures]
+        
+        # Commit turns in the original sub-query order
+        responses = []
+        for input_text, raw_response, clean_response_text in results:
+            history.add_user_message(input_text)
+            history.add_ai_message(raw_response)
             responses.append(clean_response_text)
     
-    return jsonify({"response": "\n\n".join(responses)})
+    return "\n\n".join(responses)
+
+def handle_detected_intent(text: str, session_id: str, user_details: dict, owner: str, document: Optional[str] = None) -> jsonify:
+    """Handle the detected intent with user details, retrieving only from the owner's documents"""
+    return jsonify({"response": answer_detected_intent(text, session_id, user_details, owner, document)})
+
+def stream_detected_intent(text: str, session_id: str, user_details: dict, owner: str, document: Optional[str] = None) -> None:
+    """Stream the answer to each sub-query over SocketIO, then commit the turns to session history"""
+    with session_turn(session_id), session_store.use(session_id) as history:
+        sub_queries = intent_classifier.detect(text)
+        print("Detected sub-queries:", sub_queries)
+        history_messages = summary_memory.get_prompt_history(session_id)
+        emit("chat_start", {"parts": len(sub_queries)})
+        
+        # Parts are streamed one after another so the client can render them in order
+        results = []
+        for part, item in enumerate(sub_queries):
+            results.append(answer_sub_query(
+                item["query"], item["intent"], history_messages, user_details, owner, document,
+                on_token=lambda delta, part=part: emit("chat_token", {"part": part, "token": delta})
+            ))
+        
+        responses = []
+        for input_text, raw_response, clean_response_text in results:
+            history.add_user_message(input_text)
+            history.add_ai_message(raw_response)
+            responses.append(clean_response_text)
+    
+    emit("chat_end", {"response": "\n\n".join(responses)})
+
+def fetch_user_document(username: str) -> Optional[dict]:
+    """Projected edudetails document of a user, from the profile cache while it is fresh; callers must not modify it"""
+    now = time.time()
+    with profile_cache_lock:
+        cached = profile_cache.get(username)
+        if cached is not None and cached[0] > now:
+            profile_cache.move_to_end(username)
+            profile_cache_stats["hits"] += 1
+            return cached[1]
+        profile_cache_stats["misses"] += 1
+    
+    user = edudetails_collection.find_one({"username": username}, PROFILE_PROJECTION)
+    with profile_cache_lock:
+        profile_cache[username] = (now + (PROFILE_CACHE_TTL if user else PROFILE_CACHE_MISS_TTL), user)
+        profile_cache.move_to_end(username)
+        while len(profile_cache) > PROFILE_CACHE_SIZE:
+            profile_cache.popitem(last=False)
+    return user
+
+def invalidate_user_profile(username: str) -> None:
+    """Drop a cached profile so the next lookup reads MongoDB"""
+    with profile_cache_lock:
+        if profile_cache.pop(username, None) is not None:
+            profile_cache_stats["invalidations"] += 1
+
+def get_user_profile(username: Optional[str]) -> Optional[dict]:
+    """Fetch the personalization fields of a user's education profile"""
+    if not username:
+        return None
+    user = fetch_user_document(username)
+    if not user:
+        return None
+    return {
+        'educationLevel': user.get('educationLevel', 'unknown'),
+        'standard': user.get('standard', ''),
+        'codingLevel': user.get('codingLevel', 'beginner'),
+        'strongLanguages': user.get('strongLanguages', [])
+    }
 
 @app.route("/api/user/<username>", methods=['GET'])
 def get_user_details(username):
     """Get user educational details from edudetails collection"""
     try:
-        user = edudetails_collection.find_one({"username": username})
+        user = fetch_user_document(username)
         if not user:
             return jsonify({"error": "User not found"}), 404
-            
-        # Convert ObjectId to string and remove _id field
-        user['_id'] = str(user['_id'])
         return jsonify(user)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+@app.route("/api/user/<username>/cache", methods=['DELETE'])
+def invalidate_user_details(username):
+    """Forget a cached profile, e.g. right after the user updates their education details"""
+    invalidate_user_profile(username)
+    return jsonify({"message": "Profile cache cleared"})
+
+@app.route("/api/ingest/<job_id>", methods=['GET'])
+def get_ingestion_status(job_id):
+    """Get progress of a background document ingestion job"""
+    job = ingestion_jobs.get(job_id)
+    if not job or job["owner"] != get_session_id():
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route("/api/stats", methods=['GET'])
+def get_stats():
+    """Get cache hit/miss counters, intent fast-path, session queue, Groq connection and image metrics"""
+    return jsonify({
+        "caches": get_cache_stats(),
+        "intent": intent_classifier.get_stats(),
+        "sessions": get_session_queue_stats(),
+        "session_store": session_store.get_stats(),
+        "groq": get_groq_stats(),
+        "images": get_image_stats()
+    })
+
 @app.route("/api/chat", methods=['POST', 'OPTIONS'])
 def chat():
     """Main chat endpoint handling text, files, audio, and images"""
     if request.method == 'OPTIONS':
         return jsonify({'message': 'CORS preflight'}), 200
     
-    session_id = request.cookies.get('session_id') or str(hash(request.remote_addr))
+    session_id = get_session_id()
     
     try:
         # Initialize variables
         username = None
         query = None
         file = None
+        document = None
         
         # Check content type
         content_type = request.content_type or ''
@@ -424,26 +1268,23 @@ def chat():
             # Handle form data (text + files)
             username = request.form.get('username')
             query = request.form.get('query', '').strip()
+            document = request.form.get('document')
             file = request.files.get('file')
         elif 'application/json' in content_type and request.is_json:
             # Handle pure JSON
             data = request.get_json()
             username = data.get('username')
             query = data.get('query', '').strip()
+            document = data.get('document')
         else:
             return jsonify({"response": "❌ Unsupported content type."}), 415
         
         # Get user details if username provided
-        user_details = None
-        if username:
-            user = edudetails_collection.find_one({"username": username})
-            if user:
-                user_details = {
-                    'educationLevel': user.get('educationLevel', 'unknown'),
-                    'standard': user.get('standard', ''),
-                    'codingLevel': user.get('codingLevel', 'beginner'),
-                    'strongLanguages': user.get('strongLanguages', [])
-                }
+        user_details = get_user_profile(username)
+
+        # Uploaded documents are indexed and searched per session. The owner comes only from the
+        # session cookie: the username in the request body is not authenticated
+        owner = session_id
 
         # Handle file upload if present
         if file and file.filename:
@@ -451,22 +1292,36 @@ def chat():
             ext = os.path.splitext(filename)[1].lower()
             
             if ext in SUPPORTED_TEXT_EXTENSIONS.union(SUPPORTED_DOC_EXTENSIONS):
-                text_content = extract_text_from_file(file)
-                store_and_index_text(text_content)
+                # Parsing and embedding happen on the ingestion pool, not in this request;
+                # the upload is streamed to disk so only its path is handed over
+                with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as temp:
+                    file.save(temp)
+                # A question sent with the upload is about it, so it is answered from it once it is
+                # indexed, as the Telegram bot does with a document's caption. The request does not
+                # wait: the answer arrives as ingest_done over SocketIO and in /api/ingest/<job_id>
+                job = submit_ingestion_job(filename, temp.name, owner, query, user_details, document)
                 
                 if query:
-                    return handle_detected_intent(query, session_id, user_details)
-                return jsonify({"response": "📄 File processed successfully. You can now ask questions about its content."})
+                    return jsonify({
+                        "response": "📄 File received. Your question will be answered once the document is processed.",
+                        "job_id": job["job_id"]
+                    }), 202
+                return jsonify({
+                    "response": "📄 File received and is being processed. You can ask questions about its content once it is ready.",
+                    "job_id": job["job_id"]
+                }), 202
                 
             elif ext in SUPPORTED_AUDIO_EXTENSIONS:
                 try:
                     transcribed_text = process_audio_file(file)
-                    response = handle_detected_intent(transcribed_text, session_id, user_details)
+                    response = handle_detected_intent(transcribed_text, session_id, user_details, owner, document)
                     response_data = json.loads(response.get_data(as_text=True))
                     return jsonify({
                         "transcribed": transcribed_text,
                         "response": response_data.get("response", "")
                     })
+                except (SessionBusyError, MediaTooLargeError):
+                    raise
                 except Exception as e:
                     print(f"Audio processing error: {str(e)}")
                     return jsonify({
@@ -475,17 +1330,22 @@ def chat():
                 
             elif ext in SUPPORTED_IMAGE_EXTENSIONS:
                 image_description = process_image_file(file)
-                return handle_detected_intent(image_description, session_id, user_details)
+                return handle_detected_intent(image_description, session_id, user_details, owner, document)
                 
             else:
                 return jsonify({"response": f"❌ Unsupported file type: {ext}"}), 415
         
         # Handle text-only input
         if query:
-            return handle_detected_intent(query, session_id, user_details)
+            return handle_detected_intent(query, session_id, user_details, owner, document)
         
         return jsonify({"response": "Please enter a message."}), 400
         
+    except SessionBusyError:
+        return jsonify({"response": "⏳ Still answering your previous messages. Please wait a moment."}), 429
+    except (MediaTooLargeError, RequestEntityTooLarge) as e:
+        print("Upload too large:", str(e))
+        return jsonify({"response": "❌ That file is too large. Please send a smaller one."}), 413
     except Exception as e:
         print("Chat endpoint error:", str(e))
         return jsonify({"response": "❌ An error occurred while processing your request."}), 500
@@ -493,11 +1353,12 @@ def chat():
 @app.route("/api/history", methods=['GET'])
 def get_history():
     """Get chat history for current session"""
-    session_id = request.cookies.get('session_id') or str(hash(request.remote_addr))
-    history = get_session_history(session_id)
+    session_id = get_session_id()
+    # Reading history does not create a session
+    history = session_store.peek(session_id)
     
     messages = []
-    for msg in history.messages:
+    for msg in (history.messages if history else []):
         if isinstance(msg, HumanMessage):
             messages.append({"role": "user", "content": msg.content})
         elif isinstance(msg, AIMessage):
@@ -508,16 +1369,62 @@ def get_history():
 @app.route("/api/clear", methods=['POST'])
 def clear_history():
     """Clear chat history for current session"""
-    session_id = request.cookies.get('session_id') or str(hash(request.remote_addr))
-    if session_id in session_histories:
-        del session_histories[session_id]
-    if session_id in session_locks:
-        del session_locks[session_id]
+    session_id = get_session_id()
+    session_store.pop(session_id)
+    summary_memory.forget(session_id)
     return jsonify({"message": "History cleared"})
 
+@socketio.on("connect")
+def handle_connect():
+    """Join the room of the cookie session, where background results such as ingest_done are emitted"""
+    session_id = get_cookie_session_id()
+    if session_id:
+        join_room(session_id)
+
+@socketio.on("chat")
+def handle_chat_stream(data):
+    """
+    Streaming chat over SocketIO
+    Emits chat_start, then chat_token deltas per part, then chat_end with the full cleaned answer
+    """
+    # Socket events cannot set cookies, so clients without one keep history per connection
+    session_id = get_cookie_session_id() or request.sid
+    data = data or {}
+    query = (data.get('query') or '').strip()
+    if not query:
+        emit("chat_error", {"response": "Please enter a message."})
+        return
+    
+    try:
+        username = data.get('username')
+        user_details = get_user_profile(username)
+        owner = session_id
+        stream_detected_intent(query, session_id, user_details, owner, data.get('document'))
+    except SessionBusyError:
+        emit("chat_error", {"response": "⏳ Still answering your previous messages. Please wait a moment."})
+    except Exception as e:
+        print("Chat stream error:", str(e))
+        emit("chat_error", {"response": "❌ An error occurred while processing your request."})
+
 @app.route("/")
 def home():
     return render_template("index.html")
 
+def start_background_work() -> None:
+    """
+    Fork the parse workers, then start the snapshot and embedding cache pruning
+    threads. Forking after a thread has started could copy a lock it holds into
+    the workers, so nothing at import time before this call may start a thread.
+    """
+    warm_parse_pool()
+    Thread(target=snapshot_document_store_periodically, daemon=True).start()
+    if EMBEDDING_CACHE_PRUNE_INTERVAL > 0:
+        Thread(target=prune_embedding_cache_periodically, daemon=True).start()
+    atexit.register(save_document_store)
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+# Runs on import so gunicorn workers, which import the app and never reach __main__, start it too
+start_background_work()
+
 if __name__ == "__main__":
     socketio.run(app, host="0.0.0.0", port=8000, debug=True)
\ No newline at end of file
@@ -5,12 +5,12 @@ from flask_socketio import SocketIO
 import groq
 import re
 import os
+import time
 from dotenv import load_dotenv
 import base64
 from PyPDF2 import PdfReader
 import docx
 import faiss
-import numpy as np
 from sentence_transformers import SentenceTransformer
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.messages import HumanMessage, AIMessage
@@ -65,6 +65,9 @@ index = faiss.IndexFlatL2(384)
 id_to_text: Dict[int, str] = {}
 next_id = 0 
 
+# Number of chunks embedded per forward pass during ingestion
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
 # Session storage for conversation histories and processing locks
 session_histories: Dict[str, ChatMessageHistory] = {}
 session_locks: Dict[str, Lock] = {}
@@ -218,16 +221,28 @@ def clean_response(text: str) -> str:
     text = re.sub(r'\*(.*?)\*', r'\1', text)
     return text.strip()
 
-def store_and_index_text(text: str) -> None:
-    """Store text chunks in vector index"""
+def store_and_index_text(text: str) -> int:
+    """Store text chunks in vector index, embedding them in batches"""
     global next_id
     chunks = [text[i:i+500] for i in range(0, len(text), 500)]
+    if not chunks:
+        return 0
     
+    start_time = time.perf_counter()
+    embeddings = embedding_model.encode(
+        chunks,
+        batch_size=EMBEDDING_BATCH_SIZE,
+        normalize_embeddings=True,
+        convert_to_numpy=True
+    ).astype("float32")
+    index.add(embeddings)
     for chunk in chunks:
-        embedding = embedding_model.encode(chunk, normalize_embeddings=True).astype("float32")
-        index.add(np.array([embedding]))
         id_to_text[next_id] = chunk
         next_id += 1
+    
+    elapsed = max(time.perf_counter() - start_time, 1e-6)
+    print(f"Indexed {len(chunks)} chunks in {elapsed:.2f}s ({len(chunks) / elapsed:.1f} chunks/s)")
+    return len(chunks)
 
 def retrieve_relevant_text(query: str, top_k: int = 3) -> Optional[str]:
     """Retrieve relevant text chunks using RAG"""
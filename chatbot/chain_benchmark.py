@@ -0,0 +1,63 @@
+"""
+Per-request overhead of building conversation chains versus the chain registry.
+
+Times getting the chain of one sub-query with and without the (intent, profile)
+cache in appwork.py. The model is never called.
+
+    python chain_benchmark.py
+    python chain_benchmark.py --iterations 5000 --profiles 50
+"""
+import argparse
+import time
+import tracemalloc
+
+from appwork import build_conversation_chain, chain_cache, get_conversation_chain
+
+INTENTS = ["greeting", "code_generation", "debug_help", "learning_path", "non_coding"]
+
+def make_profiles(count: int) -> list:
+    """Distinct user profiles shaped like get_user_profile results"""
+    levels = ["beginner", "intermediate", "advanced"]
+    return [
+        {
+            "educationLevel": "college",
+            "standard": f"year {i % 4 + 1}",
+            "codingLevel": levels[i % len(levels)],
+            "strongLanguages": ["Python", "JavaScript"][:i % 2 + 1] + [f"lang{i}"]
+        }
+        for i in range(count)
+    ]
+
+def measure(get_chain, requests: list) -> tuple:
+    """Mean microseconds per chain lookup and peak traced memory of the run"""
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    for intent, profile in requests:
+        get_chain(intent, profile)
+    elapsed = time.perf_counter() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed * 1e6 / len(requests), peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Chain construction overhead with and without the chain cache")
+    parser.add_argument("--iterations", type=int, default=2000, help="Chain lookups per run")
+    parser.add_argument("--profiles", type=int, default=20, help="Distinct user profiles in the request mix")
+    args = parser.parse_args()
+
+    profiles = make_profiles(args.profiles)
+    requests = [(INTENTS[i % len(INTENTS)], profiles[i % len(profiles)]) for i in range(args.iterations)]
+    print(f"{args.iterations} lookups, {len(INTENTS)} intents, {args.profiles} profiles\n")
+
+    chain_cache.clear()
+    rows = [
+        ("rebuild per call", *measure(build_conversation_chain, requests)),
+        ("chain cache", *measure(get_conversation_chain, requests)),
+    ]
+
+    print(f"{'mode':<18} {'us/call':>9} {'peak KiB':>9}")
+    for mode, micros, peak in rows:
+        print(f"{mode:<18} {micros:>9.1f} {peak / 1024:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Per-chat ordering for the Telegram bots.
+
+The bots let the Application process updates concurrently, so messages of one
+chat are funnelled through ChatScheduler: each chat's work runs in arrival order
+on its own asyncio task while different chats run in parallel.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+class ChatWork:
+    """One queued unit of work for a chat; text is set only for plain text messages, which may be coalesced"""
+    def __init__(self, run: Callable[["ChatWork"], Awaitable[None]], update: Any,
+                 context: Any = None, text: Optional[str] = None):
+        self.run = run
+        self.update = update
+        self.context = context
+        self.text = text
+        self.enqueued_at = time.monotonic()
+
+class ChatScheduler:
+    """
+    Runs the work of each chat strictly in order on its own asyncio task while different chats run in parallel
+    Text messages that arrive while an earlier one is still waiting are merged into it; anything beyond
+    max_depth waiting items is rejected
+    """
+    def __init__(self, max_depth: int):
+        self.max_depth = max_depth
+        self.queues: Dict[str, deque] = {}
+        self.workers: Dict[str, asyncio.Task] = {}
+        self.stats = {"queued": 0, "coalesced": 0, "rejected": 0, "completed": 0, "wait_total_s": 0.0, "wait_max_s": 0.0}
+
+    def submit(self, chat_id: str, work: ChatWork) -> str:
+        """Queue work for a chat and return "queued", "coalesced" or "rejected"."""
+        queue = self.queues.setdefault(chat_id, deque())
+        if work.text is not None and queue and queue[-1].text is not None:
+            queue[-1].text += "\n\n" + work.text
+            self.stats["coalesced"] += 1
+            return "coalesced"
+        if len(queue) >= self.max_depth:
+            self.stats["rejected"] += 1
+            return "rejected"
+
+        queue.append(work)
+        self.stats["queued"] += 1
+        if chat_id not in self.workers:
+            self.workers[chat_id] = asyncio.create_task(self.drain(chat_id))
+        return "queued"
+
+    async def drain(self, chat_id: str) -> None:
+        """Run a chat's queued work one item at a time; the worker exits once the queue is empty."""
+        queue = self.queues[chat_id]
+        try:
+            while queue:
+                work = queue.popleft()
+                wait_s = time.monotonic() - work.enqueued_at
+                self.stats["wait_total_s"] += wait_s
+                self.stats["wait_max_s"] = max(self.stats["wait_max_s"], wait_s)
+                try:
+                    await work.run(work)
+                except Exception as e:
+                    print(f"Error in queued work for chat {chat_id}:", e)
+                self.stats["completed"] += 1
+        finally:
+            del self.workers[chat_id]
+            if not queue:
+                del self.queues[chat_id]
+
+    def get_stats(self) -> dict:
+        """Queue depth and queue-wait metrics across all chats"""
+        completed = self.stats["completed"]
+        return {
+            **self.stats,
+            "active_chats": len(self.workers),
+            "waiting": sum(len(queue) for queue in self.queues.values()),
+            "wait_avg_s": self.stats["wait_total_s"] / completed if completed else 0.0,
+        }
@@ -0,0 +1,119 @@
+"""
+Code-aware, token-sized chunking of uploaded documents, shared by the Flask app and the Telegram bot.
+
+Code is split on definition and block boundaries, prose on sentence and paragraph
+boundaries, then packed into chunks of about CHUNK_TOKENS embedding-model tokens with
+CHUNK_OVERLAP_TOKENS of trailing context repeated at the start of the next chunk.
+"""
+import os
+import re
+from typing import Iterable, Iterator, List
+
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "200"))  # all-MiniLM-L6-v2 truncates input past 256 tokens
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+CODE_CONTINUATION_PATTERN = re.compile(r"[}\])]|(else|elif|except|finally|catch|end)\b")
+CODE_PREAMBLE_PATTERN = re.compile(r"(@|#|//|/\*|\*|--)")
+SENTENCE_PATTERN = re.compile(r".+?(?:[.!?](?=\s)|\n\s*\n|$)\s*", re.S)
+
+class Chunker:
+    """Chunks text for one embedding model, counting tokens with that model's tokenizer"""
+    def __init__(self, tokenizer, code_extensions: Iterable[str], chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+        self.tokenizer = tokenizer
+        self.code_extensions = set(code_extensions)
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+    
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """Embedding-model token counts of several texts in one tokenizer call"""
+        if not texts:
+            return []
+        return [len(ids) for ids in self.tokenizer(texts, add_special_tokens=False)["input_ids"]]
+    
+    def split_code_units(self, lines: List[str], level: int = 0) -> List[tuple]:
+        """
+        Split source lines into (block, token count) pairs, blocks starting at a statement indented exactly `level`
+        Comments and decorators stay with the definition below them; blocks over the token
+        budget are split again at the next indentation level found inside them
+        """
+        starts = [0]
+        in_string = False
+        for i, line in enumerate(lines):
+            # Lines inside multi-line string literals never start a block
+            was_in_string = in_string
+            if (line.count('"""') + line.count("'''")) % 2:
+                in_string = not in_string
+            stripped = line.lstrip()
+            indent = len(line) - len(stripped)
+            if i == 0 or was_in_string or not stripped or indent != level or CODE_CONTINUATION_PATTERN.match(stripped):
+                continue
+            if CODE_PREAMBLE_PATTERN.match(stripped) and i + 1 < len(lines):
+                continue
+            # Pull leading comments and decorators into the block
+            start = i
+            while start > starts[-1] + 1 and CODE_PREAMBLE_PATTERN.match(lines[start - 1].lstrip()) \
+                    and len(lines[start - 1]) - len(lines[start - 1].lstrip()) == level:
+                start -= 1
+            if start > starts[-1]:
+                starts.append(start)
+        blocks = ["".join(lines[a:b]) for a, b in zip(starts, starts[1:] + [len(lines)])]
+        
+        units = []
+        for block, tokens in zip(blocks, self.count_tokens(blocks)):
+            block_lines = block.splitlines(keepends=True)
+            deeper = [len(l) - len(l.lstrip()) for l in block_lines if l.strip() and len(l) - len(l.lstrip()) > level]
+            if tokens <= self.chunk_tokens or len(block_lines) == 1:
+                units.append((block, tokens))
+            elif deeper:
+                units.extend(self.split_code_units(block_lines, min(deeper)))
+            else:
+                units.extend(zip(block_lines, self.count_tokens(block_lines)))
+        return units
+    
+    def split_prose_units(self, text: str) -> List[str]:
+        """Split prose into sentences, each keeping its trailing whitespace so paragraph breaks survive"""
+        return [match.group(0) for match in SENTENCE_PATTERN.finditer(text) if match.group(0).strip()]
+    
+    def split_units(self, text: str, file_extension: str) -> List[tuple]:
+        """(unit, token count) pairs of one piece of text, split along code or prose boundaries"""
+        if file_extension in self.code_extensions:
+            return self.split_code_units(text.splitlines(keepends=True))
+        sentences = self.split_prose_units(text)
+        return list(zip(sentences, self.count_tokens(sentences)))
+    
+    def pack_chunks(self, units: Iterable[tuple]) -> Iterator[str]:
+        """Greedily pack (unit, token count) pairs into chunks of about chunk_tokens tokens, with overlap"""
+        current, current_tokens = [], []
+        for unit, tokens in units:
+            if tokens > self.chunk_tokens:
+                # A single line or sentence over budget is cut into even pieces
+                pieces = -(-tokens // self.chunk_tokens)
+                size = -(-len(unit) // pieces)
+                parts = [unit[i:i + size] for i in range(0, len(unit), size)]
+                part_tokens = [tokens // pieces] * len(parts)
+            else:
+                parts, part_tokens = [unit], [tokens]
+            for part, tokens in zip(parts, part_tokens):
+                if current and sum(current_tokens) + tokens > self.chunk_tokens:
+                    chunk = "".join(current).strip()
+                    if chunk:
+                        yield chunk
+                    # Carry the trailing units that fit in the overlap into the next chunk
+                    keep = 0
+                    while keep < len(current) and sum(current_tokens[len(current) - keep - 1:]) <= self.overlap_tokens:
+                        keep += 1
+                    current, current_tokens = current[len(current) - keep:], current_tokens[len(current_tokens) - keep:]
+                    if sum(current_tokens) + tokens > self.chunk_tokens:
+                        current, current_tokens = [], []
+                current.append(part)
+                current_tokens.append(tokens)
+        chunk = "".join(current).strip()
+        if chunk:
+            yield chunk
+    
+    def chunk_text(self, text: str, file_extension: str = "") -> List[str]:
+        """Split text into chunks of about chunk_tokens tokens along code or prose boundaries, with overlap"""
+        return list(self.pack_chunks(self.split_units(text, file_extension)))
+    
+    def chunk_sections(self, sections: Iterable[str], file_extension: str) -> Iterator[str]:
+        """Chunk a stream of pages or paragraph groups lazily; a chunk may span two sections"""
+        return self.pack_chunks(unit for section in sections for unit in self.split_units(section, file_extension))
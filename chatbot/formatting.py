@@ -0,0 +1,139 @@
+"""
+Cleaning of LLM answers for display, for whole answers and for token streams.
+
+Code blocks are kept verbatim, an answer wrapped in double quotes is unwrapped,
+and bold/italic markers are removed from the rest. StreamingResponseCleaner
+releases text only once later tokens can no longer change how it is cleaned, so
+the streamed deltas join to exactly clean_response(full answer).
+"""
+import re
+from typing import Optional
+
+FENCE = "```"
+CODE_BLOCK_PATTERN = re.compile(r'```[\s\S]*?```')
+
+def clean_markup(text: str, strip_quotes: bool = False) -> str:
+    """Remove bold/italic markers outside code blocks, and optionally the double quotes around the text"""
+    # First protect code blocks during cleaning
+    protected_blocks = []
+    def protect(match):
+        protected_blocks.append(match.group(0))
+        return f"__PROTECTED_BLOCK_{len(protected_blocks)-1}__"
+
+    # Protect code blocks
+    text = CODE_BLOCK_PATTERN.sub(protect, text)
+    if strip_quotes:
+        # Remove double quotes around the response
+        text = re.sub(r'^"(.*)"$', r'\1', text)
+    # Clean other formatting
+    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
+    text = re.sub(r'\*(.*?)\*', r'\1', text)
+
+    # Restore protected code blocks
+    for i, block in enumerate(protected_blocks):
+        text = text.replace(f"__PROTECTED_BLOCK_{i}__", block)
+    return text
+
+def clean_response(text: str) -> str:
+    """Clean and format the LLM response while preserving code blocks"""
+    return clean_markup(text, strip_quotes=True).strip()
+
+class StreamingResponseCleaner:
+    """
+    Applies clean_response to a token stream. Text outside code blocks is
+    released a line at a time, since bold/italic markers never span lines. An
+    open code block is released as it arrives, except from the first line that
+    would be cleaned differently if the block were never closed; that part waits
+    for the closing fence or the end of the stream.
+    """
+
+    def __init__(self):
+        self.pending = ""  # Raw text not released yet
+        self.in_code_block = False  # The opening fence of a block was released, its closing one not yet
+        self.quotes_ruled_out = False  # Whether the answer can no longer be a quoted one
+        self.released = False
+        self.started = False
+        self.trailing = ""  # Cleaned whitespace held back in case the stream ends after it
+
+    def feed(self, token: str) -> str:
+        """Add a token and return the cleaned text it made final"""
+        self.pending += token
+        if self.pending and not self.released:
+            self.quotes_ruled_out = self.quotes_ruled_out or not self.pending.startswith('"')
+        pieces = []
+        while True:
+            piece = self._release_code() if self.in_code_block else self._release_text()
+            if piece is None:
+                break
+            self.released = True
+            pieces.append(piece)
+        return self._emit("".join(pieces))
+
+    def flush(self) -> str:
+        """Return the cleaned remainder once the stream has ended"""
+        text, self.pending = self.pending, ""
+        # Inside an unclosed block the rest has no fences left and is cleaned as text, as clean_response does
+        cleaned = self._emit(clean_markup(text, strip_quotes=not self.released))
+        self.trailing = ""
+        return cleaned
+
+    def _release_text(self) -> Optional[str]:
+        """Release text up to the last line break outside code blocks, or up to an opening fence"""
+        text = self.pending
+        newline, last_end = -1, 0
+        for match in CODE_BLOCK_PATTERN.finditer(text):
+            newline = max(newline, text.rfind("\n", last_end, match.start()))
+            last_end = match.end()
+        # A fence after the last complete block opens one that may still be closed
+        fence = text.find(FENCE, last_end)
+        stop = fence if fence >= 0 else len(text)
+        if not self.quotes_ruled_out:
+            # A quoted answer is unwrapped unless a line break is followed by more text
+            stop = min(stop, len(text) - 1)
+        newline = max(newline, text.rfind("\n", last_end, stop))
+
+        if newline >= 0:
+            self.pending = text[newline + 1:]
+            self.quotes_ruled_out = True
+            return clean_markup(text[:newline + 1])
+        # Text before the fence is unchanged whether or not the block closes, as long as it has no markers
+        if fence >= 0 and self.quotes_ruled_out and "*" not in CODE_BLOCK_PATTERN.sub("", text[:fence]):
+            self.pending = text[fence + len(FENCE):]
+            self.in_code_block = True
+            return text[:fence + len(FENCE)]
+        return None
+
+    def _release_code(self) -> Optional[str]:
+        """Release an open code block up to its closing fence, or the part that cleaning could not change"""
+        text = self.pending
+        fence = text.find(FENCE)
+        if fence >= 0:
+            self.pending = text[fence + len(FENCE):]
+            self.in_code_block = False
+            return text[:fence + len(FENCE)]
+
+        # Were the block never closed, its lines would be cleaned as text, which only
+        # changes lines with at least two asterisks
+        end = 0
+        *lines, last_line = text.split("\n")
+        for line in lines:
+            if line.count("*") >= 2:
+                break
+            end += len(line) + 1
+        else:
+            # The unfinished line may still gain a second asterisk, or the closing fence
+            end += len(last_line.split("*", 1)[0].rstrip("`"))
+        if not end:
+            return None
+        self.pending = text[end:]
+        return text[:end]
+
+    def _emit(self, text: str) -> str:
+        # Leading and trailing whitespace is stripped like clean_response does
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        text = self.trailing + text
+        body = text.rstrip()
+        self.trailing = text[len(body):]
+        return body
@@ -0,0 +1,114 @@
+"""
+Pooled Groq HTTP clients shared by the Flask app and both Telegram bots.
+
+Every Groq call of a process goes through one keep-alive connection pool per
+client. Each request is traced through httpcore so /api/stats and the bots'
+stats commands can report latency and connection reuse per endpoint.
+"""
+import os
+import time
+from threading import Lock
+from typing import Dict
+
+import httpx
+
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "32"))
+GROQ_MAX_KEEPALIVE = int(os.getenv("GROQ_MAX_KEEPALIVE", "16"))
+GROQ_KEEPALIVE_EXPIRY = float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "120"))  # Seconds an idle connection is kept open
+GROQ_TIMEOUTS = {  # Seconds per call type
+    "intent": float(os.getenv("GROQ_INTENT_TIMEOUT", "15")),
+    "chat": float(os.getenv("GROQ_CHAT_TIMEOUT", "60")),
+    "transcription": float(os.getenv("GROQ_TRANSCRIPTION_TIMEOUT", "120")),
+    "vision": float(os.getenv("GROQ_VISION_TIMEOUT", "60")),
+    "summary": float(os.getenv("GROQ_SUMMARY_TIMEOUT", "60")),
+}
+groq_call_stats: Dict[str, dict] = {}
+groq_call_stats_lock = Lock()
+
+def note_trace_event(state: dict, event_name: str) -> None:
+    """Mark the request as having opened a new connection or done a TLS handshake"""
+    if event_name.endswith("connect_tcp.complete"):
+        state["new_connection"] = True
+    elif event_name.endswith("start_tls.complete"):
+        state["tls_handshake"] = True
+
+def trace_groq_request(request: httpx.Request) -> None:
+    """Attach an httpcore trace that notes whether the request had to open a new connection"""
+    state = {"start": time.perf_counter(), "new_connection": False, "tls_handshake": False}
+
+    def trace(event_name: str, info: dict) -> None:
+        note_trace_event(state, event_name)
+
+    trace.state = state
+    request.extensions["trace"] = trace
+
+async def trace_groq_request_async(request: httpx.Request) -> None:
+    """Same as trace_groq_request, with the coroutine trace httpcore requires on async clients"""
+    state = {"start": time.perf_counter(), "new_connection": False, "tls_handshake": False}
+
+    async def trace(event_name: str, info: dict) -> None:
+        note_trace_event(state, event_name)
+
+    trace.state = state
+    request.extensions["trace"] = trace
+
+def record_groq_response(response: httpx.Response) -> None:
+    """Record time to response headers and connection reuse per endpoint"""
+    state = getattr(response.request.extensions.get("trace"), "state", None)
+    if state is None:
+        return
+    latency_ms = (time.perf_counter() - state["start"]) * 1000
+    with groq_call_stats_lock:
+        stats = groq_call_stats.setdefault(response.request.url.path, {
+            "calls": 0, "errors": 0, "new_connections": 0, "tls_handshakes": 0, "latency_total_ms": 0.0, "latency_max_ms": 0.0
+        })
+        stats["calls"] += 1
+        stats["errors"] += response.status_code >= 400
+        stats["new_connections"] += state["new_connection"]
+        stats["tls_handshakes"] += state["tls_handshake"]
+        stats["latency_total_ms"] += latency_ms
+        stats["latency_max_ms"] = max(stats["latency_max_ms"], latency_ms)
+
+async def record_groq_response_async(response: httpx.Response) -> None:
+    record_groq_response(response)
+
+def get_groq_stats() -> dict:
+    """Per-endpoint Groq latency and connection-reuse rates"""
+    with groq_call_stats_lock:
+        return {
+            path: {
+                "calls": stats["calls"],
+                "errors": stats["errors"],
+                "new_connections": stats["new_connections"],
+                "tls_handshakes": stats["tls_handshakes"],
+                "reuse_rate": round(1 - stats["new_connections"] / stats["calls"], 3),
+                "latency_avg_ms": round(stats["latency_total_ms"] / stats["calls"], 2),
+                "latency_max_ms": round(stats["latency_max_ms"], 2),
+            }
+            for path, stats in groq_call_stats.items()
+        }
+
+def groq_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=GROQ_MAX_CONNECTIONS,
+        max_keepalive_connections=GROQ_MAX_KEEPALIVE,
+        keepalive_expiry=GROQ_KEEPALIVE_EXPIRY,
+    )
+
+def create_groq_http_client(**kwargs) -> httpx.Client:
+    """Pooled, traced client for groq.Client and ChatGroq"""
+    return httpx.Client(
+        limits=groq_limits(),
+        timeout=httpx.Timeout(GROQ_TIMEOUTS["chat"], connect=10.0),
+        event_hooks={"request": [trace_groq_request], "response": [record_groq_response]},
+        **kwargs
+    )
+
+def create_groq_async_http_client(**kwargs) -> httpx.AsyncClient:
+    """Pooled, traced client for groq.AsyncGroq"""
+    return httpx.AsyncClient(
+        limits=groq_limits(),
+        timeout=httpx.Timeout(GROQ_TIMEOUTS["chat"], connect=10.0),
+        event_hooks={"request": [trace_groq_request_async], "response": [record_groq_response_async]},
+        **kwargs
+    )
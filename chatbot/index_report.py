@@ -0,0 +1,95 @@
+"""
+Recall-vs-latency report for the RAG index backends.
+
+Compares exact flat search with HNSW and IVF at several search settings so
+ANN_BACKEND, HNSW_EF_SEARCH and IVF_NPROBE can be chosen for appwork.py.
+
+    python index_report.py --store-dir rag_store/<owner-hash>
+    python index_report.py --synthetic 1000000
+"""
+import argparse
+import os
+import time
+
+import faiss
+import numpy as np
+
+EMBEDDING_DIM = 384
+
+def load_vectors(store_dir: str) -> np.ndarray:
+    """Read every vector out of an owner's index snapshot"""
+    index = faiss.read_index(os.path.join(store_dir, "index.faiss"))
+    if isinstance(faiss.downcast_index(index), faiss.IndexIVF):
+        faiss.downcast_index(index).make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+def synthetic_vectors(count: int, seed: int = 0) -> np.ndarray:
+    """Unit-length random vectors shaped like sentence embeddings"""
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((count, EMBEDDING_DIM)).astype("float32")
+    faiss.normalize_L2(vectors)
+    return vectors
+
+def measure(index, queries: np.ndarray, ground_truth: np.ndarray, top_k: int) -> tuple:
+    """Recall@k against exact results and mean single-query latency in ms"""
+    found = np.empty((len(queries), top_k), dtype="int64")
+    start_time = time.perf_counter()
+    # One query per call, as retrieve_relevant_text does
+    for i in range(len(queries)):
+        _, found[i] = index.search(queries[i:i + 1], top_k)
+    latency_ms = (time.perf_counter() - start_time) * 1000 / len(queries)
+    hits = sum(len(set(found[i]) & set(ground_truth[i])) for i in range(len(queries)))
+    return hits / ground_truth.size, latency_ms
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall-vs-latency report for RAG index backends")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--store-dir", help="Owner snapshot directory containing index.faiss")
+    source.add_argument("--synthetic", type=int, help="Number of random vectors to generate")
+    parser.add_argument("--queries", type=int, default=200, help="Held-out vectors used as queries")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--hnsw-m", type=int, default=int(os.getenv("HNSW_M", "32")))
+    parser.add_argument("--hnsw-ef-construction", type=int, default=int(os.getenv("HNSW_EF_CONSTRUCTION", "200")))
+    parser.add_argument("--ivf-nlist", type=int, default=int(os.getenv("IVF_NLIST", "0")))
+    args = parser.parse_args()
+
+    vectors = load_vectors(args.store_dir) if args.store_dir else synthetic_vectors(args.synthetic + args.queries)
+    if len(vectors) <= args.queries:
+        parser.error(f"Need more than {args.queries} vectors, got {len(vectors)}")
+    queries, data = vectors[:args.queries], np.ascontiguousarray(vectors[args.queries:])
+    print(f"{len(data)} vectors, {len(queries)} queries, top_k={args.top_k}\n")
+
+    flat = faiss.IndexFlatL2(EMBEDDING_DIM)
+    flat.add(data)
+    _, ground_truth = flat.search(queries, args.top_k)
+
+    rows = [("flat", "-", *measure(flat, queries, ground_truth, args.top_k), 0.0)]
+
+    start_time = time.perf_counter()
+    hnsw = faiss.IndexHNSWFlat(EMBEDDING_DIM, args.hnsw_m)
+    hnsw.hnsw.efConstruction = args.hnsw_ef_construction
+    hnsw.add(data)
+    build_s = time.perf_counter() - start_time
+    for ef_search in (16, 32, 64, 128, 256):
+        hnsw.hnsw.efSearch = ef_search
+        rows.append(("hnsw", f"efSearch={ef_search}", *measure(hnsw, queries, ground_truth, args.top_k), build_s))
+
+    start_time = time.perf_counter()
+    nlist = args.ivf_nlist or max(1, int(4 * np.sqrt(len(data))))
+    quantizer = faiss.IndexFlatL2(EMBEDDING_DIM)
+    ivf = faiss.IndexIVFFlat(quantizer, EMBEDDING_DIM, nlist)
+    ivf.train(data)
+    ivf.add(data)
+    build_s = time.perf_counter() - start_time
+    for nprobe in (1, 4, 16, 64, 256):
+        if nprobe > nlist:
+            break
+        ivf.nprobe = nprobe
+        rows.append(("ivf", f"nlist={nlist} nprobe={nprobe}", *measure(ivf, queries, ground_truth, args.top_k), build_s))
+
+    print(f"{'backend':<8} {'setting':<24} {'recall@k':>9} {'ms/query':>9} {'build s':>8}")
+    for backend, setting, recall, latency_ms, build_s in rows:
+        print(f"{backend:<8} {setting:<24} {recall:>9.3f} {latency_ms:>9.3f} {build_s:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+Document parsing and background ingestion jobs shared by the Flask app and the
+Telegram bot.
+
+PDF and DOCX parsing is pure Python and holds the GIL, so it runs in worker
+processes that open the upload by path. PDFs are split into PDF_PAGES_PER_TASK
+page ranges parsed in parallel, with at most PARSE_QUEUE_DEPTH ranges in flight
+per document. PARSE_WORKERS=0 parses in-process.
+"""
+import json
+import os
+import multiprocessing
+import sqlite3
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from threading import Event, Lock
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import docx
+from PyPDF2 import PdfReader
+
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 2)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+PARSE_QUEUE_DEPTH = int(os.getenv("PARSE_QUEUE_DEPTH", str(max(2, 2 * PARSE_WORKERS))))
+# Documents are read a PDF page or DOCX_PARAGRAPH_GROUP paragraphs at a time and chunked and
+# embedded as they are read, so only one section and one embedding batch are held in memory
+DOCX_PARAGRAPH_GROUP = int(os.getenv("DOCX_PARAGRAPH_GROUP", "50"))
+INGESTION_JOB_TTL = int(os.getenv("INGESTION_JOB_TTL", "3600"))  # Seconds a finished job stays pollable
+# Forked rather than spawned: a spawned worker would re-import the entry script and load the models
+parse_executor = ProcessPoolExecutor(
+    max_workers=PARSE_WORKERS,
+    mp_context=multiprocessing.get_context("fork")
+) if PARSE_WORKERS else None
+
+def read_pdf_page_count(file_path: str) -> int:
+    """Number of pages in a PDF; runs in a parse worker"""
+    return len(PdfReader(file_path).pages)
+
+def read_pdf_pages(file_path: str, start: int, stop: int) -> List[str]:
+    """Text of pages [start, stop) of a PDF; runs in a parse worker"""
+    reader = PdfReader(file_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+def read_docx_paragraphs(file_path: str) -> List[str]:
+    """Paragraph texts of a DOCX file; runs in a parse worker"""
+    return [para.text for para in docx.Document(file_path).paragraphs]
+
+def submit_parse_task(fn: Callable, *args) -> Future:
+    """Run a parse function on the process pool, or inline when PARSE_WORKERS is 0"""
+    if parse_executor is not None:
+        return parse_executor.submit(fn, *args)
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def warm_parse_pool() -> None:
+    """Fork the parse workers up front, before the process starts its worker threads"""
+    if parse_executor is not None:
+        for _ in range(PARSE_WORKERS):
+            parse_executor.submit(os.getpid)
+
+def iter_pdf_pages(file_path: str, on_page: Optional[Callable[[int, int], None]] = None) -> Iterator[str]:
+    """Yield a PDF's page texts in order while later page ranges are parsed on other workers"""
+    total_pages = submit_parse_task(read_pdf_page_count, file_path).result()
+    starts = iter(range(0, total_pages, PDF_PAGES_PER_TASK))
+    pending = deque(
+        submit_parse_task(read_pdf_pages, file_path, start, min(start + PDF_PAGES_PER_TASK, total_pages))
+        for start in islice(starts, PARSE_QUEUE_DEPTH)
+    )
+    parsed = 0
+    try:
+        while pending:
+            pages = pending.popleft().result()
+            start = next(starts, None)
+            if start is not None:
+                pending.append(submit_parse_task(read_pdf_pages, file_path, start, min(start + PDF_PAGES_PER_TASK, total_pages)))
+            parsed += len(pages)
+            if on_page:
+                on_page(parsed, total_pages)
+            yield from pages
+    finally:
+        # The consumer stopped early; don't parse pages nobody will read
+        for future in pending:
+            future.cancel()
+
+def iter_document_sections(file_path: str, file_extension: str, text_extensions: Iterable[str],
+                           on_page: Optional[Callable[[int, int], None]] = None) -> Iterator[str]:
+    """Yield a file's text a page (PDF) or paragraph group (DOCX) at a time, reporting (parsed, total) to on_page"""
+    try:
+        if file_extension in text_extensions:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            if on_page:
+                on_page(1, 1)
+            yield text
+        elif file_extension == '.pdf':
+            for page_text in iter_pdf_pages(file_path, on_page):
+                if page_text:
+                    yield page_text + "\n"
+        elif file_extension == '.docx':
+            paragraphs = submit_parse_task(read_docx_paragraphs, file_path).result()
+            total_groups = max(1, -(-len(paragraphs) // DOCX_PARAGRAPH_GROUP))
+            for group_number, group_start in enumerate(range(0, len(paragraphs), DOCX_PARAGRAPH_GROUP), start=1):
+                group_text = "\n".join(paragraphs[group_start:group_start + DOCX_PARAGRAPH_GROUP])
+                if on_page:
+                    on_page(group_number, total_groups)
+                if group_text.strip():
+                    yield group_text + "\n"
+        else:
+            raise ValueError(f"Unsupported file type: {file_extension}")
+    except Exception as e:
+        print(f"Error extracting text from {file_path}: {str(e)}")
+        raise
+
+class IngestionJobs:
+    """
+    Registry of background ingestion jobs. run() parses, chunks and indexes one
+    uploaded file through index_chunks(chunks, target, filename, on_progress),
+    reporting progress on the job record, and always removes the file. Without a
+    chunker and index function it is only a registry, and callers report through
+    update() and finish() themselves.
+    Finished jobs are forgotten INGESTION_JOB_TTL seconds after they finish.
+    Records live in this process; SqliteIngestionJobs shares them between workers.
+    """
+    def __init__(self, chunker=None, index_chunks: Optional[Callable] = None, text_extensions: Iterable[str] = (),
+                 ttl: int = INGESTION_JOB_TTL, id_length: int = 32):
+        self.chunker = chunker
+        self.index_chunks = index_chunks
+        self.text_extensions = set(text_extensions)
+        self.ttl = ttl
+        self.id_length = id_length
+        self.jobs: Dict[str, dict] = {}
+        self.finished: Dict[str, Event] = {}  # Set once a job is done or failed
+        self.lock = Lock()
+
+    def prune(self, now: float) -> None:
+        """Forget finished jobs nobody has polled for a while; caller holds the lock"""
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job["finished_at"] and now - job["finished_at"] > self.ttl
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+            del self.finished[job_id]
+
+    def load(self, job_id: str) -> Optional[dict]:
+        """A job's record; caller holds the lock"""
+        return self.jobs.get(job_id)
+
+    def save(self, job: dict) -> None:
+        """Store a job's record; caller holds the lock"""
+        self.jobs[job["job_id"]] = job
+
+    def records(self) -> Iterable[dict]:
+        """Every job's record; caller holds the lock"""
+        return self.jobs.values()
+
+    def create(self, filename: str, **fields) -> dict:
+        """Register a queued job for filename, with extra fields such as its owner, and return its record"""
+        now = time.time()
+        job_id = uuid.uuid4().hex[:self.id_length]
+        with self.lock:
+            self.prune(now)
+            job = {
+                "job_id": job_id,
+                **fields,
+                "filename": filename,
+                "status": "queued",
+                "pages_parsed": 0,
+                "pages_total": None,
+                "chunks_embedded": 0,
+                "chunks_total": None,
+                "error": None,
+                "created_at": now,
+                "started_at": None,
+                "finished_at": None
+            }
+            self.save(job)
+            self.finished[job_id] = Event()
+            return dict(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Return a snapshot of a job's status"""
+        with self.lock:
+            job = self.load(job_id)
+            return dict(job) if job else None
+
+    def update(self, job_id: str, **fields) -> None:
+        """Update fields of a job"""
+        with self.lock:
+            job = self.load(job_id)
+            if job is not None:
+                job.update(fields)
+                self.save(job)
+
+    def finish(self, job_id: str, status: str, **fields) -> None:
+        """Mark a job done or failed and wake up anyone waiting for it"""
+        self.update(job_id, status=status, finished_at=time.time(), **fields)
+        with self.lock:
+            finished = self.finished.get(job_id)
+        if finished is not None:
+            finished.set()
+
+    def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        """Wait up to timeout seconds for a job to finish and return its status"""
+        with self.lock:
+            finished = self.finished.get(job_id)
+        if finished is not None:
+            finished.wait(timeout)
+        return self.get(job_id)
+
+    def has_pending(self, **fields) -> bool:
+        """Whether any matching job is still queued or running"""
+        with self.lock:
+            return any(
+                job["finished_at"] is None and all(job.get(key) == value for key, value in fields.items())
+                for job in self.records()
+            )
+
+    def find(self, **fields) -> List[dict]:
+        """Snapshots of the jobs whose fields match, e.g. find(chat_id=...)"""
+        with self.lock:
+            self.prune(time.time())
+            return [
+                dict(job) for job in self.records()
+                if all(job.get(key) == value for key, value in fields.items())
+            ]
+
+    def run(self, job_id: str, file_path: str, target: str) -> None:
+        """Parse, chunk and index a job's file into target's index, then remove the file"""
+        job = self.get(job_id)
+        file_extension = os.path.splitext(job["filename"])[1].lower()
+        self.update(job_id, status="running", started_at=time.time())
+        try:
+            sections = iter_document_sections(
+                file_path,
+                file_extension,
+                self.text_extensions,
+                on_page=lambda parsed, total: self.update(job_id, pages_parsed=parsed, pages_total=total)
+            )
+            self.index_chunks(
+                self.chunker.chunk_sections(sections, file_extension),
+                target,
+                job["filename"],
+                on_progress=lambda embedded, total: self.update(job_id, chunks_embedded=embedded, chunks_total=total)
+            )
+            status, error = "done", None
+        except Exception as e:
+            print(f"Ingestion job {job_id} failed: {str(e)}")
+            status, error = "failed", str(e)
+        finally:
+            if os.path.exists(file_path):
+                os.unlink(file_path)
+        self.finish(job_id, status, error=error)
+
+class SqliteIngestionJobs(IngestionJobs):
+    """
+    IngestionJobs whose records live in a SQLite database in WAL mode, so a job run
+    by one worker process can be polled through any other. wait() only blocks on
+    jobs this process runs; for the others it returns their current status.
+    """
+    def __init__(self, path: str, chunker=None, index_chunks: Optional[Callable] = None, text_extensions: Iterable[str] = (),
+                 ttl: int = INGESTION_JOB_TTL, id_length: int = 32):
+        super().__init__(chunker, index_chunks, text_extensions, ttl, id_length)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS ingestion_jobs (job_id TEXT PRIMARY KEY, record TEXT NOT NULL, finished_at REAL)"
+        )
+        self.db.commit()
+
+    def load(self, job_id: str) -> Optional[dict]:
+        row = self.db.execute("SELECT record FROM ingestion_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, job: dict) -> None:
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO ingestion_jobs (job_id, record, finished_at) VALUES (?, ?, ?)",
+                (job["job_id"], json.dumps(job), job["finished_at"])
+            )
+
+    def records(self) -> Iterable[dict]:
+        return [json.loads(record) for record, in self.db.execute("SELECT record FROM ingestion_jobs")]
+
+    def prune(self, now: float) -> None:
+        """Forget finished jobs past the TTL, whichever worker ran them; caller holds the lock"""
+        with self.db:
+            self.db.execute("DELETE FROM ingestion_jobs WHERE finished_at < ?", (now - self.ttl,))
+        for job_id in [job_id for job_id, finished in self.finished.items() if finished.is_set()]:
+            del self.finished[job_id]
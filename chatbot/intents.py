@@ -0,0 +1,199 @@
+"""
+Intent detection shared by the Flask app and the Telegram bot.
+
+A local nearest-centroid classifier over the sentence embeddings is used as a
+fast path before the LLM: confident single-sentence messages are decided
+in-process, the rest (and a sample of the fast-path ones, to measure
+agreement) go to the Groq model.
+"""
+import json
+import os
+import random
+import re
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from groq_http import GROQ_TIMEOUTS
+
+INTENT_FAST_PATH_THRESHOLD = float(os.getenv("INTENT_FAST_PATH_THRESHOLD", "0.6"))
+INTENT_FAST_PATH_MARGIN = float(os.getenv("INTENT_FAST_PATH_MARGIN", "0.05"))
+INTENT_FAST_PATH_MAX_CHARS = int(os.getenv("INTENT_FAST_PATH_MAX_CHARS", "200"))
+INTENT_SHADOW_SAMPLE_RATE = float(os.getenv("INTENT_SHADOW_SAMPLE_RATE", "0.05"))  # Share of fast-path decisions re-checked by the LLM
+INTENT_EXAMPLES = {
+    "greeting": [
+        "hi", "hello", "hey there", "good morning", "how are you?", "thanks, bye"
+    ],
+    "code_explanation": [
+        "what does this code do", "explain this function", "why does this loop run twice",
+        "what is this line doing", "explain how this snippet works", "walk me through this code"
+    ],
+    "code_generation": [
+        "write a function to reverse a string", "generate a python script that reads a csv file",
+        "create a REST API in flask", "give me code for binary search", "implement a linked list in java",
+        "write a program to check if a number is prime"
+    ],
+    "debug_help": [
+        "why am I getting a NullPointerException", "fix this error", "my code throws IndexError",
+        "this function returns the wrong result", "help me debug my program", "TypeError: undefined is not a function"
+    ],
+    "optimization": [
+        "make this code faster", "optimize this query", "how can I reduce the time complexity",
+        "improve the performance of this loop", "this function uses too much memory", "speed up my algorithm"
+    ],
+    "learning_path": [
+        "how should I start learning python", "what should I learn after javascript", "roadmap to become a web developer",
+        "best resources to learn data structures", "which course should I take for machine learning", "how do I prepare for coding interviews"
+    ],
+    "code_review": [
+        "review my code", "is this good practice", "can you check my code for issues",
+        "give feedback on this implementation", "how can I make this code cleaner", "is my solution correct"
+    ],
+    "teaching": [
+        "what is recursion", "explain list comprehension", "teach me object oriented programming",
+        "what is the difference between a list and a tuple", "how do pointers work", "explain big O notation"
+    ],
+    "non_coding": [
+        "what is the weather today", "tell me a joke", "who won the football match",
+        "what is the capital of france", "recommend a movie", "how do I cook pasta"
+    ]
+}
+INTENT_SYSTEM_PROMPT = (
+    "You are an AI that classifies user queries about programming and coding.\n"
+    "Classify the intent into one of these categories:\n"
+    "1. greeting - Simple greetings or small talk\n"
+    "2. code_explanation - Requests to explain code concepts or existing code\n"
+    "3. code_generation - Requests to write new code\n"
+    "4. debug_help - Requests to debug or fix code\n"
+    "5. optimization - Requests to optimize existing code\n"
+    "6. learning_path - Requests for learning resources or paths\n"
+    "7. code_review - Requests to review existing code\n"
+    "8. teaching - Requests to teach or explain programming concepts\n"
+    "9. non_coding - Anything not related to programming\n"
+    "10. if the user gives a code as input, mark it as code_explanation\n"
+    "Reply in JSON format: [{\"query\": \"user message\", \"intent\": \"detected_intent\"}]\n"
+    "If the query contains multiple intents, split them into separate items."
+)
+
+def is_single_request(text: str) -> bool:
+    """Whether a message is short and single-sentence, so there is nothing for the LLM to split"""
+    if len(text) > INTENT_FAST_PATH_MAX_CHARS or "\n" in text or "```" in text:
+        return False
+    return len(re.findall(r"[.?!](?:\s|$)", text.strip())) <= 1
+
+class IntentClassifier:
+    """
+    Detects the intents of a message, locally when the nearest-centroid classifier
+    is confident and with the Groq model otherwise.
+    encode_query, when given, embeds one query as a normalized (1, dim) array; the
+    app passes its memoised encoder so classification shares the retrieval cache.
+    """
+    def __init__(self, client, embedding_model, encode_query: Optional[Callable[[str], np.ndarray]] = None):
+        self.client = client
+        self.embedding_model = embedding_model
+        self.encode_query = encode_query or (
+            lambda text: embedding_model.encode(text, normalize_embeddings=True).reshape(1, -1).astype("float32")
+        )
+        self.centroids = None
+        self.centroids_lock = Lock()
+        self.stats = {"messages": 0, "fast_path": 0, "llm": 0, "compared": 0, "agreed": 0}
+        self.stats_lock = Lock()
+        self.shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="intent-shadow")
+
+    def detect_llm(self, text: str) -> List[Dict[str, str]]:
+        """
+        Detect intent of user query using Llama3-70b-8192
+        Returns list of detected intents and queries
+        """
+        prompt = [
+            {"role": "system", "content": INTENT_SYSTEM_PROMPT},
+            {"role": "user", "content": f"User message: {text}"}
+        ]
+        try:
+            response = self.client.chat.completions.create(
+                model="llama3-70b-8192",
+                messages=prompt,
+                response_format={"type": "json_object"},
+                temperature=0.2,
+                timeout=GROQ_TIMEOUTS["intent"]
+            )
+
+            result = json.loads(response.choices[0].message.content)
+            if isinstance(result, dict):
+                result = [result]  # Convert single item to list
+            return result
+        except Exception as e:
+            print("Intent detection error:", e)
+            return [{"query": text, "intent": "non_coding"}]
+
+    def build_centroids(self) -> tuple:
+        """Embed the labelled examples and average them into one unit-length centroid per intent"""
+        labels = list(INTENT_EXAMPLES)
+        centroids = []
+        for intent in labels:
+            embeddings = self.embedding_model.encode(INTENT_EXAMPLES[intent], normalize_embeddings=True, convert_to_numpy=True)
+            centroid = embeddings.mean(axis=0)
+            centroids.append(centroid / np.linalg.norm(centroid))
+        return labels, np.stack(centroids).astype("float32")
+
+    def classify_locally(self, text: str) -> tuple:
+        """Nearest-centroid intent with its similarity and margin over the runner-up"""
+        with self.centroids_lock:
+            if self.centroids is None:
+                self.centroids = self.build_centroids()
+            labels, centroids = self.centroids
+
+        scores = centroids @ self.encode_query(text)[0]
+        ranked = np.argsort(scores)[::-1]
+        best, runner_up = ranked[0], ranked[1]
+        return labels[best], float(scores[best]), float(scores[best] - scores[runner_up])
+
+    def record_agreement(self, local_intent: str, llm_result: List[Dict[str, str]]) -> None:
+        """Count whether a single-intent LLM classification matches the local one"""
+        if len(llm_result) != 1:
+            return
+        with self.stats_lock:
+            self.stats["compared"] += 1
+            if llm_result[0].get("intent") == local_intent:
+                self.stats["agreed"] += 1
+
+    def shadow_check(self, text: str, local_intent: str) -> None:
+        """Classify a fast-path message with the LLM too, purely to measure agreement"""
+        self.record_agreement(local_intent, self.detect_llm(text))
+
+    def detect(self, text: str) -> List[Dict[str, str]]:
+        """
+        Detect intent locally when the classifier is confident, otherwise fall back to the LLM
+        Returns list of detected intents and queries
+        """
+        with self.stats_lock:
+            self.stats["messages"] += 1
+
+        if not is_single_request(text):
+            with self.stats_lock:
+                self.stats["llm"] += 1
+            return self.detect_llm(text)
+
+        local_intent, confidence, margin = self.classify_locally(text)
+        if confidence >= INTENT_FAST_PATH_THRESHOLD and margin >= INTENT_FAST_PATH_MARGIN:
+            with self.stats_lock:
+                self.stats["fast_path"] += 1
+            if random.random() < INTENT_SHADOW_SAMPLE_RATE:
+                self.shadow_executor.submit(self.shadow_check, text, local_intent)
+            return [{"query": text, "intent": local_intent}]
+
+        with self.stats_lock:
+            self.stats["llm"] += 1
+        result = self.detect_llm(text)
+        self.record_agreement(local_intent, result)
+        return result
+
+    def get_stats(self) -> dict:
+        """Fast-path hit rate and agreement rate of the local intent classifier against the LLM"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats["fast_path_rate"] = stats["fast_path"] / stats["messages"] if stats["messages"] else 0.0
+        stats["agreement_rate"] = stats["agreed"] / stats["compared"] if stats["compared"] else None
+        return stats
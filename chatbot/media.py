@@ -0,0 +1,124 @@
+"""
+Image preprocessing and base64 encoding for vision calls, shared by the Flask app
+and both Telegram bots.
+
+Images are downscaled before the vision call so the longest side is at most
+VISION_MAX_SIDE pixels (the vision models tile images at 560px, 2x2 tiles at most)
+and re-encoded: PNG for screenshots so text stays sharp, JPEG otherwise.
+VISION_GRAYSCALE converts screenshots ("screenshots"), every image ("always") or
+nothing ("never") to grayscale.
+"""
+import base64
+import io
+import os
+import time
+from threading import Lock
+
+from PIL import Image, ImageOps
+
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "1120"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "85"))
+VISION_GRAYSCALE = os.getenv("VISION_GRAYSCALE", "never")
+SCREENSHOT_FORMATS = {"PNG", "GIF", "BMP"}
+MEDIA_READ_CHUNK = 3 * 64 * 1024  # A multiple of 3 so each chunk base64-encodes without padding
+image_stats = {"images": 0, "resized": 0, "bytes_in": 0, "bytes_out": 0, "prepare_ms_total": 0.0}
+image_stats_lock = Lock()
+
+class MediaTooLargeError(ValueError):
+    """Raised when an audio or image upload is over its size cap"""
+
+def encode_data_url(stream, size: int, mime_type: str) -> str:
+    """Base64-encode a stream into a data URL, chunk by chunk into one preallocated buffer"""
+    prefix = f"data:{mime_type};base64,".encode("ascii")
+    buffer = bytearray(len(prefix) + 4 * -(-size // 3))
+    view = memoryview(buffer)
+    view[:len(prefix)] = prefix
+    offset = len(prefix)
+    pending = b""
+    while True:
+        data = stream.read(MEDIA_READ_CHUNK)
+        chunk = pending + data if pending else data
+        # A short read's last one or two bytes are carried into the next chunk,
+        # so padding only ever appears at the end of the stream
+        whole = len(chunk) - len(chunk) % 3 if data else len(chunk)
+        pending = chunk[whole:]
+        encoded = base64.b64encode(memoryview(chunk)[:whole])
+        if offset + len(encoded) > len(buffer):
+            raise MediaTooLargeError(f"Upload grew past its declared {size} bytes")
+        view[offset:offset + len(encoded)] = encoded
+        offset += len(encoded)
+        if not data:
+            break
+    return str(view[:offset], "ascii")
+
+def prepare_image(stream, size: int, mime_type: str) -> tuple:
+    """
+    Downscale and re-encode an image for the vision model.
+    Returns (stream, size, mime type) of the prepared image, or of the original when
+    it can't be decoded or re-encoding would not make it smaller.
+    """
+    start_time = time.perf_counter()
+    output = None
+    resized = False
+    try:
+        image = Image.open(stream)
+        screenshot = image.format in SCREENSHOT_FORMATS
+        # Large JPEGs are decoded straight at a reduced scale
+        image.draft("RGB", (VISION_MAX_SIDE, VISION_MAX_SIDE))
+        image = ImageOps.exif_transpose(image)
+        if max(image.size) > VISION_MAX_SIDE:
+            image.thumbnail((VISION_MAX_SIDE, VISION_MAX_SIDE), Image.LANCZOS)
+            resized = True
+
+        grayscale = VISION_GRAYSCALE == "always" or (VISION_GRAYSCALE == "screenshots" and screenshot)
+        output = io.BytesIO()
+        if screenshot:
+            has_alpha = "A" in image.getbands() or "transparency" in image.info
+            if grayscale:
+                image = image.convert("LA" if has_alpha else "L")
+            else:
+                # Screenshots survive a 256-colour palette, which keeps the PNG small after resampling
+                image = image.convert("RGBA" if has_alpha else "RGB").quantize(256, method=Image.Quantize.FASTOCTREE)
+            image.save(output, format="PNG", optimize=True)
+            prepared_type = "image/png"
+        else:
+            image.convert("L" if grayscale else "RGB").save(output, format="JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+            prepared_type = "image/jpeg"
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        print(f"Image preprocessing skipped: {str(e)}")
+        output = None
+
+    original_size = size
+    if output is not None and output.tell() < size:
+        stream, size, mime_type = output, output.tell(), prepared_type
+    stream.seek(0)
+
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    with image_stats_lock:
+        image_stats["images"] += 1
+        image_stats["resized"] += resized
+        image_stats["bytes_in"] += original_size
+        image_stats["bytes_out"] += size
+        image_stats["prepare_ms_total"] += elapsed_ms
+    print(f"Prepared image: {original_size} -> {size} bytes ({mime_type}) in {elapsed_ms:.0f}ms")
+    return stream, size, mime_type
+
+def prepare_image_bytes(image_bytes: bytes, mime_type: str) -> tuple:
+    """prepare_image for an image already in memory; returns (bytes, mime type)"""
+    stream, _, mime_type = prepare_image(io.BytesIO(image_bytes), len(image_bytes), mime_type)
+    return stream.getvalue(), mime_type
+
+def get_image_stats() -> dict:
+    """Vision payload bytes saved by image preprocessing"""
+    with image_stats_lock:
+        stats = dict(image_stats)
+    images = stats["images"] or 1
+    return {
+        "images": stats["images"],
+        "resized": stats["resized"],
+        "bytes_in": stats["bytes_in"],
+        "bytes_out": stats["bytes_out"],
+        "bytes_saved": stats["bytes_in"] - stats["bytes_out"],
+        "saved_rate": round(1 - stats["bytes_out"] / stats["bytes_in"], 3) if stats["bytes_in"] else 0.0,
+        "prepare_avg_ms": round(stats["prepare_ms_total"] / images, 2),
+    }
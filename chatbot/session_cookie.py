@@ -0,0 +1,49 @@
+"""
+Cookie-identified sessions for the Flask app.
+
+Sessions are identified by a random id in a cookie, so every worker process sees
+the same id for a client. The React frontend (localhost:3000) calls the API on
+127.0.0.1:8000, which browsers treat as a different site, so the cookie defaults
+to SameSite=None; Secure. Set SESSION_COOKIE_SAMESITE=Lax and
+SESSION_COOKIE_SECURE=false when the app is only used from its own pages over
+plain HTTP.
+"""
+import os
+import re
+import uuid
+from typing import Optional
+
+from flask import Flask, g, request
+
+SESSION_COOKIE_NAME = "session_id"
+SESSION_COOKIE_MAX_AGE = int(os.getenv("SESSION_COOKIE_MAX_AGE", str(30 * 24 * 3600)))
+SESSION_COOKIE_SAMESITE = os.getenv("SESSION_COOKIE_SAMESITE", "None")  # "None", "Lax" or "Strict"
+# Browsers drop SameSite=None cookies that are not Secure
+SESSION_COOKIE_SECURE = os.getenv("SESSION_COOKIE_SECURE", "true").lower() == "true" or SESSION_COOKIE_SAMESITE == "None"
+SESSION_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+def get_cookie_session_id() -> Optional[str]:
+    """Session id from the request cookie, or None when it is missing or malformed"""
+    session_id = request.cookies.get(SESSION_COOKIE_NAME, "")
+    return session_id if SESSION_ID_PATTERN.fullmatch(session_id) else None
+
+def get_session_id() -> str:
+    """Session id from the request cookie; new clients get a fresh id that set_session_cookie sends back"""
+    session_id = get_cookie_session_id()
+    if session_id:
+        return session_id
+    if "new_session_id" not in g:
+        g.new_session_id = uuid.uuid4().hex
+    return g.new_session_id
+
+def set_session_cookie(response):
+    if "new_session_id" in g:
+        response.set_cookie(
+            SESSION_COOKIE_NAME, g.new_session_id, max_age=SESSION_COOKIE_MAX_AGE, httponly=True,
+            samesite=SESSION_COOKIE_SAMESITE, secure=SESSION_COOKIE_SECURE
+        )
+    return response
+
+def init_session_cookie(app: Flask) -> None:
+    """Send the cookie for sessions created while handling a request"""
+    app.after_request(set_session_cookie)
@@ -0,0 +1,300 @@
+"""
+Bounded chat-history stores shared by the Flask app and both Telegram bots.
+
+SessionStore keeps histories in this process; SqliteSessionStore keeps them in a
+SQLite database that several worker processes can share. Both evict sessions
+after SESSION_TTL idle seconds, or least recently used first past either cap.
+"""
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, List, Optional
+
+from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+SESSION_TTL = int(os.getenv("SESSION_TTL", "21600"))
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "10000"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+SESSION_MESSAGE_OVERHEAD = 1024  # Approximate bytes per message object besides its text
+SESSION_EVICTION_INTERVAL = int(os.getenv("SESSION_EVICTION_INTERVAL", "10"))
+
+class SessionStore:
+    """
+    Chat histories kept in least-recently-used order with an idle TTL, a session cap and a byte cap
+    Sessions that a request is using are never evicted; sizes are estimates of message text plus object overhead
+    """
+    def __init__(self, max_sessions: int, max_bytes: int, ttl: float, on_evict: Optional[Callable[[str], None]] = None):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.histories: "OrderedDict[str, ChatMessageHistory]" = OrderedDict()
+        self.last_used: Dict[str, float] = {}
+        self.sizes: Dict[str, int] = {}
+        self.in_use: Dict[str, int] = {}
+        self.total_bytes = 0
+        self.lock = Lock()
+        self.stats = {"created": 0, "expired": 0, "evicted": 0}
+    
+    def get(self, session_id: str) -> ChatMessageHistory:
+        """Get or create a session's history and mark it as recently used"""
+        with self.lock:
+            history = self.histories.get(session_id)
+            if history is None:
+                history = self.histories[session_id] = ChatMessageHistory()
+                self.sizes[session_id] = 0
+                self.stats["created"] += 1
+            self.touch(session_id)
+            evicted = self.evict()
+        self.notify(evicted)
+        return history
+    
+    def peek(self, session_id: str) -> Optional[ChatMessageHistory]:
+        """Get a session's history without creating it or changing its recency"""
+        with self.lock:
+            return self.histories.get(session_id)
+    
+    @contextmanager
+    def use(self, session_id: str):
+        """Pin a session for the length of a request and re-measure it afterwards"""
+        with self.lock:
+            self.in_use[session_id] = self.in_use.get(session_id, 0) + 1
+        try:
+            yield self.get(session_id)
+        finally:
+            with self.lock:
+                self.in_use[session_id] -= 1
+                if not self.in_use[session_id]:
+                    del self.in_use[session_id]
+                history = self.histories.get(session_id)
+                if history is not None:
+                    size = sum(sys.getsizeof(msg.content) for msg in history.messages) + SESSION_MESSAGE_OVERHEAD * len(history.messages)
+                    self.total_bytes += size - self.sizes[session_id]
+                    self.sizes[session_id] = size
+                    self.touch(session_id)
+                evicted = self.evict()
+            self.notify(evicted)
+    
+    def pop(self, session_id: str) -> None:
+        """Forget a session"""
+        with self.lock:
+            if session_id in self.histories:
+                self.remove(session_id)
+    
+    def load_summary(self, session_id: str) -> Optional[tuple]:
+        """Running summaries of in-process sessions live only in SummaryMemory"""
+        return None
+    
+    def save_summary(self, session_id: str, summary: str, summarized: int) -> None:
+        pass
+    
+    def touch(self, session_id: str) -> None:
+        self.histories.move_to_end(session_id)
+        self.last_used[session_id] = time.time()
+    
+    def remove(self, session_id: str) -> None:
+        del self.histories[session_id]
+        del self.last_used[session_id]
+        self.total_bytes -= self.sizes.pop(session_id)
+    
+    def evict(self) -> List[str]:
+        """Drop expired sessions, then least recently used ones while a cap is exceeded; called with the lock held"""
+        evicted = []
+        expire_before = time.time() - self.ttl
+        for session_id in list(self.histories):
+            over_cap = len(self.histories) > self.max_sessions or self.total_bytes > self.max_bytes
+            expired = self.last_used[session_id] < expire_before
+            if not over_cap and not expired:
+                break  # Everything after this is more recent
+            if session_id in self.in_use:
+                continue
+            self.remove(session_id)
+            self.stats["expired" if expired else "evicted"] += 1
+            evicted.append(session_id)
+        return evicted
+    
+    def notify(self, evicted: List[str]) -> None:
+        if self.on_evict:
+            for session_id in evicted:
+                self.on_evict(session_id)
+    
+    def get_stats(self) -> dict:
+        """Gauges of live sessions and their estimated memory"""
+        with self.lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self.histories),
+                "in_use": len(self.in_use),
+                "bytes": self.total_bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                **self.stats
+            }
+
+class SqliteChatMessageHistory(BaseChatMessageHistory):
+    """History of one session, read from and appended to the shared session database"""
+    def __init__(self, store: "SqliteSessionStore", session_id: str):
+        self.store = store
+        self.session_id = session_id
+    
+    @property
+    def messages(self) -> List[BaseMessage]:
+        with self.store.lock:
+            rows = self.store.db.execute(
+                "SELECT message FROM session_messages WHERE session_id = ? ORDER BY id", (self.session_id,)
+            ).fetchall()
+        return messages_from_dict([json.loads(row[0]) for row in rows])
+    
+    def add_messages(self, messages: List[BaseMessage]) -> None:
+        rows = [(self.session_id, json.dumps(message_to_dict(message))) for message in messages]
+        with self.store.lock, self.store.db:
+            self.store.db.execute(
+                "INSERT INTO sessions (session_id, last_used, bytes) VALUES (?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET last_used = excluded.last_used, bytes = bytes + excluded.bytes",
+                (self.session_id, time.time(), sum(len(row[1]) for row in rows))
+            )
+            self.store.db.executemany("INSERT INTO session_messages (session_id, message) VALUES (?, ?)", rows)
+    
+    def clear(self) -> None:
+        self.store.pop(self.session_id)
+
+class SqliteSessionStore:
+    """
+    Session histories and running summaries in a SQLite database in WAL mode, shared by all worker processes
+    Has the same methods as SessionStore. They map onto a Redis-like store as one list of messages per
+    session (RPUSH/LRANGE), one hash for its summary and last use (HSET/HGETALL) and EXPIRE for the idle TTL.
+    Only this process's in-flight requests are protected from eviction.
+    """
+    def __init__(self, path: str, max_sessions: int, max_bytes: int, ttl: float, on_evict: Optional[Callable[[str], None]] = None,
+                 eviction_interval: float = SESSION_EVICTION_INTERVAL):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.in_use: Dict[str, int] = {}
+        self.eviction_interval = eviction_interval
+        self.next_eviction = 0.0
+        self.lock = Lock()
+        self.stats = {"expired": 0, "evicted": 0}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                last_used REAL NOT NULL,
+                bytes INTEGER NOT NULL DEFAULT 0,
+                summary TEXT NOT NULL DEFAULT '',
+                summarized INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used);
+            CREATE TABLE IF NOT EXISTS session_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                message TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS session_messages_session ON session_messages (session_id, id);
+        """)
+        self.db.commit()
+    
+    def get(self, session_id: str) -> SqliteChatMessageHistory:
+        """Get a session's history; the session row is created by its first message"""
+        return SqliteChatMessageHistory(self, session_id)
+    
+    def peek(self, session_id: str) -> Optional[SqliteChatMessageHistory]:
+        """Get a session's history if the session exists"""
+        with self.lock:
+            exists = self.db.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return SqliteChatMessageHistory(self, session_id) if exists else None
+    
+    @contextmanager
+    def use(self, session_id: str):
+        """Pin a session for the length of a request and refresh its last use afterwards"""
+        with self.lock:
+            self.in_use[session_id] = self.in_use.get(session_id, 0) + 1
+        try:
+            yield self.get(session_id)
+        finally:
+            with self.lock:
+                self.in_use[session_id] -= 1
+                if not self.in_use[session_id]:
+                    del self.in_use[session_id]
+                with self.db:
+                    self.db.execute("UPDATE sessions SET last_used = ? WHERE session_id = ?", (time.time(), session_id))
+                evicted = self.evict()
+            self.notify(evicted)
+    
+    def pop(self, session_id: str) -> None:
+        """Forget a session"""
+        with self.lock, self.db:
+            self.remove(session_id)
+    
+    def load_summary(self, session_id: str) -> Optional[tuple]:
+        """Stored (summary, number of messages it covers) of a session, if any"""
+        with self.lock:
+            row = self.db.execute("SELECT summary, summarized FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return tuple(row) if row and row[0] else None
+    
+    def save_summary(self, session_id: str, summary: str, summarized: int) -> None:
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE sessions SET summary = ?, summarized = ? WHERE session_id = ?", (summary, summarized, session_id)
+            )
+    
+    def remove(self, session_id: str) -> None:
+        self.db.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+        self.db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+    
+    def evict(self) -> List[str]:
+        """
+        Drop expired sessions, then least recently used ones while a cap is exceeded; called with the lock held
+        Runs at most every eviction_interval seconds per process since every worker shares the work
+        """
+        now = time.time()
+        if now < self.next_eviction:
+            return []
+        self.next_eviction = now + self.eviction_interval
+        
+        count, total_bytes = self.db.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM sessions").fetchone()
+        evicted = []
+        with self.db:
+            rows = self.db.execute("SELECT session_id, last_used, bytes FROM sessions ORDER BY last_used")
+            for session_id, last_used, size in rows.fetchall():
+                over_cap = count > self.max_sessions or total_bytes > self.max_bytes
+                expired = last_used < now - self.ttl
+                if not over_cap and not expired:
+                    break  # Everything after this is more recent
+                if session_id in self.in_use:
+                    continue
+                self.remove(session_id)
+                count -= 1
+                total_bytes -= size
+                self.stats["expired" if expired else "evicted"] += 1
+                evicted.append(session_id)
+        return evicted
+    
+    def notify(self, evicted: List[str]) -> None:
+        if self.on_evict:
+            for session_id in evicted:
+                self.on_evict(session_id)
+    
+    def get_stats(self) -> dict:
+        """Gauges of live sessions and their stored size across all workers"""
+        with self.lock:
+            count, total_bytes = self.db.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM sessions").fetchone()
+            return {
+                "backend": "sqlite",
+                "sessions": count,
+                "in_use": len(self.in_use),
+                "bytes": total_bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                **self.stats
+            }
@@ -0,0 +1,137 @@
+"""
+Summary conversation memory shared by the Flask app and the Telegram bot.
+
+Recent turns are replayed verbatim within MEMORY_TOKEN_BUDGET and older turns
+are folded into a running summary by a small model in the background.
+MEMORY_MODE=buffer replays the full history.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Dict
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from groq_http import GROQ_TIMEOUTS
+
+MEMORY_MODE = os.getenv("MEMORY_MODE", "summary")
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "2000"))
+MEMORY_SUMMARY_MODEL = os.getenv("MEMORY_SUMMARY_MODEL", "llama3-8b-8192")
+MEMORY_SUMMARY_MAX_TOKENS = int(os.getenv("MEMORY_SUMMARY_MAX_TOKENS", "400"))
+MEMORY_SUMMARY_MESSAGE_CHARS = 2000  # Longer messages are truncated in the summarizer's input
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "2"))
+
+def estimate_tokens(text: str) -> int:
+    """Rough Llama 3 token count: about four characters per token plus per-message overhead"""
+    return len(text) // 4 + 4
+
+class SummaryMemory:
+    """
+    Running summaries of the sessions in a session store. Summaries are saved
+    through the store, so a SQLite store shares them between worker processes,
+    and forget() is registered as the store's eviction callback.
+    """
+    def __init__(self, client, session_store, mode: str = MEMORY_MODE, token_budget: int = MEMORY_TOKEN_BUDGET):
+        self.client = client
+        self.session_store = session_store
+        self.mode = mode
+        self.token_budget = token_budget
+        self.summaries: Dict[str, dict] = {}
+        self.lock = Lock()
+        self.executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="summary")
+        session_store.on_evict = self.forget
+
+    def forget(self, session_id: str) -> None:
+        """Drop the running summary of a session whose history is gone"""
+        with self.lock:
+            self.summaries.pop(session_id, None)
+
+    def get_prompt_history(self, session_id: str) -> list:
+        """
+        History messages to replay into a prompt
+        Recent turns are kept verbatim within the token budget; older turns are represented by the running summary
+        """
+        messages = list(self.session_store.get(session_id).messages)
+        if self.mode != "summary":
+            return messages
+
+        with self.lock:
+            state = self.summaries.get(session_id)
+            if state is None or state["summarized"] > len(messages):
+                # Another worker may already have summarized this session
+                summary, summarized = self.session_store.load_summary(session_id) or ("", 0)
+                if summarized > len(messages):
+                    summary, summarized = "", 0
+                state = self.summaries[session_id] = {"summary": summary, "summarized": summarized, "pending": False}
+            summary, summarized = state["summary"], state["summarized"]
+
+        # Walk back from the newest message until the budget is spent
+        budget = self.token_budget - (estimate_tokens(summary) if summary else 0)
+        start = len(messages)
+        while start > summarized:
+            cost = estimate_tokens(messages[start - 1].content)
+            if cost > budget:
+                break
+            budget -= cost
+            start -= 1
+        # Begin the window at a user message so no turn is split
+        while start < len(messages) and not isinstance(messages[start], HumanMessage):
+            start += 1
+
+        if start > summarized:
+            self.schedule_update(session_id, state, messages[summarized:start], start)
+
+        recent = messages[start:]
+        if summary:
+            return [SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")] + recent
+        return recent
+
+    def schedule_update(self, session_id: str, state: dict, messages: list, upto: int) -> None:
+        """Fold turns that fell out of the token budget into the summary, unless an update is already running"""
+        with self.lock:
+            if state["pending"]:
+                return
+            state["pending"] = True
+        self.executor.submit(self.update, session_id, state, messages, upto)
+
+    def update(self, session_id: str, state: dict, messages: list, upto: int) -> None:
+        """Merge older turns into a session's running summary; runs on the summary pool, off the request path"""
+        try:
+            transcript = "\n".join(
+                f"{'Student' if isinstance(msg, HumanMessage) else 'Assistant'}: {msg.content[:MEMORY_SUMMARY_MESSAGE_CHARS]}"
+                for msg in messages
+            )
+            response = self.client.chat.completions.create(
+                model=MEMORY_SUMMARY_MODEL,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": (
+                            "You maintain a running summary of a conversation between a student and a coding assistant. "
+                            "Merge the new turns into the existing summary. Keep the student's goals, the code and errors "
+                            "they shared, decisions made and open questions. Be concise and reply with the summary only."
+                        )
+                    },
+                    {
+                        "role": "user",
+                        "content": f"Existing summary:\n{state['summary'] or '(none)'}\n\nNew turns:\n{transcript}"
+                    }
+                ],
+                temperature=0.2,
+                max_tokens=MEMORY_SUMMARY_MAX_TOKENS,
+                timeout=GROQ_TIMEOUTS["summary"]
+            )
+            summary = response.choices[0].message.content.strip()
+            with self.lock:
+                # The session may have been cleared while the summary was generated
+                current = self.summaries.get(session_id) is state
+                if current:
+                    state["summary"] = summary
+                    state["summarized"] = upto
+            if current:
+                self.session_store.save_summary(session_id, summary, upto)
+        except Exception as e:
+            print("Summary update error:", e)
+        finally:
+            with self.lock:
+                state["pending"] = False
@@ -1,14 +1,17 @@
-import json
+import sys
 import re
 import os
+import time
+import asyncio
 import base64
-from typing import Dict, List, Optional
+from typing import Callable, Dict, Iterable, List, Optional
 from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
 from tempfile import NamedTemporaryFile
 import mimetypes
 
-from PyPDF2 import PdfReader
-import docx
 import faiss
 import numpy as np
 from sentence_transformers import SentenceTransformer
@@ -17,10 +20,10 @@ from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_groq import ChatGroq
 from langchain_core.output_parsers import StrOutputParser
-from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
+from langchain_core.runnables import Runnable
 
-from telegram import Update, Voice, PhotoSize, Document
+from telegram import Update, Voice, PhotoSize, Document, Message
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import (
     ApplicationBuilder,
     ContextTypes,
@@ -34,27 +37,82 @@ import groq
 from dotenv import load_dotenv
 load_dotenv()
 
-# Initialize Groq client
+# Modules shared with the Flask app live one directory up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from groq_http import GROQ_TIMEOUTS, create_groq_async_http_client, create_groq_http_client, get_groq_stats
+from session_store import SESSION_MAX_BYTES, SESSION_MAX_COUNT, SESSION_TTL, SessionStore
+from chunking import Chunker
+from media import get_image_stats, prepare_image_bytes
+from intents import IntentClassifier
+from ingestion import IngestionJobs, warm_parse_pool
+from chat_scheduler import ChatScheduler, ChatWork
+from summary_memory import SummaryMemory
+
+# Shared Groq HTTP layer: every Groq call goes through one keep-alive pool per client. Whisper and
+# vision calls are awaited on the event loop via async_client; intent detection and chat run on
+# the I/O pool and use the sync client
+groq_http_client = create_groq_http_client()
+groq_async_http_client = create_groq_async_http_client()
+
+# Initialize Groq clients
 groq_api_key = os.getenv("GROQ_API_KEY")
-client = groq.Client(api_key=groq_api_key) 
+client = groq.Client(api_key=groq_api_key, http_client=groq_http_client)
+async_client = groq.AsyncGroq(api_key=groq_api_key, http_client=groq_async_http_client)
 
 # Initialize embedding model for RAG
 embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
 
-# Global index and mapping for code documentation
-index = faiss.IndexFlatL2(384)
-id_to_text: Dict[int, str] = {}
-next_id = 0 
+# Per-chat vector indexes so each chat only searches its own uploads
+EMBEDDING_DIM = 384
+chat_indexes: Dict[str, "ChatIndex"] = {}
+chat_indexes_lock = Lock()
+
+# Number of chunks embedded per forward pass during ingestion
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+# Dedicated executors keep blocking work off the event loop: Groq calls and
+# everything waiting on them run on the I/O pool, query embeddings and image
+# preprocessing on the CPU pool, and document ingestion on its own pool so a
+# long upload never holds up the queries of other chats
+IO_WORKERS = int(os.getenv("IO_WORKERS", "32"))
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "2"))
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+ingestion_executor = ThreadPoolExecutor(max_workers=INGESTION_WORKERS, thread_name_prefix="ingestion")
+
+def encode_query(query: str) -> np.ndarray:
+    """Embed a query on the CPU pool, so however many I/O threads answer at once only CPU_WORKERS run the encoder"""
+    embedding = cpu_executor.submit(embedding_model.encode, query, normalize_embeddings=True).result()
+    return embedding.reshape(1, -1).astype("float32")
+
+# Confident single-sentence messages are classified in-process, the rest by the LLM (see intents.py)
+intent_classifier = IntentClassifier(client, embedding_model, encode_query)
+
+# Number of updates the Application processes at the same time
+TELEGRAM_CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_CONCURRENT_UPDATES", "64"))
+
+# Independent sub-queries of one message are answered concurrently on this pool
+SUBQUERY_WORKERS = int(os.getenv("SUBQUERY_WORKERS", "8"))
+subquery_executor = ThreadPoolExecutor(max_workers=SUBQUERY_WORKERS, thread_name_prefix="subquery")
+
+# Streaming replies: a placeholder message is edited as tokens arrive
+TELEGRAM_STREAMING = os.getenv("TELEGRAM_STREAMING", "true").lower() == "true"
+TELEGRAM_EDIT_INTERVAL = float(os.getenv("TELEGRAM_EDIT_INTERVAL", "1.0"))  # Seconds between edits of one reply
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Messages of one chat are handled in order on a per-chat queue; at most CHAT_QUEUE_DEPTH may wait
+CHAT_QUEUE_DEPTH = int(os.getenv("CHAT_QUEUE_DEPTH", "5"))
 
-# Session storage for conversation histories and processing locks
-session_histories: Dict[str, ChatMessageHistory] = {}
-session_locks: Dict[str, Lock] = {}
 
 # Initialize LangChain components
 chat_llm = ChatGroq(
     temperature=0.7,
     model_name="llama3-70b-8192",
-    groq_api_key=groq_api_key
+    groq_api_key=groq_api_key,
+    http_client=groq_http_client,
+    http_async_client=groq_async_http_client,
+    request_timeout=GROQ_TIMEOUTS["chat"]
 )
 
 # Supported file extensions
@@ -63,29 +121,23 @@ SUPPORTED_DOC_EXTENSIONS = {'.pdf', '.docx'}
 SUPPORTED_AUDIO_EXTENSIONS = {'.mp3', '.wav', '.m4a', '.ogg', '.oga', '.webm'}
 SUPPORTED_IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp'}
 
-def get_session_lock(chat_id: str) -> Lock:
-    """Get or create processing lock for a chat"""
-    if chat_id not in session_locks:
-        session_locks[chat_id] = Lock()
-    return session_locks[chat_id]
+# Uploads are chunked on code or sentence boundaries by embedding-model token count (see chunking.py)
+chunker = Chunker(embedding_model.tokenizer, SUPPORTED_TEXT_EXTENSIONS - {'.txt'})
+
+session_store = SessionStore(SESSION_MAX_COUNT, SESSION_MAX_BYTES, SESSION_TTL)
+# Recent turns are replayed within MEMORY_TOKEN_BUDGET, older ones as a running summary (see summary_memory.py)
+summary_memory = SummaryMemory(client, session_store)
 
 def get_session_history(chat_id: str) -> ChatMessageHistory:
     """Get or create chat history for a chat"""
-    if chat_id not in session_histories:
-        session_histories[chat_id] = ChatMessageHistory()
-    return session_histories[chat_id]
-
-def get_conversation_chain(chat_id: str, intent: str) -> LLMChain:
-    """Create appropriate LangChain chain based on intent"""
-    history = get_session_history(chat_id)
-    
-    # Common components
-    memory = ConversationBufferMemory(
-        return_messages=True,
-        memory_key="history",
-        chat_memory=history
-    )
-    
+    return session_store.get(chat_id)
+
+@lru_cache(maxsize=None)
+def build_conversation_chain(intent: str) -> Runnable:
+    """
+    Create appropriate LangChain chain based on intent, once per prompt
+    The chain takes "input" and "history"; callers commit the turn to chat history themselves
+    """
     # Base prompt template
     if intent == "greeting":
         prompt = ChatPromptTemplate.from_messages([
@@ -139,58 +191,11 @@ Guidelines:
             ("human", "{input}")
         ])
     
-    return LLMChain(
-        llm=chat_llm,
-        prompt=prompt,
-        memory=memory,
-        verbose=False
-    )
-
-def detect_intent_llm(text: str) -> List[Dict[str, str]]:
-    """
-    Detect intent of user query using Llama3-70b-8192
-    Returns list of detected intents and queries
-    """
-    prompt = [
-        {
-            "role": "system",
-            "content": (
-                "You are an AI that classifies user queries about programming and coding.\n"
-                "Classify the intent into one of these categories:\n"
-                "1. greeting - Simple greetings or small talk\n"
-                "2. code_explanation - Requests to explain code concepts or existing code\n"
-                "3. code_generation - Requests to write new code\n"
-                "4. debug_help - Requests to debug or fix code\n"
-                "5. optimization - Requests to optimize existing code\n"
-                "6. learning_path - Requests for learning resources or paths\n"
-                "7. code_review - Requests to review existing code\n"
-                "8. teaching - Requests to teach or explain programming concepts\n"
-                "9. non_coding - Anything not related to programming\n"
-                "Reply in JSON format: [{\"query\": \"user message\", \"intent\": \"detected_intent\"}]\n"
-                "If the query contains multiple intents, split them into separate items."
-            )
-        },
-        {
-            "role": "user",
-            "content": f"User message: {text}"
-        }
-    ]
-
-    try:
-        response = client.chat.completions.create(
-            model="llama3-70b-8192",
-            messages=prompt,
-            response_format={"type": "json_object"},
-            temperature=0.2
-        )
+    return prompt | chat_llm | StrOutputParser()
 
-        result = json.loads(response.choices[0].message.content)
-        if isinstance(result, dict):
-            result = [result]  # Convert single item to list
-        return result
-    except Exception as e:
-        print("Intent detection error:", e)
-        return [{"query": text, "intent": "non_coding"}]
+def get_conversation_chain(intent: str) -> Runnable:
+    """Get the shared chain for an intent; chains hold no chat state, so every chat reuses them"""
+    return build_conversation_chain(intent if intent in ["greeting", "non_coding", "teaching"] else "default")
 
 def clean_response(text: str) -> str:
     """Clean and format the LLM response"""
@@ -199,129 +204,333 @@ def clean_response(text: str) -> str:
     text = re.sub(r'\*(.*?)\*', r'\1', text)
     return text.strip()
 
-def store_and_index_text(text: str) -> None:
-    """Store text chunks in vector index"""
-    global next_id
-    chunks = [text[i:i+500] for i in range(0, len(text), 500)]
+class ChatIndex:
+    """Vector index, chunk texts and document membership for a single chat"""
     
-    for chunk in chunks:
-        embedding = embedding_model.encode(chunk, normalize_embeddings=True).astype("float32")
-        index.add(np.array([embedding]))
-        id_to_text[next_id] = chunk
-        next_id += 1
-
-def retrieve_relevant_text(query: str, top_k: int = 3) -> Optional[str]:
-    """Retrieve relevant text chunks using RAG"""
-    if next_id == 0:  # No documents indexed
+    def __init__(self):
+        self.index = faiss.IndexFlatL2(EMBEDDING_DIM)
+        self.chunks: List[str] = []
+        self.document_ids: Dict[str, List[int]] = {}
+        self.lock = Lock()
+
+def get_chat_index(chat_id: str, create: bool = True) -> Optional[ChatIndex]:
+    """Get or create the vector index for a chat"""
+    with chat_indexes_lock:
+        if chat_id not in chat_indexes and create:
+            chat_indexes[chat_id] = ChatIndex()
+        return chat_indexes.get(chat_id)
+
+def store_and_index_chunks(chunks: Iterable[str], chat_id: str, document: str, on_progress: Optional[Callable[[int, Optional[int]], None]] = None) -> int:
+    """Embed chunks into the chat's vector index as they arrive, one batch at a time"""
+    chunks = iter(chunks)
+    chat_index = None
+    embedded = 0
+    start_time = time.perf_counter()
+    while batch := list(islice(chunks, EMBEDDING_BATCH_SIZE)):
+        if chat_index is None:
+            chat_index = get_chat_index(chat_id)
+        embeddings = embedding_model.encode(
+            batch,
+            batch_size=EMBEDDING_BATCH_SIZE,
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        ).astype("float32")
+        with chat_index.lock:
+            chat_index.index.add(embeddings)
+            ids = chat_index.document_ids.setdefault(document, [])
+            for chunk in batch:
+                ids.append(len(chat_index.chunks))
+                chat_index.chunks.append(chunk)
+        embedded += len(batch)
+        # The total is unknown until the document has been read to the end
+        if on_progress:
+            on_progress(embedded, None)
+    
+    if not embedded:
+        return 0
+    if on_progress:
+        on_progress(embedded, embedded)
+    elapsed = max(time.perf_counter() - start_time, 1e-6)
+    print(f"Indexed {embedded} chunks in {elapsed:.2f}s ({embedded / elapsed:.1f} chunks/s)")
+    return embedded
+
+# Documents are parsed on the process pool in ingestion.py and embedded on the ingestion pool
+ingestion_jobs = IngestionJobs(chunker, store_and_index_chunks, SUPPORTED_TEXT_EXTENSIONS, id_length=8)
+
+def retrieve_relevant_text(query: str, chat_id: str, document: Optional[str] = None, top_k: int = 3) -> Optional[str]:
+    """Retrieve relevant text chunks from the chat's documents, optionally from one document only"""
+    chat_index = get_chat_index(chat_id, create=False)
+    if chat_index is None or not chat_index.chunks:  # No documents indexed
         return None
         
-    query_embedding = embedding_model.encode(query, normalize_embeddings=True).reshape(1, -1).astype("float32")
-    distances, indices = index.search(query_embedding, top_k)
-    retrieved = [id_to_text.get(i, "") for i in indices[0] if i >= 0]
+    query_embedding = encode_query(query)
+    with chat_index.lock:
+        params = None
+        if document:
+            ids = chat_index.document_ids.get(document)
+            if not ids:
+                return None
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(np.array(ids, dtype="int64")))
+        distances, indices = chat_index.index.search(query_embedding, top_k, params=params)
+        retrieved = [chat_index.chunks[i] for i in indices[0] if i >= 0]
     return "\n".join(retrieved) if retrieved else None
 
-async def extract_text_from_file(file_path: str, file_extension: str) -> str:
-    """Extract text from various file types"""
-    try:
-        if file_extension in SUPPORTED_TEXT_EXTENSIONS:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        elif file_extension == '.pdf':
-            reader = PdfReader(file_path)
-            return "\n".join(page.extract_text() for page in reader.pages if page.extract_text())
-        elif file_extension == '.docx':
-            doc = docx.Document(file_path)
-            return "\n".join([para.text for para in doc.paragraphs])
-        else:
-            raise ValueError(f"Unsupported file type: {file_extension}")
-    except Exception as e:
-        print(f"Error extracting text from {file_path}: {str(e)}")
-        raise
-
-async def process_audio_file(file_path: str) -> str:
-    """Transcribe audio file using Groq's Whisper API"""
+async def process_audio_file(audio_data: bytes, filename: str) -> str:
+    """Transcribe audio using Groq's Whisper API"""
     try:
-        with open(file_path, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
-                file=(file_path, audio_file.read()),
-                model="whisper-large-v3-turbo",
-                response_format="text",
-                language="en",
-            )
-            return str(transcription)
+        transcription = await async_client.audio.transcriptions.create(
+            file=(filename, audio_data),
+            model="whisper-large-v3-turbo",
+            response_format="text",
+            language="en",
+            timeout=GROQ_TIMEOUTS["transcription"]
+        )
+        return str(transcription)
     except Exception as e:
         print(f"Audio transcription error: {str(e)}")
         raise
 
-async def process_image_file(file_path: str) -> str:
+async def process_image_file(image_bytes: bytes, filename: str) -> str:
     """Extract text/description from image using Llama-4-Scout"""
     try:
-        with open(file_path, "rb") as img_file:
-            image_data = base64.b64encode(img_file.read()).decode('utf-8')
-            file_extension = os.path.splitext(file_path)[1].lower()
-            
-            response = client.chat.completions.create(
-                model="meta-llama/llama-4-scout-17b-16e-instruct",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an AI that can analyze images. Describe the image content in detail, focusing on any text or code present."
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": f"data:image/{file_extension[1:]};base64,{image_data}"
-                            },
-                            {
-                                "type": "text",
-                                "text": "Describe this image in detail, especially any text or code content."
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=1000
-            )
-            return response.choices[0].message.content
+        mime_type = mimetypes.guess_type(filename)[0] or "image/jpeg"
+        loop = asyncio.get_running_loop()
+        image_bytes, mime_type = await loop.run_in_executor(cpu_executor, prepare_image_bytes, image_bytes, mime_type)
+        image_data = base64.b64encode(image_bytes).decode('utf-8')
+        
+        response = await async_client.chat.completions.create(
+            model="meta-llama/llama-4-scout-17b-16e-instruct",
+            messages=[
+                {
+                    "role": "system",
+                    "content": "You are an AI that can analyze images. Describe the image content in detail, focusing on any text or code present."
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image_url",
+                            "image_url": f"data:{mime_type};base64,{image_data}"
+                        },
+                        {
+                            "type": "text",
+                            "text": "Describe this image in detail, especially any text or code content."
+                        }
+                    ]
+                }
+            ],
+            max_tokens=1000,
+            timeout=GROQ_TIMEOUTS["vision"]
+        )
+        return response.choices[0].message.content
     except Exception as e:
         print(f"Image processing error: {str(e)}")
         raise
 
-async def handle_detected_intent(text: str, chat_id: str) -> str:
-    """Handle the detected intent and generate appropriate response"""
-    sub_queries = detect_intent_llm(text)
+class StreamingResponseCleaner:
+    """Applies clean_response formatting to a token stream, one completed line at a time"""
+    
+    def __init__(self):
+        self.buffer = ""
+        self.started = False
+    
+    def feed(self, token: str) -> str:
+        """Add a token and return the cleaned text of any lines it completed"""
+        self.buffer += token
+        lines = self.buffer.split("\n")
+        self.buffer = lines.pop()
+        return self._emit("".join(self._clean_line(line) + "\n" for line in lines))
+    
+    def flush(self) -> str:
+        """Return the cleaned remainder once the stream has ended"""
+        line, self.buffer = self.buffer, ""
+        return self._emit(self._clean_line(line).rstrip())
+    
+    def _clean_line(self, line: str) -> str:
+        line = line.replace("```", "")
+        line = re.sub(r'\*\*(.*?)\*\*', r'\1', line)
+        line = re.sub(r'\*(.*?)\*', r'\1', line)
+        return line
+    
+    def _emit(self, text: str) -> str:
+        # Leading whitespace is stripped like clean_response does
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        return text
+
+def answer_sub_query(query: str, intent: str, history_messages: list, chat_id: str, document: Optional[str],
+                     on_token: Optional[Callable[[str], None]] = None) -> tuple:
+    """
+    Retrieve context and generate the answer for one sub-query
+    When on_token is given the answer is streamed to it as cleaned text deltas
+    Returns (input text, raw answer, cleaned answer) without touching chat history
+    """
+    print(f"Processing intent '{intent}' for query: {query}")
+    
+    # Get appropriate chain
+    chain = get_conversation_chain(intent)
+    
+    # Add context if available (except for greetings/non-coding)
+    context = None
+    if intent not in ["greeting", "non_coding"]:
+        context = retrieve_relevant_text(query, chat_id, document)
+    
+    # Prepare input
+    input_text = f"Context:\n{context}\n\nQuestion:\n{query}" if context else query
+    
+    # Generate response
+    chain_input = {"input": input_text, "history": history_messages}
+    if on_token:
+        cleaner = StreamingResponseCleaner()
+        tokens = []
+        for token in chain.stream(chain_input):
+            tokens.append(token)
+            delta = cleaner.feed(token)
+            if delta:
+                on_token(delta)
+        delta = cleaner.flush()
+        if delta:
+            on_token(delta)
+        raw_response = "".join(tokens)
+    else:
+        raw_response = chain.invoke(chain_input)
+    return input_text, raw_response, clean_response(raw_response)
+
+def answer_message(text: str, chat_id: str, document: Optional[str] = None,
+                   on_token: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Detect intents and answer all sub-queries of one message, committing them to history in order
+    When on_token is given the parts are streamed to it one after another
+    Only called from chat_scheduler work, so one chat never has two messages in flight
+    """
+    sub_queries = intent_classifier.detect(text)
     print("Detected sub-queries:", sub_queries)
 
-    responses = []
-    
-    for item in sub_queries:
-        query = item["query"]
-        intent = item["intent"]
-        print(f"Processing intent '{intent}' for query: {query}")
-
-        # Get session lock to ensure sequential processing
-        session_lock = get_session_lock(chat_id)
-        with session_lock:
-            # Get appropriate chain
-            chain = get_conversation_chain(chat_id, intent)
-            
-            # Add context if available (except for greetings/non-coding)
-            context = None
-            if intent not in ["greeting", "non_coding"]:
-                context = retrieve_relevant_text(query)
-            
-            # Prepare input
-            input_text = f"Context:\n{context}\n\nQuestion:\n{query}" if context else query
-            
-            # Generate response
-            raw_response = chain.run(input=input_text)
-            clean_response_text = clean_response(raw_response)
-            
+    with session_store.use(chat_id) as history:
+        # Every sub-query sees the history as it was before this message
+        history_messages = summary_memory.get_prompt_history(chat_id)
+        
+        if on_token:
+            results = []
+            for part, item in enumerate(sub_queries):
+                if part:
+                    on_token("\n\n")
+                results.append(answer_sub_query(item["query"], item["intent"], history_messages, chat_id, document, on_token))
+        elif len(sub_queries) == 1:
+            item = sub_queries[0]
+            results = [answer_sub_query(item["query"], item["intent"], history_messages, chat_id, document)]
+        else:
+            futures = [
+                subquery_executor.submit(answer_sub_query, item["query"], item["intent"], history_messages, chat_id, document)
+                for item in sub_queries
+            ]
+            results = [future.result() for future in futures]
+        
+        # Commit turns in the original sub-query order
+        responses = []
+        for input_text, raw_response, clean_response_text in results:
+            history.add_user_message(input_text)
+            history.add_ai_message(raw_response)
             responses.append(clean_response_text)
     
     return "\n\n".join(responses)
 
+async def handle_detected_intent(text: str, chat_id: str, document: Optional[str] = None) -> str:
+    """Handle the detected intent and generate appropriate response, optionally scoped to one document"""
+    # Groq calls and embedding block, so run them on the I/O pool
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, answer_message, text, chat_id, document)
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """Split text into Telegram-sized messages, preferring to break at a newline"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    parts.append(text)
+    return parts
+
+async def reply_in_parts(message: Message, text: str) -> None:
+    """Reply with text, split into as many messages as Telegram's length cap needs"""
+    for part in split_message(text):
+        await message.reply_text(part)
+
+class TelegramStreamWriter:
+    """Renders a growing answer into Telegram messages, throttling edits and rolling over past the length cap"""
+    
+    def __init__(self, update: Update, placeholder: Message):
+        self.update = update
+        self.messages = [placeholder]
+        self.rendered = [placeholder.text]
+        self.text = ""
+        self.next_edit = 0.0
+    
+    async def append(self, delta: str) -> None:
+        """Add streamed text and refresh the messages if the edit interval has passed"""
+        self.text += delta
+        if time.monotonic() >= self.next_edit:
+            await self.render()
+    
+    async def finish(self, text: str) -> None:
+        """Replace the streamed text with the final answer and render it, waiting out rate limits"""
+        self.text = text
+        while True:
+            try:
+                await self.render(final=True)
+                return
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+    
+    async def render(self, final: bool = False) -> None:
+        parts = split_message(self.text or "…")
+        try:
+            for i, part in enumerate(parts):
+                if i < len(self.messages):
+                    if self.rendered[i] != part:
+                        await self.messages[i].edit_text(part)
+                        self.rendered[i] = part
+                else:
+                    self.messages.append(await self.update.message.reply_text(part))
+                    self.rendered.append(part)
+        except RetryAfter as e:
+            if final:
+                raise
+            # Back off until Telegram allows edits again; the final render catches up
+            self.next_edit = time.monotonic() + e.retry_after
+            return
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self.next_edit = time.monotonic() + TELEGRAM_EDIT_INTERVAL
+
+async def stream_detected_intent(text: str, chat_id: str, writer: TelegramStreamWriter, document: Optional[str] = None) -> None:
+    """Stream the answer into the writer as tokens arrive from the model"""
+    loop = asyncio.get_running_loop()
+    tokens: asyncio.Queue = asyncio.Queue()
+    
+    def on_token(delta: str) -> None:
+        loop.call_soon_threadsafe(tokens.put_nowait, delta)
+    
+    future = loop.run_in_executor(io_executor, answer_message, text, chat_id, document, on_token)
+    future.add_done_callback(lambda _: loop.call_soon_threadsafe(tokens.put_nowait, None))
+    while (delta := await tokens.get()) is not None:
+        await writer.append(delta)
+    
+    await writer.finish(await future)
+
+chat_scheduler = ChatScheduler(CHAT_QUEUE_DEPTH)
+
+async def submit_chat_work(chat_id: str, work: ChatWork) -> None:
+    """Queue work for a chat, telling the user when their chat already has too much waiting."""
+    if chat_scheduler.submit(chat_id, work) == "rejected":
+        await work.update.message.reply_text(
+            "⏳ I'm still working on your earlier messages. Please wait for my reply before sending more."
+        )
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /start is issued."""
     await update.message.reply_text(
@@ -348,7 +557,8 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Available commands:\n"
         "/start - Welcome message\n"
         "/help - This help message\n"
-        "/clear - Clear conversation history\n\n"
+        "/clear - Clear conversation history\n"
+        "/status - Show document processing progress\n\n"
         "What I can do:\n"
         "• Answer programming questions\n"
         "• Explain code concepts\n"
@@ -364,13 +574,60 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "• Images: .jpg, .png (for text/code analysis)"
     )
 
+async def ingestion_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Report progress of this chat's document ingestion jobs."""
+    chat_id = str(update.effective_chat.id)
+    jobs = ingestion_jobs.find(chat_id=chat_id)
+    
+    if not jobs:
+        await update.message.reply_text("No documents are being processed.")
+        return
+    
+    lines = []
+    for job in sorted(jobs, key=lambda j: j["created_at"])[-5:]:
+        pages = f"{job['pages_parsed']}/{job['pages_total'] or '?'} pages"
+        chunks = f"{job['chunks_embedded']}/{job['chunks_total'] or '?'} chunks"
+        lines.append(f"• {job['filename']} [{job['job_id']}]: {job['status']} ({pages}, {chunks})")
+    await update.message.reply_text("📊 Document processing:\n" + "\n".join(lines))
+
+async def intent_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Report how often the local intent classifier answered and how well it agrees with the LLM."""
+    stats = intent_classifier.get_stats()
+    agreement = f"{stats['agreement_rate']:.0%}" if stats["agreement_rate"] is not None else "n/a"
+    queue_stats = chat_scheduler.get_stats()
+    store_stats = session_store.get_stats()
+    images = get_image_stats()
+    await update.message.reply_text(
+        "🧭 Intent classifier:\n"
+        f"• Messages: {stats['messages']}\n"
+        f"• Fast path: {stats['fast_path']} ({stats['fast_path_rate']:.0%})\n"
+        f"• LLM fallback: {stats['llm']}\n"
+        f"• Agreement with LLM: {agreement} of {stats['compared']} compared\n\n"
+        "📬 Chat queues:\n"
+        f"• Active chats: {queue_stats['active_chats']} ({queue_stats['waiting']} messages waiting)\n"
+        f"• Coalesced: {queue_stats['coalesced']}, rejected: {queue_stats['rejected']}\n"
+        f"• Queue wait: {queue_stats['wait_avg_s']:.2f}s avg, {queue_stats['wait_max_s']:.2f}s max\n\n"
+        "🗂️ Sessions:\n"
+        f"• Live chats: {store_stats['sessions']}/{store_stats['max_sessions']} ({store_stats['in_use']} in use)\n"
+        f"• Memory: {store_stats['bytes'] / 1024:.0f} KiB of {store_stats['max_bytes'] / 1024 / 1024:.0f} MiB\n"
+        f"• Expired: {store_stats['expired']}, evicted: {store_stats['evicted']}\n\n"
+        "🖼️ Images:\n"
+        f"• Prepared: {images['images']} ({images['resized']} downscaled, {images['prepare_avg_ms']:.0f}ms avg)\n"
+        f"• Payload: {images['bytes_saved'] / 1024:.0f} KiB saved ({images['saved_rate']:.0%})"
+        + "".join(
+            f"\n\n🌐 {path}:\n"
+            f"• Calls: {stats['calls']} ({stats['errors']} errors)\n"
+            f"• Connection reuse: {stats['reuse_rate']:.0%} ({stats['tls_handshakes']} TLS handshakes)\n"
+            f"• Latency: {stats['latency_avg_ms']:.0f}ms avg, {stats['latency_max_ms']:.0f}ms max"
+            for path, stats in get_groq_stats().items()
+        )
+    )
+
 async def clear_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Clear the chat history for this chat."""
     chat_id = str(update.effective_chat.id)
-    if chat_id in session_histories:
-        del session_histories[chat_id]
-    if chat_id in session_locks:
-        del session_locks[chat_id]
+    session_store.pop(chat_id)
+    summary_memory.forget(chat_id)
     await update.message.reply_text("🗑️ Conversation history cleared!")
 
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -382,6 +639,13 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("Please enter a message.")
         return
     
+    await submit_chat_work(chat_id, ChatWork(answer_text_message, update, context, text=user_input))
+
+async def answer_text_message(work: ChatWork):
+    """Answer a queued text message, which may hold several coalesced messages."""
+    update, context = work.update, work.context
+    chat_id = str(update.effective_chat.id)
+    
     try:
         # Send "typing" action
         await context.bot.send_chat_action(
@@ -389,8 +653,13 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
             action="typing"
         )
         
-        response = await handle_detected_intent(user_input, chat_id)
-        await update.message.reply_text(response)
+        if TELEGRAM_STREAMING:
+            placeholder = await update.message.reply_text("💭 Thinking...")
+            await stream_detected_intent(work.text, chat_id, TelegramStreamWriter(update, placeholder))
+            return
+        
+        response = await handle_detected_intent(work.text, chat_id)
+        await reply_in_parts(update.message, response)
     except Exception as e:
         print("Error processing text message:", e)
         await update.message.reply_text("❌ An error occurred while processing your message.")
@@ -411,35 +680,54 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        # Send "typing" action
-        await context.bot.send_chat_action(
-            chat_id=update.effective_chat.id,
-            action="typing"
+        # Download the file; the ingestion job removes it when done
+        file = await context.bot.get_file(document.file_id)
+        with NamedTemporaryFile(suffix=file_extension, delete=False) as temp_file:
+            temp_path = temp_file.name
+        await file.download_to_drive(temp_path)
+        
+        job_id = ingestion_jobs.create(document.file_name, chat_id=chat_id)["job_id"]
+        await update.message.reply_text(
+            f"📄 File received and is being processed (job {job_id}). Use /status to check progress."
         )
         
-        # Download the file
-        file = await context.bot.get_file(document.file_id)
-        with NamedTemporaryFile(suffix=file_extension) as temp_file:
-            await file.download_to_drive(temp_file.name)
-            
-            # Process the file
-            text_content = await extract_text_from_file(temp_file.name, file_extension)
-            store_and_index_text(text_content)
-            
-            # Check if there's a caption with a question
-            if update.message.caption:
-                response = await handle_detected_intent(update.message.caption, chat_id)
-                await update.message.reply_text(response)
-            else:
-                await update.message.reply_text(
-                    "📄 File processed successfully. You can now ask questions about its content."
-                )
+        # Parse and embed in the background so this chat and others stay responsive
+        context.application.create_task(
+            finish_document_ingestion(update, job_id, temp_path, chat_id),
+            update=update
+        )
     except Exception as e:
         print("Error processing document:", e)
         await update.message.reply_text("❌ Failed to process the document. Please try again.")
 
+async def finish_document_ingestion(update: Update, job_id: str, file_path: str, chat_id: str):
+    """Wait for an ingestion job and answer the document's caption once it is indexed."""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(ingestion_executor, ingestion_jobs.run, job_id, file_path, chat_id)
+    
+    job = ingestion_jobs.get(job_id)
+    if job["status"] != "done":
+        await update.message.reply_text("❌ Failed to process the document. Please try again.")
+        return
+    
+    # A caption is a question about this particular document, answered in turn with the chat's other messages
+    if update.message.caption:
+        async def answer_caption(work: ChatWork):
+            response = await handle_detected_intent(update.message.caption, chat_id, job["filename"])
+            await reply_in_parts(update.message, response)
+        await submit_chat_work(chat_id, ChatWork(answer_caption, update))
+    else:
+        await update.message.reply_text(
+            "📄 File processed successfully. You can now ask questions about its content."
+        )
+
 async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Queue voice messages so they are answered in order with the chat's other messages."""
+    await submit_chat_work(str(update.effective_chat.id), ChatWork(answer_voice_message, update, context))
+
+async def answer_voice_message(work: ChatWork):
     """Handle voice messages by transcribing them."""
+    update, context = work.update, work.context
     chat_id = str(update.effective_chat.id)
     voice = update.message.voice
     
@@ -452,26 +740,31 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
         
         # Download the voice message
         file = await context.bot.get_file(voice.file_id)
-        with NamedTemporaryFile(suffix='.ogg') as temp_file:
-            await file.download_to_drive(temp_file.name)
-            
-            # Transcribe the audio
-            transcribed_text = await process_audio_file(temp_file.name)
-            
-            # Get the LLM response
-            response = await handle_detected_intent(transcribed_text, chat_id)
-            
-            # Send both transcription and response
-            await update.message.reply_text(
-                f"🎤 Transcribed:\n{transcribed_text}\n\n"
-                f"💡 Response:\n{response}"
-            )
+        audio_data = await file.download_as_bytearray()
+        
+        # Transcribe the audio
+        transcribed_text = await process_audio_file(bytes(audio_data), "voice.ogg")
+        
+        # Get the LLM response
+        response = await handle_detected_intent(transcribed_text, chat_id)
+        
+        # Send both transcription and response
+        await reply_in_parts(
+            update.message,
+            f"🎤 Transcribed:\n{transcribed_text}\n\n"
+            f"💡 Response:\n{response}"
+        )
     except Exception as e:
         print("Error processing voice message:", e)
         await update.message.reply_text("❌ Could not process the voice message. Please try again.")
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Queue photos so they are answered in order with the chat's other messages."""
+    await submit_chat_work(str(update.effective_chat.id), ChatWork(answer_photo, update, context))
+
+async def answer_photo(work: ChatWork):
     """Handle photos by analyzing them for text/code."""
+    update, context = work.update, work.context
     chat_id = str(update.effective_chat.id)
     photo = update.message.photo[-1]  # Get highest resolution photo
     
@@ -484,22 +777,21 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Download the photo
         file = await context.bot.get_file(photo.file_id)
-        with NamedTemporaryFile(suffix='.jpg') as temp_file:
-            await file.download_to_drive(temp_file.name)
-            
-            # Process the image
-            image_description = await process_image_file(temp_file.name)
-            
-            # Check if there's a caption with additional context
-            if update.message.caption:
-                full_query = f"{update.message.caption}\n\nImage content:\n{image_description}"
-            else:
-                full_query = f"Based on this image:\n{image_description}"
-            
-            # Get the LLM response
-            response = await handle_detected_intent(full_query, chat_id)
-            
-            await update.message.reply_text(response)
+        image_bytes = await file.download_as_bytearray()
+        
+        # Process the image
+        image_description = await process_image_file(bytes(image_bytes), "photo.jpg")
+        
+        # Check if there's a caption with additional context
+        if update.message.caption:
+            full_query = f"{update.message.caption}\n\nImage content:\n{image_description}"
+        else:
+            full_query = f"Based on this image:\n{image_description}"
+        
+        # Get the LLM response
+        response = await handle_detected_intent(full_query, chat_id)
+        
+        await reply_in_parts(update.message, response)
     except Exception as e:
         print("Error processing photo:", e)
         await update.message.reply_text("❌ Could not process the image. Please try again.")
@@ -514,13 +806,23 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 def main():
     """Start the bot."""
+    warm_parse_pool()
+    
     # Create the Application
-    application = ApplicationBuilder().token(os.getenv("TELEGRAM_BOT_TOKEN")).build()
+    # Handle updates from many chats at once; blocking work runs on the executors above
+    application = (
+        ApplicationBuilder()
+        .token(os.getenv("TELEGRAM_BOT_TOKEN"))
+        .concurrent_updates(TELEGRAM_CONCURRENT_UPDATES)
+        .build()
+    )
     
     # Add command handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("clear", clear_history))
+    application.add_handler(CommandHandler("status", ingestion_status))
+    application.add_handler(CommandHandler("stats", intent_stats_command))
     
     # Add message handlers
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
@@ -1,5 +1,8 @@
 import os
+import sys
 import json
+import time
+import asyncio
 import re
 import base64
 from dotenv import load_dotenv
@@ -7,34 +10,61 @@ import tempfile
 from telegram import Update, Voice, PhotoSize
 from telegram.ext import ApplicationBuilder, ContextTypes, MessageHandler, CommandHandler, filters
 import groq
-from PyPDF2 import PdfReader
-import docx
-import numpy as np
 import faiss
 from sentence_transformers import SentenceTransformer
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain_core.messages import HumanMessage, AIMessage
-from collections import defaultdict
+from itertools import islice
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv()
 
+# Modules shared with the Flask app live one directory up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from groq_http import GROQ_TIMEOUTS, create_groq_http_client
+from session_store import SESSION_MAX_BYTES, SESSION_MAX_COUNT, SESSION_TTL, SessionStore
+from media import get_image_stats, prepare_image_bytes
+from chunking import Chunker
+from ingestion import IngestionJobs, warm_parse_pool
+from chat_scheduler import ChatScheduler, ChatWork
+
 # --- Setup ---
+# One keep-alive connection pool shared by every Groq call, with a timeout per call type (seconds)
+groq_http_client = create_groq_http_client()
 groq_api_key = os.getenv("GROQ_API_KEY")
-client = groq.Client(api_key=groq_api_key)
+client = groq.Client(api_key=groq_api_key, http_client=groq_http_client)
 
 # --- Document Indexing Setup ---
 embedding_dim = 384  # Dimension of embeddings
 embedding_model = SentenceTransformer('all-MiniLM-L6-v2')  
-index = faiss.IndexFlatL2(embedding_dim)
-id_to_text = {}
-next_id = 0
+chat_indexes = {}  # chat_id -> ChatIndex, so each chat only searches its own uploads
+chat_indexes_lock = Lock()
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))  # Chunks per encoder forward pass
+
+# --- Executors: blocking work never runs on the event loop ---
+io_executor = ThreadPoolExecutor(max_workers=int(os.getenv("IO_WORKERS", "32")), thread_name_prefix="io")  # Groq calls
+cpu_executor = ThreadPoolExecutor(max_workers=int(os.getenv("CPU_WORKERS", os.getenv("INGESTION_WORKERS", "2"))), thread_name_prefix="cpu")  # embedding
+TELEGRAM_CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_CONCURRENT_UPDATES", "64"))
+
+# Updates are processed concurrently, so messages of one chat go through a per-chat queue to keep
+# their replies and history in order; at most CHAT_QUEUE_DEPTH may wait
+CHAT_QUEUE_DEPTH = int(os.getenv("CHAT_QUEUE_DEPTH", "5"))
+chat_scheduler = ChatScheduler(CHAT_QUEUE_DEPTH)
+
+# --- Background Ingestion Setup ---
+# PDF/DOCX pages are parsed on the shared process pool in ingestion.py and chunked to the
+# embedding model's token budget; finished jobs are forgotten after INGESTION_JOB_TTL seconds
+TEXT_EXTENSIONS = {".txt"}
+chunker = Chunker(embedding_model.tokenizer, set())
 
 # --- Chat History Setup ---
-store = defaultdict(ChatMessageHistory)
+# Chats idle for SESSION_TTL seconds are dropped, and the least recently used go first past either cap
+session_store = SessionStore(SESSION_MAX_COUNT, SESSION_MAX_BYTES, SESSION_TTL)
 
 def get_session_history(session_id: str) -> ChatMessageHistory:
-    return store[session_id]
+    return session_store.get(session_id)
 
 # --- Utilities ---
 def clean_response(text):
@@ -49,7 +79,8 @@ def transcribe_audio_to_text(audio_path):
             file=(audio_path, file.read()),
             model="whisper-large-v3-turbo",
             response_format="verbose_json",
-            language="en"
+            language="en",
+            timeout=GROQ_TIMEOUTS["transcription"]
         )
     return transcription.text
 
@@ -80,7 +111,8 @@ def detect_coding_intent(text):
             model="llama-3.3-70b-versatile",
             messages=prompt,
             response_format={"type": "json_object"},
-            temperature=0.1
+            temperature=0.1,
+            timeout=GROQ_TIMEOUTS["intent"]
         )
         result = json.loads(response.choices[0].message.content)
         return {
@@ -93,7 +125,15 @@ def detect_coding_intent(text):
         return {"is_coding": False, "request_type": None, "language": None}
 
 # --- Image and Document Handling ---
+async def submit_chat_work(work: ChatWork):
+    if chat_scheduler.submit(str(work.update.effective_chat.id), work) == "rejected":
+        await work.update.message.reply_text("⏳ Still working on your earlier messages. Please wait for my reply.")
+
 async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await submit_chat_work(ChatWork(answer_image, update, context))
+
+async def answer_image(work: ChatWork):
+    update, context = work.update, work.context
     photo = update.message.photo[-1]  # Get highest resolution photo
     file = await context.bot.get_file(photo.file_id)
     
@@ -101,14 +141,15 @@ async def handle_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await file.download_to_drive(tmp.name)
         with open(tmp.name, "rb") as image_file:
             caption = update.message.caption or "Extract any code from this image"
-            response = handle_image_query(image_file, caption)
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(io_executor, handle_image_query, image_file, caption)
     
     os.remove(tmp.name)
     await update.message.reply_text(response)
 
 def handle_image_query(image_file, query=None):
-    image_bytes = image_file.read()
     mime_type = "image/jpeg"  # Telegram sends as JPEG
+    image_bytes, mime_type = prepare_image_bytes(image_file.read(), mime_type)
     
     # Encode image to base64
     base64_image = base64.b64encode(image_bytes).decode("utf-8")
@@ -135,7 +176,8 @@ def handle_image_query(image_file, query=None):
                     image_payload
                 ]
             }
-        ]
+        ],
+        timeout=GROQ_TIMEOUTS["vision"]
     )
     return response.choices[0].message.content
 
@@ -150,43 +192,79 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     with tempfile.NamedTemporaryFile(suffix=document.file_name, delete=False) as tmp:
         await file.download_to_drive(tmp.name)
-        try:
-            text = extract_text(tmp)
-            store_file_and_index(tmp)
-            response = "📄 Document processed and indexed! You can now ask questions about its content."
-        except ValueError as e:
-            response = f"❌ Error: {str(e)}"
-        except Exception as e:
-            response = "❌ An error occurred while processing the document."
-            print("Document processing error:", e)
     
-    os.remove(tmp.name)
-    await update.message.reply_text(response)
+    chat_id = str(update.effective_chat.id)
+    job_id = ingestion_jobs.create(document.file_name, chat_id=chat_id)["job_id"]
+    await update.message.reply_text(f"📄 Document received (job {job_id}). Indexing in the background, use /status to check.")
+    context.application.create_task(finish_document(update, job_id, tmp.name, chat_id), update=update)
 
-def extract_text(file):
-    filename = file.name.lower()
-    if filename.endswith(".pdf"):
-        reader = PdfReader(file.name)
-        return "\n".join(page.extract_text() for page in reader.pages if page.extract_text())
-    elif filename.endswith(".docx"):
-        doc = docx.Document(file.name)
-        return "\n".join([para.text for para in doc.paragraphs])
-    elif filename.endswith(".txt"):
-        with open(file.name, "r") as f:
-            return f.read()
+async def finish_document(update: Update, job_id, file_path, chat_id):
+    # The job removes the file when done
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(cpu_executor, ingestion_jobs.run, job_id, file_path, chat_id)
+    job = ingestion_jobs.get(job_id)
+    if job["status"] == "done":
+        await update.message.reply_text("📄 Document processed and indexed! You can now ask questions about its content.")
+    elif job["error"] and job["error"].startswith("Unsupported file type"):
+        await update.message.reply_text(f"❌ Error: {job['error']}")
     else:
-        raise ValueError("Unsupported file type")
+        await update.message.reply_text("❌ An error occurred while processing the document.")
+
+async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = str(update.effective_chat.id)
+    jobs = ingestion_jobs.find(chat_id=chat_id)
+    stats = session_store.get_stats()
+    images = get_image_stats()
+    sessions = (
+        f"🗂️ {stats['sessions']} live chats, ~{stats['bytes'] // 1024} KiB of history\n"
+        f"🖼️ {images['images']} images prepared, {images['bytes_saved'] // 1024} KiB saved ({images['saved_rate']:.0%})"
+    )
+    if not jobs:
+        await update.message.reply_text("No documents are being processed.\n" + sessions)
+        return
+    lines = [f"• {job['filename']} [{job['job_id']}]: {job['status']} ({job['pages_parsed']}/{job['pages_total'] or '?'} pages, {job['chunks_embedded']} chunks)" for job in jobs[-5:]]
+    await update.message.reply_text("\n".join(lines + [sessions]))
+
+class ChatIndex:
+    """Vector index and chunk texts of one chat, only changed together under lock"""
+    def __init__(self):
+        self.index = faiss.IndexFlatL2(embedding_dim)
+        self.chunks = []  # Position == vector id
+        self.lock = Lock()
+
+def get_chat_index(chat_id, create=True):
+    with chat_indexes_lock:
+        if chat_id not in chat_indexes and create:
+            chat_indexes[chat_id] = ChatIndex()
+        return chat_indexes.get(chat_id)
 
-def store_file_and_index(file):
-    global next_id
-    text = extract_text(file)
-    chunks = [text[i:i+500] for i in range(0, len(text), 500)]
+def store_and_index_chunks(chunks, chat_id, document, on_progress=None):
+    """Embed chunks into the chat's index one batch at a time, as the document is parsed"""
+    chunks = iter(chunks)
+    chat_index = get_chat_index(chat_id)
+    embedded = 0
+    start_time = time.perf_counter()
+    while batch := list(islice(chunks, EMBEDDING_BATCH_SIZE)):
+        embeddings = embedding_model.encode(
+            batch,
+            batch_size=EMBEDDING_BATCH_SIZE,
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        ).astype("float32")
+        with chat_index.lock:
+            chat_index.index.add(embeddings)
+            chat_index.chunks.extend(batch)
+        embedded += len(batch)
+        if on_progress:
+            on_progress(embedded, None)
 
-    for chunk in chunks:
-        embedding = embedding_model.encode(chunk, normalize_embeddings=True).astype("float32")
-        index.add(np.array([embedding]))
-        id_to_text[next_id] = chunk
-        next_id += 1
+    if on_progress:
+        on_progress(embedded, embedded)
+    elapsed = max(time.perf_counter() - start_time, 1e-6)
+    print(f"Indexed {embedded} chunks of {document} in {elapsed:.2f}s ({embedded / elapsed:.1f} chunks/s)")
+    return embedded
+
+ingestion_jobs = IngestionJobs(chunker, store_and_index_chunks, TEXT_EXTENSIONS, id_length=8)
 
 def generate_coding_response(query, context=None, chat_history=None, intent=None):
     # Prepare message history
@@ -236,18 +314,24 @@ def generate_coding_response(query, context=None, chat_history=None, intent=None
             model="llama-3.3-70b-versatile",
             messages=messages,
             temperature=0.3,
-            max_tokens=500
+            max_tokens=500,
+            timeout=GROQ_TIMEOUTS["chat"]
         )
         return clean_response(response.choices[0].message.content)
     except Exception as e:
         print(f"Generation error: {e}")
         return "Error generating response"
 
-def retrieve_relevant_text(query, top_k=5):
+def retrieve_relevant_text(query, chat_id, top_k=5):
+    chat_index = get_chat_index(chat_id, create=False)
+    if chat_index is None:
+        return None
     query_embedding = embedding_model.encode(query, normalize_embeddings=True).reshape(1, -1).astype("float32")
-    distances, indices = index.search(query_embedding, top_k)
-
-    retrieved = [id_to_text.get(i, "") for i in indices[0] if i >= 0]
+    with chat_index.lock:
+        if not chat_index.chunks:
+            return None
+        distances, indices = chat_index.index.search(query_embedding, top_k)
+        retrieved = [chat_index.chunks[i] for i in indices[0] if i >= 0]
     return "\n".join(retrieved) if retrieved else None
 
 async def process_input(update: Update, context: ContextTypes.DEFAULT_TYPE, user_input: str):
@@ -257,22 +341,29 @@ async def process_input(update: Update, context: ContextTypes.DEFAULT_TYPE, user
         return
     
     chat_id = str(update.effective_chat.id)
-    chat_history = get_session_history(chat_id)
-    intent = detect_coding_intent(user_input)
+    with session_store.use(chat_id) as chat_history:
+        await answer_input(update, chat_id, chat_history, user_input)
+
+async def answer_input(update: Update, chat_id, chat_history, user_input: str):
+    loop = asyncio.get_running_loop()
+    intent = await loop.run_in_executor(io_executor, detect_coding_intent, user_input)
     
     if not intent["is_coding"]:
         await update.message.reply_text("I am a coding bot. Ask Coding questions only.")
         return
     
     chat_history.add_user_message(user_input)
-    context_text = retrieve_relevant_text(user_input)
+    context_text = await loop.run_in_executor(cpu_executor, retrieve_relevant_text, user_input, chat_id)
     
     try:
-        response = generate_coding_response(
-            query=user_input,
-            context=context_text,
-            chat_history=chat_history,
-            intent=intent
+        response = await loop.run_in_executor(
+            io_executor,
+            lambda: generate_coding_response(
+                query=user_input,
+                context=context_text,
+                chat_history=chat_history,
+                intent=intent
+            )
         )
         chat_history.add_ai_message(response)
         await update.message.reply_text(response)
@@ -281,15 +372,24 @@ async def process_input(update: Update, context: ContextTypes.DEFAULT_TYPE, user
         await update.message.reply_text("Error processing request")
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await process_input(update, context, update.message.text)
+    # Texts still waiting in the chat's queue are merged and answered together
+    await submit_chat_work(ChatWork(answer_text, update, context, text=update.message.text))
+
+async def answer_text(work: ChatWork):
+    await process_input(work.update, work.context, work.text)
 
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await submit_chat_work(ChatWork(answer_voice, update, context))
+
+async def answer_voice(work: ChatWork):
+    update, context = work.update, work.context
     voice: Voice = update.message.voice
     with tempfile.NamedTemporaryFile(delete=False, suffix=".ogg") as tmp:
         file = await context.bot.get_file(voice.file_id)
         await file.download_to_drive(tmp.name)
 
-    user_input = transcribe_audio_to_text(tmp.name)
+    loop = asyncio.get_running_loop()
+    user_input = await loop.run_in_executor(io_executor, transcribe_audio_to_text, tmp.name)
     os.remove(tmp.name)
     await process_input(update, context, user_input)
 
@@ -305,11 +405,13 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 def main():
+    warm_parse_pool()
     telegram_token = os.getenv("TELEGRAM_BOT_TOKEN")
-    app = ApplicationBuilder().token(telegram_token).build()
+    app = ApplicationBuilder().token(telegram_token).concurrent_updates(TELEGRAM_CONCURRENT_UPDATES).build()
     
     # Add handlers
     app.add_handler(CommandHandler("start", start_command))
+    app.add_handler(CommandHandler("status", status_command))
     app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), handle_text))
     app.add_handler(MessageHandler(filters.VOICE, handle_voice))
     app.add_handler(MessageHandler(filters.PHOTO, handle_image))
@@ -0,0 +1,35 @@
+import numpy as np
+
+from answer_cache import AnswerCache
+
+def unit(*values):
+    vector = np.array([values], dtype="float32")
+    return vector / np.linalg.norm(vector)
+
+def test_lookup_matches_similar_query_with_same_intent_and_profile():
+    cache = AnswerCache(4, 3, ttl=60, threshold=0.9)
+    cache.store(unit(1, 0, 0), "teaching", ("beginner",), "recursion answer")
+    cache.store(unit(0, 1, 0), "teaching", ("beginner",), "tuple answer")
+
+    assert cache.lookup(unit(1, 0.1, 0), "teaching", ("beginner",)) == "recursion answer"
+    assert cache.lookup(unit(1, 0.1, 0), "teaching", ("advanced",)) is None
+    assert cache.lookup(unit(0, 0, 1), "teaching", ("beginner",)) is None
+    assert cache.get_stats() == {"hits": 1, "misses": 2, "bypassed": 0, "size": 2}
+
+def test_full_cache_overwrites_least_recently_used_entry():
+    cache = AnswerCache(2, 3, ttl=60, threshold=0.9)
+    cache.store(unit(1, 0, 0), "greeting", (), "first")
+    cache.store(unit(0, 1, 0), "greeting", (), "second")
+    assert cache.lookup(unit(1, 0, 0), "greeting", ()) == "first"
+
+    cache.store(unit(0, 0, 1), "greeting", (), "third")
+
+    assert cache.lookup(unit(0, 1, 0), "greeting", ()) is None
+    assert cache.lookup(unit(1, 0, 0), "greeting", ()) == "first"
+    assert cache.lookup(unit(0, 0, 1), "greeting", ()) == "third"
+
+def test_expired_entries_are_not_returned():
+    cache = AnswerCache(2, 3, ttl=-1, threshold=0.9)
+    cache.store(unit(1, 0, 0), "greeting", (), "stale")
+    assert cache.lookup(unit(1, 0, 0), "greeting", ()) is None
+    assert cache.get_stats()["size"] == 0
@@ -0,0 +1,31 @@
+import asyncio
+
+from chat_scheduler import ChatScheduler, ChatWork
+
+def test_work_of_one_chat_runs_in_order_and_texts_coalesce():
+    events = []
+
+    async def run(work):
+        events.append(("start", work.text))
+        await asyncio.sleep(0.01)
+        events.append(("end", work.text))
+
+    async def main():
+        scheduler = ChatScheduler(max_depth=2)
+        assert scheduler.submit("1", ChatWork(run, None, text="first")) == "queued"
+        await asyncio.sleep(0)  # The first message is now running
+        assert scheduler.submit("1", ChatWork(run, None, text="second")) == "queued"
+        assert scheduler.submit("1", ChatWork(run, None, text="third")) == "coalesced"
+        assert scheduler.submit("1", ChatWork(run, None)) == "queued"
+        assert scheduler.submit("1", ChatWork(run, None)) == "rejected"
+        while scheduler.workers:
+            await asyncio.sleep(0.01)
+        return scheduler.get_stats()
+
+    stats = asyncio.run(main())
+    assert events == [
+        ("start", "first"), ("end", "first"),
+        ("start", "second\n\nthird"), ("end", "second\n\nthird"),
+        ("start", None), ("end", None)
+    ]
+    assert stats["completed"] == 3 and stats["active_chats"] == 0
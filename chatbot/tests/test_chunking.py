@@ -0,0 +1,41 @@
+from chunking import Chunker
+
+def whitespace_tokenizer(texts, add_special_tokens=False):
+    return {"input_ids": [text.split() for text in texts]}
+
+def make_chunker(chunk_tokens=20, overlap_tokens=4):
+    return Chunker(whitespace_tokenizer, {".py"}, chunk_tokens=chunk_tokens, overlap_tokens=overlap_tokens)
+
+def test_python_definitions_are_not_split_across_chunks():
+    source = "".join(
+        f"def function_{i}(value):\n    \"\"\"Docstring line\n\n    def not_a_definition():\n    \"\"\"\n    return value + {i}\n\n"
+        for i in range(6)
+    )
+    chunks = make_chunker().chunk_text(source, ".py")
+    assert len(chunks) > 1
+    for chunk in chunks:
+        starts = [line for line in chunk.splitlines() if line.startswith("def ")]
+        assert starts, chunk
+        assert chunk.count('"""') % 2 == 0
+
+def test_prose_is_packed_by_sentences_with_overlap():
+    text = " ".join(f"Sentence number {i} is here." for i in range(30))
+    chunks = make_chunker(overlap_tokens=5).chunk_text(text, ".txt")
+    for chunk in chunks:
+        assert len(chunk.split()) <= 20
+        assert chunk.endswith(".")
+    # The last sentence of one chunk opens the next
+    last_sentence = "Sentence" + chunks[0].rsplit("Sentence", 1)[1]
+    assert chunks[1].startswith(last_sentence)
+
+def test_sections_are_chunked_lazily():
+    consumed = []
+
+    def pages():
+        for i in range(100):
+            consumed.append(i)
+            yield f"Page {i} has some text on it. " * 3 + "\n"
+
+    chunks = make_chunker().chunk_sections(pages(), ".pdf")
+    next(chunks)
+    assert len(consumed) < 5
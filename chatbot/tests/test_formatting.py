@@ -0,0 +1,42 @@
+import random
+
+from formatting import StreamingResponseCleaner, clean_response
+
+ANSWERS = [
+    "Here is **the** code:\n```python\ndef f(*args, **kwargs):\n    return a * b * c\n```\nDone *now*.",
+    '"Recursion is when a **function** calls itself."',
+    '"Use ```print(*items)``` to\nprint them"',
+    "Call ```f(**opts)``` with *care*, then ```g()```.\n  ",
+    "An unclosed block:\n```\nx = **bold**\ny = 1",
+    "  \n\n**Tip:** keep it short\n\n",
+]
+
+def stream(text, rng):
+    cleaner = StreamingResponseCleaner()
+    deltas = []
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 5)
+        deltas.append(cleaner.feed(text[position:position + size]))
+        position += size
+    deltas.append(cleaner.flush())
+    return "".join(deltas)
+
+def test_streamed_chunks_join_to_clean_response():
+    rng = random.Random(0)
+    for answer in ANSWERS:
+        for _ in range(20):
+            assert stream(answer, rng) == clean_response(answer)
+
+def test_random_markup_streams_like_clean_response():
+    rng = random.Random(1)
+    pieces = ["*", "**", "`", "```", "\n", '"', " ", "a"]
+    for _ in range(2000):
+        answer = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 20)))
+        assert stream(answer, rng) == clean_response(answer)
+
+def test_open_code_block_is_released_before_it_closes():
+    cleaner = StreamingResponseCleaner()
+    assert cleaner.feed("Example:\n```python\nprint(1)\n") == "Example:\n```python\nprint(1)"
+    assert cleaner.feed("```\n") == "\n```"
+    assert cleaner.flush() == ""
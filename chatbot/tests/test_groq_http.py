@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+import groq
+import httpx
+
+import groq_http
+
+COMPLETION = {
+    "id": "chatcmpl-test",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "llama3-8b-8192",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "pong"}, "finish_reason": "stop"}],
+}
+
+def ask(async_client: groq.AsyncGroq) -> str:
+    async def call():
+        response = await async_client.chat.completions.create(
+            model="llama3-8b-8192",
+            messages=[{"role": "user", "content": "ping"}],
+            timeout=groq_http.GROQ_TIMEOUTS["chat"],
+        )
+        return response.choices[0].message.content
+    return asyncio.run(call())
+
+def test_async_client_call_through_mock_transport():
+    groq_http.groq_call_stats.clear()
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request.extensions.get("trace"))
+        return httpx.Response(200, json=COMPLETION)
+
+    http_client = groq_http.create_groq_async_http_client(transport=httpx.MockTransport(handler))
+    assert ask(groq.AsyncGroq(api_key="test", http_client=http_client, max_retries=0)) == "pong"
+
+    assert asyncio.iscoroutinefunction(seen[0])
+    assert groq_http.get_groq_stats()["/openai/v1/chat/completions"]["calls"] == 1
+
+def test_async_client_call_through_real_connection_pool():
+    # httpcore only invokes the trace extension on a real connection, and rejects sync callbacks there
+    groq_http.groq_call_stats.clear()
+
+    async def serve(reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        body = json.dumps(COMPLETION).encode()
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+        await writer.drain()
+        writer.close()
+
+    async def call():
+        server = await asyncio.start_server(serve, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            client = groq.AsyncGroq(
+                api_key="test",
+                base_url=f"http://127.0.0.1:{port}",
+                http_client=groq_http.create_groq_async_http_client(),
+                max_retries=0,
+            )
+            response = await client.chat.completions.create(model="llama3-8b-8192", messages=[{"role": "user", "content": "ping"}])
+            return response.choices[0].message.content
+
+    assert asyncio.run(call()) == "pong"
+    stats = groq_http.get_groq_stats()["/openai/v1/chat/completions"]
+    assert stats["calls"] == 1
+    assert stats["new_connections"] == 1
@@ -0,0 +1,80 @@
+import os
+from threading import Thread
+
+from chunking import Chunker
+from ingestion import IngestionJobs, SqliteIngestionJobs
+
+def whitespace_tokenizer(texts, add_special_tokens=False):
+    return {"input_ids": [text.split() for text in texts]}
+
+def test_job_indexes_file_reports_progress_and_removes_it(tmp_path):
+    indexed = []
+
+    def index_chunks(chunks, target, filename, on_progress=None):
+        chunks = list(chunks)
+        indexed.append((target, filename, chunks))
+        on_progress(len(chunks), len(chunks))
+
+    jobs = IngestionJobs(Chunker(whitespace_tokenizer, {".py"}), index_chunks, {".txt", ".py"})
+    path = tmp_path / "notes.txt"
+    path.write_text("First sentence here. Second sentence here.", encoding="utf-8")
+    job = jobs.create("notes.txt", chat_id="42")
+
+    jobs.run(job["job_id"], str(path), "42")
+
+    job = jobs.get(job["job_id"])
+    assert job["status"] == "done"
+    assert job["pages_parsed"] == job["pages_total"] == 1
+    assert job["chunks_embedded"] == 1
+    assert indexed == [("42", "notes.txt", ["First sentence here. Second sentence here."])]
+    assert not os.path.exists(path)
+    assert [j["job_id"] for j in jobs.find(chat_id="42")] == [job["job_id"]]
+
+def test_failed_job_is_reported_and_expires(tmp_path):
+    jobs = IngestionJobs(Chunker(whitespace_tokenizer, set()), None, {".txt"}, ttl=0)
+    path = tmp_path / "image.bmp"
+    path.write_bytes(b"BM")
+    job = jobs.create("image.bmp")
+
+    jobs.run(job["job_id"], str(path), "owner")
+
+    assert jobs.get(job["job_id"])["status"] == "failed"
+    assert not os.path.exists(path)
+    # Finished jobs past the TTL are pruned on the next registration
+    jobs.create("other.txt")
+    assert jobs.get(job["job_id"]) is None
+
+def test_wait_returns_once_the_job_finishes(tmp_path):
+    jobs = IngestionJobs(Chunker(whitespace_tokenizer, set()), lambda *args, **kwargs: None, {".txt"})
+    path = tmp_path / "notes.txt"
+    path.write_text("Some text.", encoding="utf-8")
+    job = jobs.create("notes.txt", owner="alice")
+    assert jobs.has_pending(owner="alice")
+    assert not jobs.has_pending(owner="bob")
+    # Not started yet, so the wait times out with the job still queued
+    assert jobs.wait(job["job_id"], 0.01)["status"] == "queued"
+
+    worker = Thread(target=jobs.run, args=(job["job_id"], str(path), "alice"))
+    worker.start()
+    assert jobs.wait(job["job_id"], 5)["status"] == "done"
+    worker.join()
+    assert not jobs.has_pending(owner="alice")
+
+def test_sqlite_jobs_are_shared_between_workers(tmp_path):
+    db_file = str(tmp_path / "jobs.sqlite")
+    path = tmp_path / "notes.txt"
+    path.write_text("Some text.", encoding="utf-8")
+    worker_a = SqliteIngestionJobs(db_file, Chunker(whitespace_tokenizer, set()), lambda *args, **kwargs: None, {".txt"})
+    worker_b = SqliteIngestionJobs(db_file)
+    job = worker_a.create("notes.txt", owner="alice")
+    assert worker_b.get(job["job_id"])["status"] == "queued"
+    assert worker_b.has_pending(owner="alice")
+
+    worker_a.run(job["job_id"], str(path), "alice")
+    worker_a.update(job["job_id"], answer="Indexed.")
+
+    job = worker_b.get(job["job_id"])
+    assert job["status"] == "done" and job["answer"] == "Indexed."
+    assert not worker_b.has_pending(owner="alice")
+    # A job run by another worker is not waited on, its current status is returned
+    assert worker_b.wait(job["job_id"], 5)["status"] == "done"
@@ -0,0 +1,45 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+
+from intents import INTENT_EXAMPLES, IntentClassifier
+
+class KeywordEmbeddingModel:
+    """One dimension per intent, set when the text is one of that intent's examples"""
+    labels = list(INTENT_EXAMPLES)
+
+    def encode(self, texts, normalize_embeddings=True, convert_to_numpy=True):
+        single = isinstance(texts, str)
+        rows = np.full((1 if single else len(texts), len(self.labels)), 0.01, dtype="float32")
+        for row, text in enumerate([texts] if single else texts):
+            for column, intent in enumerate(self.labels):
+                if text in INTENT_EXAMPLES[intent]:
+                    rows[row, column] = 1.0
+        rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+        return rows[0] if single else rows
+
+class FakeGroq:
+    def __init__(self, result):
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self.result = result
+
+    def create(self, **kwargs):
+        self.calls += 1
+        message = SimpleNamespace(content=json.dumps(self.result))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+def test_confident_message_skips_the_llm():
+    client = FakeGroq([{"query": "", "intent": "non_coding"}])
+    classifier = IntentClassifier(client, KeywordEmbeddingModel())
+    assert classifier.detect("explain big O notation") == [{"query": "explain big O notation", "intent": "teaching"}]
+    assert classifier.get_stats()["fast_path"] == 1
+
+def test_multi_sentence_message_goes_to_the_llm():
+    result = [{"query": "hi", "intent": "greeting"}, {"query": "fix this error", "intent": "debug_help"}]
+    client = FakeGroq(result)
+    classifier = IntentClassifier(client, KeywordEmbeddingModel())
+    assert classifier.detect("hi. fix this error.") == result
+    assert client.calls == 1
+    assert classifier.get_stats()["llm"] == 1
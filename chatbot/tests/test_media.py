@@ -0,0 +1,34 @@
+import base64
+import io
+
+from PIL import Image
+
+from media import VISION_MAX_SIDE, encode_data_url, prepare_image, prepare_image_bytes
+
+def test_large_photo_is_downscaled_to_jpeg():
+    buffer = io.BytesIO()
+    noise = Image.effect_noise((3000, 2000), 64).convert("RGB")
+    noise.save(buffer, format="BMP")
+    size = buffer.tell()
+    buffer.seek(0)
+    stream, prepared_size, mime_type = prepare_image(buffer, size, "image/bmp")
+    assert prepared_size < size
+    assert stream.tell() == 0
+    image = Image.open(stream)
+    assert max(image.size) == VISION_MAX_SIDE
+    assert mime_type == "image/png"  # BMP is treated as a screenshot
+
+def test_undecodable_image_is_passed_through():
+    data = b"not an image"
+    assert prepare_image_bytes(data, "image/jpeg") == (data, "image/jpeg")
+
+def test_data_url_matches_plain_base64():
+    class ShortReads(io.BytesIO):
+        # Reads return fewer bytes than asked, so chunks are not multiples of 3
+        def read(self, n=-1):
+            return super().read(min(n, 1000) if n > 0 else n)
+
+    for length in (0, 1, 2, 3, 1001, 200_000):
+        data = bytes(range(256)) * (length // 256) + bytes(length % 256)
+        url = encode_data_url(ShortReads(data), len(data), "image/png")
+        assert url == "data:image/png;base64," + base64.b64encode(data).decode("ascii")
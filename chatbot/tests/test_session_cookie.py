@@ -0,0 +1,33 @@
+from flask import Flask, jsonify
+
+from session_cookie import SESSION_COOKIE_NAME, get_session_id, init_session_cookie
+
+def make_app():
+    app = Flask(__name__)
+    init_session_cookie(app)
+
+    @app.route("/api/chat", methods=["POST"])
+    def chat():
+        return jsonify({"session_id": get_session_id()})
+
+    return app
+
+def test_session_id_persists_across_requests():
+    client = make_app().test_client()
+    first = client.post("/api/chat", base_url="https://127.0.0.1:8000")
+    cookie = first.headers["Set-Cookie"]
+    assert "SameSite=None" in cookie
+    assert "Secure" in cookie
+    assert "HttpOnly" in cookie
+
+    second = client.post("/api/chat", base_url="https://127.0.0.1:8000")
+    assert second.get_json()["session_id"] == first.get_json()["session_id"]
+    assert "Set-Cookie" not in second.headers
+    assert client.get_cookie(SESSION_COOKIE_NAME, domain="127.0.0.1").value == first.get_json()["session_id"]
+
+def test_malformed_cookie_gets_a_fresh_session():
+    client = make_app().test_client()
+    client.set_cookie(SESSION_COOKIE_NAME, "../../etc/passwd", domain="127.0.0.1")
+    response = client.post("/api/chat", base_url="https://127.0.0.1:8000")
+    assert response.get_json()["session_id"] != "../../etc/passwd"
+    assert SESSION_COOKIE_NAME in response.headers["Set-Cookie"]
@@ -0,0 +1,35 @@
+from session_store import SessionStore, SqliteSessionStore
+
+def test_least_recently_used_session_is_evicted_past_the_cap():
+    evicted = []
+    store = SessionStore(max_sessions=2, max_bytes=10**9, ttl=3600, on_evict=evicted.append)
+    for session_id in ("a", "b"):
+        with store.use(session_id) as history:
+            history.add_user_message(f"hello from {session_id}")
+    store.get("a")
+    store.get("c")
+
+    assert evicted == ["b"]
+    assert store.peek("b") is None
+    assert store.get_stats()["sessions"] == 2
+
+def test_sessions_in_use_are_not_evicted():
+    store = SessionStore(max_sessions=1, max_bytes=10**9, ttl=3600)
+    with store.use("a") as history:
+        history.add_user_message("still answering")
+        store.get("b")
+        assert store.peek("a") is not None
+
+def test_sqlite_store_shares_histories_and_summaries(tmp_path):
+    path = str(tmp_path / "sessions.sqlite")
+    writer = SqliteSessionStore(path, max_sessions=10, max_bytes=10**9, ttl=3600)
+    with writer.use("a") as history:
+        history.add_user_message("hi")
+        history.add_ai_message("hello")
+    writer.save_summary("a", "greeted", 2)
+
+    reader = SqliteSessionStore(path, max_sessions=10, max_bytes=10**9, ttl=3600)
+    assert [message.content for message in reader.peek("a").messages] == ["hi", "hello"]
+    assert reader.load_summary("a") == ("greeted", 2)
+    reader.pop("a")
+    assert writer.peek("a") is None
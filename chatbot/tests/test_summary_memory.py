@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+from session_store import SessionStore
+from summary_memory import SummaryMemory
+
+class FakeGroq:
+    def __init__(self):
+        self.prompts = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.prompts.append(kwargs["messages"][-1]["content"])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="earlier turns"))])
+
+def test_old_turns_are_replaced_by_the_running_summary():
+    store = SessionStore(max_sessions=10, max_bytes=10**9, ttl=3600)
+    client = FakeGroq()
+    memory = SummaryMemory(client, store, token_budget=30)
+    history = store.get("a")
+    for turn in range(4):
+        history.add_user_message(f"question {turn} " + "x" * 40)
+        history.add_ai_message(f"answer {turn}")
+
+    recent = memory.get_prompt_history("a")
+    assert [message.content for message in recent][-1] == "answer 3"
+    memory.executor.shutdown(wait=True)
+    assert "question 0" in client.prompts[0]
+
+    messages = memory.get_prompt_history("a")
+    assert messages[0].content == "Summary of the earlier conversation:\nearlier turns"
+    assert messages[1:] == recent
+
+def test_evicted_sessions_lose_their_summary():
+    store = SessionStore(max_sessions=1, max_bytes=10**9, ttl=3600)
+    memory = SummaryMemory(FakeGroq(), store)
+    memory.get_prompt_history("a")
+    store.get("b")
+    assert "a" not in memory.summaries